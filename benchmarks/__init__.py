@@ -0,0 +1 @@
+from .synthetic import cell_points, synthetic_frame, write_dataset
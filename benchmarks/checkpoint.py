@@ -0,0 +1,150 @@
+from pathlib import Path
+from time import perf_counter
+import argparse
+import json
+import numpy as np
+import torch
+import torch.nn as nn
+from torch import optim
+from networks import UNet, CHECKPOINTS
+from utils import SavedTensorMeter
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(
+        description="Peak memory against step time of the training checkpoint modes"
+    )
+    parser.add_argument(
+        "-c",
+        "--crop_sizes",
+        dest="crop_sizes",
+        help="sides of the square training crops",
+        nargs="+",
+        default=[256, 512],
+        type=int,
+    )
+    parser.add_argument(
+        "-b", "--batch_size", dest="batch_size", help="batch_size", default=16, type=int
+    )
+    parser.add_argument(
+        "--checkpoints",
+        dest="checkpoints",
+        help="checkpoint modes compared",
+        nargs="+",
+        choices=CHECKPOINTS,
+        default=list(CHECKPOINTS),
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "-r", "--repeat", dest="repeat", help="timed steps per case", default=3, type=int
+    )
+    parser.add_argument(
+        "-g", "--gpu", dest="gpu", help="whether use CUDA", action="store_true"
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="json file of the results",
+        default="./output/checkpoint.json",
+        type=str,
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def train_step(net, optimizer, imgs, targets):
+    masks_pred = net(imgs)
+    loss = nn.functional.mse_loss(masks_pred.view(-1), targets.view(-1))
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+
+
+def measure(args, checkpoint, crop_size):
+    """
+    :return: median seconds of a training step, MB autograd keeps for the backward
+        pass, peak MB allocated on the GPU (None on CPU)
+    """
+    torch.manual_seed(0)
+    net = UNet(
+        n_channels=1,
+        n_classes=1,
+        width=args.width,
+        depth=args.depth,
+        checkpoint=checkpoint,
+    )
+    device = "cuda" if args.gpu else "cpu"
+    net.to(device).train()
+    optimizer = optim.Adam(net.parameters(), lr=1e-3)
+    imgs = torch.rand(args.batch_size, 1, crop_size, crop_size, device=device)
+    targets = torch.rand_like(imgs)
+
+    # warm-up, also allocates the optimizer state
+    train_step(net, optimizer, imgs, targets)
+    with SavedTensorMeter(list(net.parameters()) + list(net.buffers())) as meter:
+        masks_pred = net(imgs)
+    del masks_pred
+
+    if args.gpu:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    times = []
+    for _ in range(args.repeat):
+        start = perf_counter()
+        train_step(net, optimizer, imgs, targets)
+        if args.gpu:
+            torch.cuda.synchronize()
+        times.append(perf_counter() - start)
+    peak = torch.cuda.max_memory_allocated() / 2 ** 20 if args.gpu else None
+    return float(np.median(times)), meter.nbytes / 2 ** 20, peak
+
+
+def compare(args):
+    cases = []
+    for crop_size in args.crop_sizes:
+        base = None
+        for checkpoint in args.checkpoints:
+            seconds, saved, peak = measure(args, checkpoint, crop_size)
+            base = seconds if base is None else base
+            case = {
+                "crop size": crop_size,
+                "batch size": args.batch_size,
+                "checkpoint": checkpoint,
+                "step s": seconds,
+                "step ratio": seconds / base,
+                "saved MB": saved,
+                "peak MB": peak,
+            }
+            print(
+                "{:5d} x{:3d} {:8s} step {:7.3f} s ({:4.2f}x)  saved {:8.1f} MB{}".format(
+                    crop_size,
+                    args.batch_size,
+                    checkpoint,
+                    seconds,
+                    seconds / base,
+                    saved,
+                    "" if peak is None else "  peak {:8.1f} MB".format(peak),
+                )
+            )
+            cases.append(case)
+    return {"args": vars(args), "cases": cases}
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    result = compare(args)
+    output_path = Path(args.output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open(mode="w") as f:
+        json.dump(result, f, indent=2)
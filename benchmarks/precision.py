@@ -0,0 +1,216 @@
+from argparse import Namespace
+from pathlib import Path
+from time import perf_counter
+import argparse
+import json
+import sys
+import tempfile
+import numpy as np
+import torch
+from networks import load_model, keep_fp32
+from propagation.gen_guided_model import GuidedModel
+from detection_predict import Predict
+from utils import (
+    open_frames,
+    local_maxima,
+    target_peaks_gen,
+    match_points,
+    count_tp_fp_fn,
+    SavedTensorMeter,
+)
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(
+        description="Compare a reduced precision run with fp32"
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        dest="input_path",
+        help="dataset with <input>/ori and <input>/gt as detection_predict.py reads it",
+        default="./image/test",
+        type=str,
+    )
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="load weight path",
+        default="./weight/best.pth",
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "-p",
+        "--precision",
+        dest="precision",
+        help="precision compared with fp32",
+        choices=["bf16", "fp16"],
+        default="bf16",
+    )
+    parser.add_argument(
+        "-n", "--frames", dest="frames", help="max frames compared", default=8, type=int
+    )
+    parser.add_argument(
+        "--propagate",
+        dest="propagate",
+        help="frames whose guided backpropagation is also compared",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="json file of the comparison",
+        default="./output/precision.json",
+        type=str,
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def f_measure(tp, fp, fn):
+    if tp == 0:
+        return 0.0
+    recall = tp / (tp + fn)
+    precision = tp / (tp + fp)
+    return 2 * recall * precision / (recall + precision)
+
+
+def mask_iou(a, b):
+    union = (a | b).sum()
+    return (a & b).sum() / union if union else 1.0
+
+
+def guided(net, img, precision, peaks=None):
+    """
+    :return: peaks, responses of the cells, bytes kept for the backward passes,
+        seconds of the backward passes
+    """
+    model = GuidedModel(net)
+    model.precision = precision
+    model.inference()
+    x = torch.from_numpy(img.astype(np.float32) / img.max())[None, None]
+    x.requires_grad_()
+    with SavedTensorMeter(list(net.parameters()) + list(net.buffers())) as meter:
+        class_response_maps, _, detected = model.detect(x)
+    peaks = detected if peaks is None else peaks
+    region = model.assign_region(peaks)
+    ids = list(range(1, len(peaks) + 1))
+    start = perf_counter()
+    results = model.propagate(x, class_response_maps, region, ids)
+    seconds = perf_counter() - start
+    model.train(False)
+    return peaks, [results[i] for i in ids], meter.nbytes, seconds
+
+
+def compare(args):
+    net = load_model(args.weight_path, width=args.width, depth=args.depth).eval()
+    keep_fp32(net)
+    ori_frames = open_frames(Path(args.input_path, "ori"), "*.tif", flags=0)
+    gt_frames = open_frames(Path(args.input_path, "gt"), "*.tif", flags=0)
+    n = min(len(ori_frames), len(gt_frames), args.frames)
+
+    counts = {"fp32": np.zeros(3, int), args.precision: np.zeros(3, int)}
+    frames = []
+    with tempfile.TemporaryDirectory() as tmp:
+        predicts = {
+            precision: Predict(
+                Namespace(
+                    net=net,
+                    gpu=False,
+                    input_path=None,
+                    output_path=Path(tmp, precision),
+                    precision=precision,
+                )
+            )
+            for precision in counts
+        }
+        for i in range(n):
+            ori = ori_frames[i][:512, :512]
+            target = target_peaks_gen(gt_frames[i][:512, :512].astype(np.uint8))
+            responses, peaks, times = {}, {}, {}
+            for precision, predict in predicts.items():
+                start = perf_counter()
+                responses[precision] = predict.pred(ori)
+                times[precision] = perf_counter() - start
+                peaks[precision] = local_maxima(responses[precision], 100, 2)
+                associate_id = match_points(target, peaks[precision], 10)
+                counts[precision] += count_tp_fp_fn(
+                    target, peaks[precision], associate_id, ori.shape
+                )
+            diff = np.abs(
+                responses["fp32"].astype(int) - responses[args.precision].astype(int)
+            )
+            same = len(match_points(peaks["fp32"], peaks[args.precision], 2))
+            frame = {
+                "frame": i,
+                "response max abs": int(diff.max()),
+                "response mean abs": float(diff.mean()),
+                "peaks fp32": len(peaks["fp32"]),
+                "peaks " + args.precision: len(peaks[args.precision]),
+                "peaks within 2 px": same,
+                "detect s fp32": times["fp32"],
+                "detect s " + args.precision: times[args.precision],
+            }
+
+            if i < args.propagate:
+                # the same peaks for both, so the responses of each cell compare
+                peaks_32, gbs_32, bytes_32, s_32 = guided(net, ori, "fp32")
+                _, gbs_low, bytes_low, s_low = guided(net, ori, args.precision, peaks_32)
+                errors = [
+                    np.abs(a - b).sum() / max(np.abs(a).sum(), 1e-12)
+                    for a, b in zip(gbs_32, gbs_low)
+                ]
+                # support of each cell, its response above a tenth of its max
+                ious = [
+                    mask_iou(a > 0.1 * a.max(), b > 0.1 * b.max())
+                    for a, b in zip(gbs_32, gbs_low)
+                ]
+                frame.update(
+                    {
+                        "cell response rel error median": float(np.median(errors))
+                        if errors
+                        else 0.0,
+                        "cell response rel error max": float(np.max(errors))
+                        if errors
+                        else 0.0,
+                        "cell mask iou median": float(np.median(ious)) if ious else 1.0,
+                        "cell mask iou min": float(np.min(ious)) if ious else 1.0,
+                        "saved MB fp32": bytes_32 / 2 ** 20,
+                        "saved MB " + args.precision: bytes_low / 2 ** 20,
+                        "backward s fp32": s_32,
+                        "backward s " + args.precision: s_low,
+                    }
+                )
+            print(", ".join("{}: {}".format(k, v) for k, v in frame.items()))
+            frames.append(frame)
+
+    summary = {
+        "f-measure " + precision: f_measure(*count) for precision, count in counts.items()
+    }
+    print(", ".join("{}: {:.4f}".format(k, v) for k, v in summary.items()))
+    return {"args": vars(args), "frames": frames, "summary": summary}
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    result = compare(args)
+    output_path = Path(args.output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open(mode="w") as f:
+        json.dump(result, f, indent=2)
+    values = list(result["summary"].values())
+    # a precision that loses cells fails
+    sys.exit(1 if values[1] < values[0] - 0.01 else 0)
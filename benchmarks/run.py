@@ -0,0 +1,323 @@
+from argparse import Namespace
+from collections import OrderedDict
+from pathlib import Path
+from time import perf_counter
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import torch
+from networks import UNet, load_model
+from propagation.gen_guided_model import GuidedModel
+from utils import local_maxima, optimum, gaus_filter, stamp, EvaluationMethods
+from likelymapgen import like_map_gen
+from detection_predict import Predict
+from .synthetic import write_dataset
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(description="Benchmark on synthetic data")
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="json file of the results",
+        default="./output/benchmark.json",
+        type=str,
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        dest="baseline",
+        help="json file of a previous run to compare with",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        dest="sizes",
+        help="square frame sizes",
+        nargs="+",
+        default=[256, 512],
+        type=int,
+    )
+    parser.add_argument(
+        "-d",
+        "--densities",
+        dest="densities",
+        help="cells per 100x100 pixels",
+        nargs="+",
+        default=[1.0],
+        type=float,
+    )
+    parser.add_argument(
+        "-r", "--repeat", dest="repeat", help="timed runs per case", default=3, type=int
+    )
+    parser.add_argument(
+        "--only",
+        dest="only",
+        help="names of the benchmarks to run",
+        nargs="+",
+        default=None,
+    )
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="weights of the UNet, a seeded random network by default",
+        default=None,
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        help="exit with 1 when a median is slower than the baseline by this ratio",
+        default=None,
+        type=float,
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+class PointGuidedModel(GuidedModel):
+    """propagates from the synthetic cells, a random network does not find them"""
+
+    def __init__(self, net, points):
+        super().__init__(net)
+        self.points = points
+
+    def detect(self, img):
+        class_response_maps, pre_img, _ = super().detect(img)
+        return class_response_maps, pre_img, self.points
+
+
+def bench_like_map_gen(case):
+    frame = case.frames[0]
+    path = case.tmp.joinpath("cell_position.txt")
+    # like_map_gen stops before the last frame index, one dummy row follows the frame
+    rows = [[0, x, y] for x, y in frame["points"]] + [[1, 0, 0]]
+    np.savetxt(str(path), rows, fmt="%d", delimiter=",", header=" frame, x, y")
+    args = Namespace(
+        input_path=path,
+        output_path=case.tmp.joinpath("likelihood"),
+        width=case.size,
+        height=case.size,
+        g_size=12,
+        batch=16,
+    )
+    return lambda: like_map_gen(args)
+
+
+def bench_local_maxima(case):
+    likelihood = case.frames[0]["likelihood"]
+    return lambda: local_maxima(likelihood, 100, 2)
+
+
+def bench_optimum(case):
+    points = case.frames[0]["points"].astype(float)
+    rng = np.random.default_rng(0)
+    # a detection with jitter, 10% missed cells and 10% false positives
+    keep = rng.random(len(points)) > 0.1
+    pred = points[keep] + rng.normal(0, 2, (keep.sum(), 2))
+    extra = rng.uniform(0, case.size, (len(points) // 10, 2))
+    pred = np.concatenate([pred, extra])
+    return lambda: optimum(points, pred, 10)
+
+
+def bench_gaus_filter(case):
+    dot = np.zeros((case.size, case.size))
+    dot[case.size // 2, case.size // 2] = 255
+    return lambda: gaus_filter(dot, 401, 12)
+
+
+def bench_stamp(case):
+    points = case.frames[0]["points"]
+    return lambda: stamp(points, (case.size, case.size), 12, ksize=401)
+
+
+def bench_assign_region(case):
+    model = GuidedModel(case.net)
+    model.shape = (case.size, case.size)
+    points = case.frames[0]["points"]
+    return lambda: model.assign_region(points)
+
+
+def bench_predict(case):
+    args = Namespace(
+        net=case.net,
+        gpu=False,
+        input_path=case.root.joinpath("ori"),
+        output_path=case.tmp.joinpath("detection"),
+    )
+    predict = Predict(args)
+    return predict.main
+
+
+def bench_guided_forward(case):
+    frame = case.frames[0]
+    if case.trained:
+        model = GuidedModel(case.net)
+    else:
+        model = PointGuidedModel(case.net, frame["points"])
+    model.inference()
+    img = frame["img"].astype(np.float32) / frame["img"].max()
+    img = torch.from_numpy(img[np.newaxis, np.newaxis])
+    root_path = case.tmp.joinpath("guided")
+    root_path.mkdir(parents=True, exist_ok=True)
+    return lambda: model(img.clone(), root_path)
+
+
+def bench_update_evaluation(case):
+    target = case.frames[0]["label"]
+    # a segmentation shifted by two pixels with every tenth cell missed
+    pred = np.roll(target, 2, axis=1)
+    pred[np.isin(pred, np.arange(1, pred.max() + 1, 10))] = 0
+    evaluation = EvaluationMethods([], [], case.tmp.joinpath("evaluation"))
+    return lambda: evaluation.update_evaluation(pred.copy(), target.copy(), False)
+
+
+BENCHMARKS = OrderedDict(
+    [
+        ("like_map_gen", bench_like_map_gen),
+        ("local_maxima", bench_local_maxima),
+        ("optimum", bench_optimum),
+        ("gaus_filter", bench_gaus_filter),
+        ("stamp", bench_stamp),
+        ("GuidedModel.assign_region", bench_assign_region),
+        ("Predict.main", bench_predict),
+        ("GuidedModel.forward", bench_guided_forward),
+        ("EvaluationMethods.update_evaluation", bench_update_evaluation),
+    ]
+)
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return times
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "threads": torch.get_num_threads(),
+    }
+
+
+def run(args):
+    torch.manual_seed(0)
+    if args.weight_path is None:
+        net = UNet(n_channels=1, n_classes=1, width=args.width, depth=args.depth)
+    else:
+        net = load_model(args.weight_path, width=args.width, depth=args.depth)
+    net.eval()
+
+    names = args.only if args.only is not None else list(BENCHMARKS)
+    results = []
+    for size in args.sizes:
+        for density in args.densities:
+            with tempfile.TemporaryDirectory() as tmp:
+                tmp = Path(tmp)
+                case = Namespace(
+                    size=size,
+                    density=density,
+                    net=net,
+                    trained=args.weight_path is not None,
+                    root=tmp.joinpath("data"),
+                    tmp=tmp,
+                )
+                case.frames = write_dataset(case.root, 1, (size, size), density)
+                for name in names:
+                    fn = BENCHMARKS[name](case)
+                    # first call warms up caches and lazy initialisation
+                    fn()
+                    times = measure(fn, args.repeat)
+                    result = {
+                        "name": name,
+                        "size": size,
+                        "density": density,
+                        "cells": len(case.frames[0]["points"]),
+                        "times": times,
+                        "median": float(np.median(times)),
+                        "min": float(np.min(times)),
+                    }
+                    print(
+                        "{:<36} {:>5}px {:>4} cells {:>10.2f} ms".format(
+                            name, size, result["cells"], result["median"] * 1000
+                        )
+                    )
+                    results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance=None):
+    """
+    :return: text of the comparison, whether a case is slower than tolerance allows
+    """
+    base = {
+        (r["name"], r["size"], r["density"]): r["median"] for r in baseline["results"]
+    }
+    text = "{:<36} {:>6} {:>7} {:>12} {:>12} {:>7}\n".format(
+        "name", "size", "density", "base [ms]", "now [ms]", "ratio"
+    )
+    slower = False
+    for r in results:
+        key = (r["name"], r["size"], r["density"])
+        if key not in base:
+            continue
+        ratio = r["median"] / base[key]
+        text += "{:<36} {:>6} {:>7} {:>12.2f} {:>12.2f} {:>7.2f}\n".format(
+            r["name"], r["size"], r["density"], base[key] * 1000, r["median"] * 1000, ratio
+        )
+        if tolerance is not None and ratio > 1 + tolerance:
+            slower = True
+    return text, slower
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    results = run(args)
+    output_path = Path(args.output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open(mode="w") as f:
+        json.dump(
+            {"environment": environment(), "args": vars(args), "results": results},
+            f,
+            indent=2,
+        )
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        text, slower = compare(results, baseline, args.tolerance)
+        print(text)
+        if slower:
+            sys.exit(1)
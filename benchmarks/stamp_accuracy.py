@@ -0,0 +1,134 @@
+import argparse
+import sys
+import numpy as np
+import cv2
+from utils import stamp, stamp_labels, stamp_batch
+from .synthetic import cell_points
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(
+        description="Compare utils.stamp with the per-point gaus_filter it replaces"
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        dest="sizes",
+        help="square frame sizes",
+        nargs="+",
+        default=[128, 512],
+        type=int,
+    )
+    parser.add_argument(
+        "-d",
+        "--densities",
+        dest="densities",
+        help="cells per 100x100 pixels",
+        nargs="+",
+        default=[0.5, 2.0],
+        type=float,
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def gaus_filter_padded(img, kernel_size, sigma):
+    # gaus_filter before the padding fix, padded by the full kernel size
+    pad_size = int(kernel_size - 1 / 2)
+    img_t = np.pad(img, (pad_size, pad_size), "constant")
+    img_t = cv2.GaussianBlur(img_t, ksize=(kernel_size, kernel_size), sigmaX=sigma)
+    return img_t[pad_size:-pad_size, pad_size:-pad_size]
+
+
+def point_maps(points, shape, kernel_size, sigma):
+    maps = []
+    for x, y in points:
+        img = np.zeros(shape)
+        img[int(y), int(x)] = 255
+        maps.append(gaus_filter_padded(img, kernel_size, sigma))
+    return np.array(maps)
+
+
+def label_differ(maps, reference, label):
+    """
+    pixels labelled differently, leaving out ties of equally distant points which the
+    last bit of the blur decides
+    """
+    differ = np.flatnonzero(label.ravel() != reference.ravel())
+    # label 0 is background with value 0
+    maps = np.concatenate([np.zeros((1,) + maps.shape[1:]), maps])
+    maps = maps.reshape(len(maps), -1)
+    ties = np.isclose(
+        maps[reference.ravel()[differ], differ], maps[label.ravel()[differ], differ]
+    )
+    return int((~ties).sum()), int(ties.sum())
+
+
+def check_case(size, density, seed=0):
+    """
+    :return: dict of the differences of each caller
+    """
+    shape = (size, size)
+    rng = np.random.default_rng(seed)
+    points = cell_points(shape, density, rng)
+
+    # like_map_gen: max of 301 kernels of sigma 12, normalized to uint8
+    maps = point_maps(points, shape, 301, 12)
+    reference = maps.max(axis=0)
+    result = stamp(points, shape, 12, ksize=301)
+    ref_u8 = (255 * reference / reference.max()).astype("uint8")
+    res_u8 = (255 * result / result.max()).astype("uint8")
+    batch = stamp_batch([points, points[::-1]], shape, 12, ksize=301)
+
+    # GuidedModel.assign_region: argmax of 401 kernels of sigma 12, 0 below 0.01
+    maps_region = point_maps(points, shape, 401, 12)
+    region = maps_region.argmax(axis=0) + 1
+    region[maps_region.max(axis=0) < 0.01] = 0
+    label, _ = stamp_labels(points, shape, 12, 401, thresh=0.01)
+
+    # UseMethods.noize_off: argmax of 201 kernels of sigma 9
+    maps_index = point_maps(points[:4], shape, 201, 9)
+    index = maps_index.argmax(axis=0)
+    index_mask, _ = stamp_labels(points[:4], shape, 9, 201, truncate=None)
+
+    region_differ, region_ties = label_differ(maps_region, region, label)
+    index_differ, index_ties = label_differ(
+        maps_index, index + 1, np.maximum(index_mask - 1, 0) + 1
+    )
+    return {
+        "size": size,
+        "density": density,
+        "cells": len(points),
+        "like_map_gen max abs": float(np.abs(result - reference).max()),
+        "like_map_gen uint8 differ": int((res_u8 != ref_u8).sum()),
+        "stamp_batch max abs": float(np.abs(batch - result).max()),
+        "assign_region differ": region_differ,
+        "assign_region ties": region_ties,
+        "noize_off differ": index_differ,
+        "noize_off ties": index_ties,
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    failed = False
+    for size in args.sizes:
+        for density in args.densities:
+            result = check_case(size, density)
+            print(", ".join("{}: {}".format(k, v) for k, v in result.items()))
+            # the kernel is cut at 4 sigma, far below one gray level
+            failed |= result["like_map_gen max abs"] > 1e-3
+            failed |= any(
+                result[key] > 0
+                for key in (
+                    "like_map_gen uint8 differ",
+                    "assign_region differ",
+                    "noize_off differ",
+                )
+            )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,98 @@
+from pathlib import Path
+import numpy as np
+import cv2
+
+
+def cell_points(size, density, rng, min_dist=None):
+    """
+    random cell centers kept apart by min_dist
+    :param size: (height, width)
+    :param density: cells per 100x100 pixels
+    :return: points [x, y]
+    """
+    h, w = size
+    n = int(round(density * h * w / 1e4))
+    if min_dist is None:
+        # loose packing, about half of the area of a hexagonal packing
+        min_dist = 0.7 * np.sqrt(h * w / max(n, 1))
+    points = np.zeros((0, 2), dtype=int)
+    for _ in range(50):
+        candidates = np.stack(
+            [rng.integers(8, w - 8, 4 * n), rng.integers(8, h - 8, 4 * n)], axis=1
+        )
+        for candidate in candidates:
+            if len(points) >= n:
+                return points
+            if len(points) == 0 or (
+                np.hypot(*(points - candidate).T).min() > min_dist
+            ):
+                points = np.append(points, candidate[np.newaxis], axis=0)
+    return points
+
+
+def synthetic_frame(size=(512, 512), density=1.0, sigma=6, seed=0):
+    """
+    phase-contrast like frame of bright elliptic cells on a noisy background
+    :return: dict of
+             img: uint8 image
+             points: cell centers [x, y]
+             likelihood: uint8 likelihood map, a gaussian at each cell
+             label: instance label image, cell i is label i + 1
+    """
+    rng = np.random.default_rng(seed)
+    h, w = size
+    points = cell_points(size, density, rng)
+    spacing = np.sqrt(h * w / max(len(points), 1))
+    radius = int(np.clip(spacing / 4, 4, 12))
+
+    img = np.full((h, w), 30, np.float32)
+    label = np.zeros((h, w), np.int32)
+    for i, (x, y) in enumerate(points):
+        axes = tuple(int(a) for a in rng.integers(radius * 2 // 3, radius + 1, 2))
+        angle = float(rng.integers(0, 180))
+        cv2.ellipse(img, (int(x), int(y)), axes, angle, 0, 360, 180, -1)
+        cv2.ellipse(label, (int(x), int(y)), axes, angle, 0, 360, i + 1, -1)
+    img = cv2.GaussianBlur(img, (5, 5), 1.5) + rng.normal(0, 8, img.shape)
+    img = img.clip(0, 255).astype(np.uint8)
+
+    # cells are apart, the sum of the gaussians is close to their max
+    likelihood = np.zeros((h, w), np.float32)
+    likelihood[points[:, 1], points[:, 0]] = 255
+    likelihood = cv2.GaussianBlur(likelihood, (0, 0), sigma)
+    if likelihood.max() > 0:
+        likelihood = likelihood / likelihood.max() * 255
+    return {
+        "img": img,
+        "points": points,
+        "likelihood": likelihood.astype(np.uint8),
+        "label": label,
+    }
+
+
+def write_dataset(root, n_frames=4, size=(512, 512), density=1.0, seed=0):
+    """
+    <root>/ori/*.tif, <root>/gt/*.tif point images as detection_predict.py reads them
+    and <root>/cell_position.txt as likelymapgen.py reads it
+    :return: list of frames
+    """
+    root = Path(root)
+    root.joinpath("ori").mkdir(parents=True, exist_ok=True)
+    root.joinpath("gt").mkdir(parents=True, exist_ok=True)
+    frames = []
+    rows = []
+    for i in range(n_frames):
+        frame = synthetic_frame(size, density, seed=seed + i)
+        points = np.zeros(size, np.uint8)
+        points[frame["points"][:, 1], frame["points"][:, 0]] = 255
+        cv2.imwrite(str(root.joinpath("ori", "{:05d}.tif".format(i))), frame["img"])
+        cv2.imwrite(str(root.joinpath("gt", "{:05d}.tif".format(i))), points)
+        rows.extend([i, x, y] for x, y in frame["points"])
+        frames.append(frame)
+    np.savetxt(
+        str(root.joinpath("cell_position.txt")),
+        np.array(rows).reshape(-1, 3),
+        fmt="%03d",
+        delimiter=",",
+        header=" frame, x, y",
+    )
+    return frames
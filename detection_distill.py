@@ -0,0 +1,221 @@
+from time import perf_counter
+from pathlib import Path
+import argparse
+import cv2
+import torch
+from networks import UNet
+from detection_train import TrainNet
+from detection_predict import PredictFmeasure
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(description="Distill a slim UNet from best.pth")
+    parser.add_argument(
+        "-t",
+        "--train_path",
+        dest="train_path",
+        help="training dataset's path",
+        default="./image/train",
+        type=str,
+    )
+    parser.add_argument(
+        "-v",
+        "--val_path",
+        dest="val_path",
+        help="validation data path",
+        default="./image/val",
+        type=str,
+    )
+    parser.add_argument(
+        "-i",
+        "--test_path",
+        dest="test_path",
+        help="test data path used for the comparison table",
+        default="./image/test",
+        type=str,
+    )
+    parser.add_argument(
+        "-tw",
+        "--teacher_path",
+        dest="teacher_path",
+        help="weight of the full model",
+        default="./weight/best.pth",
+    )
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="save weight path of the student",
+        default="./weight/student/best.pth",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="output path of the comparison",
+        default="./output/distill",
+        type=str,
+    )
+    parser.add_argument(
+        "-g", "--gpu", dest="gpu", help="whether use CUDA", action="store_true"
+    )
+    parser.add_argument(
+        "-b", "--batch_size", dest="batch_size", help="batch_size", default=16, type=int
+    )
+    parser.add_argument(
+        "-e", "--epochs", dest="epochs", help="epochs", default=500, type=int
+    )
+    parser.add_argument(
+        "-l",
+        "--learning_rate",
+        dest="learning_rate",
+        help="learning late",
+        default=1e-3,
+        type=float,
+    )
+    parser.add_argument(
+        "-a",
+        "--alpha",
+        dest="alpha",
+        help="weight of the teacher likelihood map in the target (1: teacher only)",
+        default=1.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--width", dest="width", help="student first stage channels", default=16, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="student number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="student uses depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compare_only",
+        dest="compare_only",
+        help="skip training and only write the comparison table",
+        action="store_true",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+class DistillNet(TrainNet):
+    """train the student against the likelihood map of the teacher"""
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.teacher = args.teacher
+        self.teacher.eval()
+        self.alpha = args.alpha
+
+    def make_target(self, imgs, true_masks):
+        with torch.no_grad():
+            teacher_masks = self.teacher(imgs)
+        return self.alpha * teacher_masks + (1 - self.alpha) * true_masks
+
+    def show_graph(self):
+        pass
+
+
+def count_params(net):
+    return sum(p.numel() for p in net.parameters())
+
+
+def latency(net, shape, gpu, repeat=20):
+    net.eval()
+    img = torch.rand((1, 1) + tuple(shape))
+    if gpu:
+        img = img.cuda()
+    with torch.no_grad():
+        # warm up
+        net(img)
+        if gpu:
+            torch.cuda.synchronize()
+        start = perf_counter()
+        for _ in range(repeat):
+            net(img)
+        if gpu:
+            torch.cuda.synchronize()
+    return (perf_counter() - start) / repeat * 1000
+
+
+def compare(models, args):
+    """
+    F-measure and latency of each model on the test set
+    :param models: list of (name, net)
+    :return: table text
+    """
+    args.input_path = args.test_path
+    ori_path = sorted(args.test_path.joinpath("ori").glob("*.tif"))
+    shape = cv2.imread(str(ori_path[0]), 0)[:512, :512].shape if ori_path else (512, 512)
+
+    rows = []
+    for name, net in models:
+        args.net = net
+        args.output_path = args.save_path.joinpath(name)
+        pred = PredictFmeasure(args)
+        precision, recall, f_measure = pred.main()
+        rows.append(
+            [
+                name,
+                net.width,
+                net.depth,
+                net.separable,
+                count_params(net),
+                latency(net, shape, args.gpu),
+                precision,
+                recall,
+                f_measure,
+            ]
+        )
+
+    base = rows[0][5]
+    text = "model,width,depth,separable,params,latency[ms],speedup,precision,recall,f-measure\n"
+    for row in rows:
+        text += "{},{},{},{},{},{:.2f},{:.2f},{:.4f},{:.4f},{:.4f}\n".format(
+            *row[:6], base / row[5], *row[6:]
+        )
+    print(text)
+    with args.save_path.joinpath("model_comparison.txt").open(mode="w") as f:
+        f.write(text)
+    return text
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    args.train_path = [Path(args.train_path)]
+    args.val_path = [Path(args.val_path)]
+    args.test_path = Path(args.test_path)
+    args.weight_path = Path(args.weight_path)
+    args.save_path = Path(args.output_path)
+
+    teacher = UNet(n_channels=1, n_classes=1)
+    teacher.load_state_dict(torch.load(args.teacher_path, map_location="cpu"))
+    student = UNet(
+        n_channels=1,
+        n_classes=1,
+        width=args.width,
+        depth=args.depth,
+        separable=args.separable,
+    )
+    if args.gpu:
+        teacher.cuda()
+        student.cuda()
+
+    if not args.compare_only:
+        args.teacher = teacher
+        args.net = student
+        train = DistillNet(args)
+        train.main()
+
+    student.load_state_dict(torch.load(str(args.weight_path), map_location="cpu"))
+    compare([("teacher", teacher), ("student", student)], args)
@@ -0,0 +1,141 @@
+from pathlib import Path
+import argparse
+from utils import open_frames, target_peaks_gen
+from utils import peak_candidates, match_points, count_tp_fp_fn
+from utils import METRICS, StageMetrics, EvaluationMetrics, start_exporters
+from time import perf_counter
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(
+        description="F-measure of saved detection responses, without the network"
+    )
+    parser.add_argument(
+        "-p",
+        "--pred_path",
+        dest="pred_path",
+        help="responses written by detection_predict.py (*.tif or a stack)",
+        default="./output/detection/pred",
+        type=str,
+    )
+    parser.add_argument(
+        "-t",
+        "--gt_path",
+        dest="gt_path",
+        help="point annotations, 255 at each cell (*.tif or a stack)",
+        default="./image/test/gt",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="text file the precision, recall and f-measure are appended to",
+        default="./output/detection/f-measure.txt",
+        type=str,
+    )
+    parser.add_argument(
+        "--peak_thresh",
+        dest="peak_thresh",
+        help="min response of a detected peak",
+        default=100,
+        type=int,
+    )
+    parser.add_argument(
+        "--dist_peak",
+        dest="dist_peak",
+        help="min distance between peaks",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "--dist_threshold",
+        dest="dist_threshold",
+        help="max distance of a matched pair",
+        default=10,
+        type=float,
+    )
+    parser.add_argument(
+        "--metrics_port",
+        dest="metrics_port",
+        help="serve the metrics in Prometheus text format on this port",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--metrics_path",
+        dest="metrics_path",
+        help="json snapshot of the metrics, rewritten every --metrics_interval seconds",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        dest="metrics_interval",
+        help="seconds between the json snapshots",
+        default=10,
+        type=float,
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def evaluate(args):
+    """
+    the counts of PredictFmeasure with the matching of utils.sweep
+    :return: precision, recall, f-measure
+    """
+    pred_frames = open_frames(Path(args.pred_path), "*.tif", flags=0)
+    gt_frames = open_frames(Path(args.gt_path), "*.tif", flags=0)
+    n = min(len(pred_frames), len(gt_frames))
+    metrics = StageMetrics(METRICS, "evaluate")
+    evaluation = EvaluationMetrics(METRICS, "evaluate")
+    tps = fps = fns = 0
+    for i in range(n):
+        start = perf_counter()
+        pred = pred_frames[i]
+        gt_img = gt_frames[i][: pred.shape[0], : pred.shape[1]]
+        target = target_peaks_gen(gt_img.astype("uint8"))
+        peaks, _ = peak_candidates(pred, args.peak_thresh, args.dist_peak)
+        associate_id = match_points(target, peaks, args.dist_threshold)
+        tp, fp, fn = count_tp_fp_fn(target, peaks, associate_id, pred.shape)
+        tps, fps, fns = tps + tp, fps + fp, fns + fn
+        metrics.frame(
+            perf_counter() - start,
+            pred.nbytes + gt_img.nbytes,
+            cells=len(peaks),
+            pending=n - i - 1,
+        )
+        evaluation.update(tp, fp, fn)
+
+    if tps == 0:
+        precision = recall = f_measure = 0
+    else:
+        recall = tps / (tps + fns)
+        precision = tps / (tps + fps)
+        f_measure = (2 * recall * precision) / (recall + precision)
+    return precision, recall, f_measure
+
+
+def main(args):
+    exporters = start_exporters(
+        METRICS, args.metrics_port, args.metrics_path, args.metrics_interval
+    )
+    try:
+        precision, recall, f_measure = evaluate(args)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    print(precision, recall, f_measure)
+    output_path = Path(args.output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open(mode="a") as f:
+        f.write("%f,%f,%f\n" % (precision, recall, f_measure))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,11 +1,14 @@
 from datetime import datetime
-from PIL import Image
 import torch
 import numpy as np
 from pathlib import Path
 import cv2
-from networks import UNet
+from networks import load_model, autocast, check_precision, keep_fp32
 from utils import local_maxima, show_res, optimum, target_peaks_gen, remove_outside_plot
+from utils import ResponseCache, LayerProfiler, weight_hash, model_key, open_frames
+from utils import sweep_frame, pr_table, BuildManifest, params_key, file_digest
+from utils import METRICS, StageMetrics, EvaluationMetrics, start_exporters, file_bytes
+from time import perf_counter
 import argparse
 
 
@@ -40,8 +43,131 @@ def parse_args():
     parser.add_argument(
         "-g", "--gpu", dest="gpu", help="whether use CUDA", action="store_true"
     )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fused",
+        dest="fused",
+        help="fold BatchNorm into the convs before inference",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-q",
+        "--quantized",
+        dest="quantized",
+        help="weight path is an int8 graph from quantize_model.py (CPU only), "
+        "converted with this quantized engine",
+        nargs="?",
+        const="fbgemm",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cache_path",
+        help="response cache shared with propagate_main.py",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--cache_size",
+        dest="cache_size",
+        help="max size of the response cache [MB]",
+        default=2048,
+        type=int,
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile_path",
+        help="directory of the per-layer profile (trace.json, profile.txt)",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--precision",
+        dest="precision",
+        help="autocast the UNet to bf16 or fp16, the output layer stays fp32",
+        choices=["fp32", "bf16", "fp16"],
+        default="fp32",
+    )
+    parser.add_argument(
+        "--update",
+        dest="update",
+        help="only rebuild frames whose input, weights or parameters changed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--dry_run",
+        dest="dry_run",
+        help="list the frames --update would rebuild and exit",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--sweep",
+        dest="sweep",
+        help="evaluate a grid of peak thresholds and distances on cached responses",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--peak_threshs",
+        dest="peak_threshs",
+        help="peak thresholds of the sweep",
+        nargs="+",
+        default=list(range(20, 250, 10)),
+        type=int,
+    )
+    parser.add_argument(
+        "--dist_peaks",
+        dest="dist_peaks",
+        help="min distances between peaks of the sweep",
+        nargs="+",
+        default=[2],
+        type=int,
+    )
+    parser.add_argument(
+        "--dist_thresholds",
+        dest="dist_thresholds",
+        help="association distances of the sweep",
+        nargs="+",
+        default=[10],
+        type=float,
+    )
+    parser.add_argument(
+        "--metrics_port",
+        dest="metrics_port",
+        help="serve the metrics in Prometheus text format on this port",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--metrics_path",
+        dest="metrics_path",
+        help="json snapshot of the metrics, rewritten every --metrics_interval seconds",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        dest="metrics_interval",
+        help="seconds between the json snapshots",
+        default=10,
+        type=float,
+    )
 
     args = parser.parse_args()
+    # the sweep reads all responses at once and has no frames to skip
+    if args.sweep and (args.update or args.dry_run):
+        parser.error("--update and --dry_run can not be used with --sweep")
     return args
 
 
@@ -58,29 +184,76 @@ class Predict:
         self.save_ori_path.mkdir(parents=True, exist_ok=True)
         self.save_pred_path.mkdir(parents=True, exist_ok=True)
 
+        self.cache = getattr(args, "cache", None)
+        self.precision = getattr(args, "precision", "fp32")
+        # model_key of the weight file, else the hash of the state_dict
+        self.net_key = getattr(args, "net_key", None)
+        if self.net_key is None and self.cache is not None:
+            self.net_key = weight_hash(self.net, self.precision)
+        self.img_key = None
+        # BuildManifest, frames built from the same input and parameters are skipped
+        self.manifest = None
+        if self.precision != "fp32":
+            check_precision(self.precision, "cuda" if self.gpu else "cpu")
+            keep_fp32(self.net)
+        self.metrics = StageMetrics(getattr(args, "metrics", METRICS), "detect")
+
+    def params(self):
+        """parameters the outputs depend on, besides the weights"""
+        return {"stage": "detect", "precision": self.precision}
+
+    def outputs(self, name):
+        return [
+            self.save_pred_path / Path(name + ".tif"),
+            self.save_ori_path / Path(name + ".tif"),
+        ]
+
     def pred(self, ori):
         img = (ori.astype(np.float32) / ori.max()).reshape(
             (1, ori.shape[0], ori.shape[1])
         )
+        if self.cache is None:
+            return self.forward(img)
+        pre_img, self.img_key, _ = self.cache.response(
+            img[0], self.net_key, lambda: self.forward(img)
+        )
+        return pre_img
 
+    def forward(self, img):
         with torch.no_grad():
             img = torch.from_numpy(img).unsqueeze(0)
             if self.gpu:
                 img = img.cuda()
-            mask_pred = self.net(img)
-        pre_img = mask_pred.detach().cpu().numpy()[0, 0]
+            with autocast(self.precision, img.device.type):
+                mask_pred = self.net(img)
+        pre_img = mask_pred.detach().float().cpu().numpy()[0, 0]
         pre_img = (pre_img * 255).astype(np.uint8)
         return pre_img
 
     def main(self):
         self.net.eval()
-        # path def
-        paths = sorted(self.ori_path.glob("*.tif"))
-        for i, path in enumerate(paths):
-            ori = np.array(Image.open(path))
+        # directory of *.tif or a tiff stack
+        frames = open_frames(self.ori_path, "*.tif")
+        for i in range(len(frames)):
+            name, inputs = "%05d" % i, [(frames, i)]
+            if self.manifest is not None:
+                if self.manifest.reason(name, inputs, self.outputs(name)) is None:
+                    continue
+                if self.manifest.dry_run:
+                    continue
+            start = perf_counter()
+            ori = frames[i]
             pre_img = self.pred(ori)
             cv2.imwrite(str(self.save_pred_path / Path("%05d.tif" % i)), pre_img)
             cv2.imwrite(str(self.save_ori_path / Path("%05d.tif" % i)), ori)
+            self.metrics.frame(
+                perf_counter() - start,
+                ori.nbytes,
+                file_bytes(self.outputs(name)),
+                pending=len(frames) - i - 1,
+            )
+            if self.manifest is not None:
+                self.manifest.done(name, inputs)
 
 
 class PredictFmeasure(Predict):
@@ -103,10 +276,33 @@ class PredictFmeasure(Predict):
         self.tps = 0
         self.fps = 0
         self.fns = 0
+        self.n_peaks = 0
+        self.evaluation = EvaluationMetrics(getattr(args, "metrics", METRICS), "detect")
+
+    def params(self):
+        return {
+            "stage": "detect_fmeasure",
+            "precision": self.precision,
+            "peak_thresh": self.peak_thresh,
+            "dist_peak": self.dist_peak,
+            "dist_threshold": self.dist_threshold,
+        }
+
+    def outputs(self, name):
+        return super().outputs(name) + [
+            self.save_gt_path / Path(name + ".tif"),
+            self.save_error_path / Path(name + ".tif"),
+        ]
 
     def cal_tp_fp_fn(self, ori, gt_img, pre_img, i):
         gt = target_peaks_gen((gt_img).astype(np.uint8))
-        res = local_maxima(pre_img, self.peak_thresh, self.dist_peak)
+        if self.cache is None:
+            res = local_maxima(pre_img, self.peak_thresh, self.dist_peak)
+        else:
+            res = self.cache.peaks(
+                self.img_key, self.net_key, pre_img, self.peak_thresh, self.dist_peak
+            )
+        self.n_peaks = len(res)
         associate_id = optimum(gt, res, self.dist_threshold)
 
         gt_final, no_detected_id = remove_outside_plot(
@@ -134,27 +330,50 @@ class PredictFmeasure(Predict):
         self.tps += tp
         self.fns += fn
         self.fps += fp
+        return tp, fp, fn
 
     def main(self):
         self.net.eval()
-        # path def
-        path_x = sorted(self.ori_path.glob("*.tif"))
-        path_y = sorted(self.gt_path.glob("*.tif"))
-
-        z = zip(path_x, path_y)
-
-        for i, b in enumerate(z):
+        # <input>/ori, <input>/gt directories of *.tif or ori.tif, gt.tif stacks
+        ori_frames = open_frames(self.ori_path, "*.tif", flags=0)
+        gt_frames = open_frames(self.gt_path, "*.tif", flags=0)
+
+        for i in range(min(len(ori_frames), len(gt_frames))):
+            name, inputs = "%05d" % i, [(ori_frames, i), (gt_frames, i)]
+            if self.manifest is not None:
+                if self.manifest.reason(name, inputs, self.outputs(name)) is None:
+                    # counts of the previous run
+                    info = self.manifest.info(name)
+                    self.tps += info["tp"]
+                    self.fps += info["fp"]
+                    self.fns += info["fn"]
+                    continue
+                if self.manifest.dry_run:
+                    continue
             import gc
 
             gc.collect()
-            ori = cv2.imread(str(b[0]), 0)[:512, :512]
-            gt_img = cv2.imread(str(b[1]), 0)[:512, :512]
+            start = perf_counter()
+            ori = ori_frames[i][:512, :512]
+            gt_img = gt_frames[i][:512, :512]
 
             pre_img = self.pred(ori)
 
-            self.cal_tp_fp_fn(ori, gt_img, pre_img, i)
+            tp, fp, fn = self.cal_tp_fp_fn(ori, gt_img, pre_img, i)
+            self.metrics.frame(
+                perf_counter() - start,
+                ori.nbytes + gt_img.nbytes,
+                file_bytes(self.outputs(name)),
+                cells=self.n_peaks,
+                pending=min(len(ori_frames), len(gt_frames)) - i - 1,
+            )
+            self.evaluation.update(tp, fp, fn)
+            if self.manifest is not None:
+                self.manifest.done(name, inputs, tp=tp, fp=fp, fn=fn)
+        if self.manifest is not None and self.manifest.dry_run:
+            return None
         if self.tps == 0:
-            f_measure = 0
+            precision = recall = f_measure = 0
         else:
             recall = self.tps / (self.tps + self.fns)
             precision = self.tps / (self.tps + self.fps)
@@ -163,21 +382,162 @@ class PredictFmeasure(Predict):
         print(precision, recall, f_measure)
         with self.save_txt_path.open(mode="a") as f:
             f.write("%f,%f,%f\n" % (precision, recall, f_measure))
+        return precision, recall, f_measure
 
 
-if __name__ == "__main__":
-    args = parse_args()
+class SweepFmeasure(PredictFmeasure):
+    """
+    f-measure over a grid of peak thresholds, peak distances and association
+    distances. The responses and gt peaks are computed once and kept in
+    <output>/sweep/responses.npz for the next sweep with the same weights.
+    """
 
+    def __init__(self, args):
+        super().__init__(args)
+        self.peak_threshs = sorted(args.peak_threshs)
+        self.dist_peaks = args.dist_peaks
+        self.dist_thresholds = args.dist_thresholds
+        self.save_sweep_path = args.output_path / Path("sweep")
+        self.save_sweep_path.mkdir(parents=True, exist_ok=True)
+        self.responses_path = self.save_sweep_path / Path("responses.npz")
+
+    def load_responses(self):
+        """
+        :return: list of responses, list of gt peaks
+        """
+        net_key = self.net_key or weight_hash(self.net, self.precision)
+        key = "{}:{}".format(net_key, self.ori_path.resolve())
+        if self.responses_path.exists():
+            cached = np.load(str(self.responses_path))
+            if str(cached["key"]) == key:
+                n = int(cached["n"])
+                return (
+                    [cached["response_%05d" % i] for i in range(n)],
+                    [cached["gt_%05d" % i] for i in range(n)],
+                )
+
+        self.net.eval()
+        ori_frames = open_frames(self.ori_path, "*.tif", flags=0)
+        gt_frames = open_frames(self.gt_path, "*.tif", flags=0)
+        responses, targets = [], []
+        for ori, gt_img in zip(ori_frames, gt_frames):
+            # same crop as PredictFmeasure.main
+            responses.append(self.pred(ori[:512, :512]))
+            targets.append(target_peaks_gen(gt_img[:512, :512].astype(np.uint8)))
+        arrays = {"key": key, "n": len(responses)}
+        arrays.update({"response_%05d" % i: r for i, r in enumerate(responses)})
+        arrays.update({"gt_%05d" % i: t for i, t in enumerate(targets)})
+        np.savez(str(self.responses_path), **arrays)
+        return responses, targets
+
+    def save_curve(self, table):
+        import matplotlib.pyplot as plt
+
+        plt.figure(figsize=(4, 4), dpi=150)
+        for dist_peak in self.dist_peaks:
+            for dist_threshold in self.dist_thresholds:
+                rows = table[(table[:, 1] == dist_peak) & (table[:, 2] == dist_threshold)]
+                plt.plot(
+                    rows[:, 7],
+                    rows[:, 6],
+                    ".-",
+                    label="dist_peak %d, dist %g" % (dist_peak, dist_threshold),
+                )
+        plt.xlabel("recall")
+        plt.ylabel("precision")
+        plt.xlim(0, 1)
+        plt.ylim(0, 1.05)
+        plt.legend(fontsize=6)
+        plt.savefig(str(self.save_sweep_path / Path("pr_curve.png")))
+        plt.close()
+
+    def main(self):
+        responses, targets = self.load_responses()
+        counts = sum(
+            sweep_frame(
+                response,
+                target,
+                self.peak_threshs,
+                self.dist_peaks,
+                self.dist_thresholds,
+            )
+            for response, target in zip(responses, targets)
+        )
+        table = pr_table(counts, self.peak_threshs, self.dist_peaks, self.dist_thresholds)
+        np.savetxt(
+            str(self.save_sweep_path / Path("sweep.csv")),
+            table,
+            fmt=["%d", "%d", "%g", "%d", "%d", "%d", "%f", "%f", "%f"],
+            delimiter=",",
+            header="peak_thresh,dist_peak,dist_threshold,tp,fp,fn,"
+            "precision,recall,f_measure",
+            comments="",
+        )
+        self.save_curve(table)
+
+        best = table[table[:, 8].argmax()]
+        text = (
+            "best: peak_thresh %d, dist_peak %d, dist_threshold %g, "
+            "precision %f, recall %f, f-measure %f"
+            % (best[0], best[1], best[2], best[6], best[7], best[8])
+        )
+        print(text)
+        with (self.save_sweep_path / Path("best.txt")).open(mode="w") as f:
+            f.write(text + "\n")
+        return best[6], best[7], best[8]
+
+
+def main(args):
     args.input_path = Path(args.input_path)
     args.output_path = Path(args.output_path)
 
-    net = UNet(n_channels=1, n_classes=1)
-    net.load_state_dict(torch.load(args.weight_path, map_location="cpu"))
+    if args.quantized is not None:
+        assert not args.gpu, "quantized model runs on CPU only"
+        assert args.precision == "fp32", "quantized model has its own int8 precision"
+    net = load_model(
+        args.weight_path,
+        fused=args.fused,
+        quantized=args.quantized,
+        width=args.width,
+        depth=args.depth,
+        separable=args.separable,
+    )
 
     if args.gpu:
         net.cuda()
     args.net = net
+    args.net_key = model_key(args.weight_path, args.fused, args.precision)
+    args.cache = None
+    if args.cache_path is not None:
+        args.cache = ResponseCache(args.cache_path, args.cache_size * 1024 ** 2)
+
+    pred = SweepFmeasure(args) if args.sweep else PredictFmeasure(args)
+    if args.update or args.dry_run:
+        weight_key = file_digest(args.weight_path) + ("_fused" if args.fused else "")
+        pred.manifest = BuildManifest(
+            args.output_path.joinpath("build_manifest.jsonl"),
+            params_key(weight_key, **pred.params()),
+            dry_run=args.dry_run,
+        )
+
+    profiler = None
+    if args.profile_path is not None:
+        profiler = LayerProfiler(net).attach()
+    exporters = start_exporters(
+        METRICS, args.metrics_port, args.metrics_path, args.metrics_interval
+    )
+    try:
+        pred.main()
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    if pred.manifest is not None:
+        print(pred.manifest.report())
+    if profiler is not None:
+        print(profiler.save(args.profile_path))
+    if args.cache is not None:
+        print("response cache: {}".format(args.cache.stats()))
 
-    pred = PredictFmeasure(args)
 
-    pred.main()
+if __name__ == "__main__":
+    main(parse_args())
@@ -3,12 +3,11 @@ from torch import optim
 import torch.utils.data
 import torch.nn as nn
 from detection import *
-from utils import CellImageLoad
+from utils import CellImageLoad, CellPointLoad, ConcatSource, open_frames
 from pathlib import Path
-import matplotlib.pyplot as plt
 import numpy as np
 import cv2
-from networks import UNet
+from networks import UNet, CHECKPOINTS
 import argparse
 
 
@@ -57,6 +56,55 @@ def parse_args():
         default=1e-3,
         type=float,
     )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--train_points",
+        dest="train_points",
+        help="cell positions (frame,x,y) whose targets are rendered per crop "
+        "instead of reading <train_path>/gt",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--val_points",
+        dest="val_points",
+        help="cell positions (frame,x,y) of the validation frames",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--sigma",
+        dest="sigma",
+        help="gaussian sigma of the targets rendered from --train_points/--val_points",
+        default=12,
+        type=float,
+    )
+    parser.add_argument(
+        "--crop_size",
+        dest="crop_size",
+        help="side of the square training crops",
+        default=256,
+        type=int,
+    )
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint",
+        help="stages whose activations are recomputed in the backward pass "
+        "instead of kept, to fit larger crops or batches",
+        choices=CHECKPOINTS,
+        default="none",
+    )
 
     args = parser.parse_args()
     return args
@@ -64,17 +112,16 @@ def parse_args():
 
 class _TrainBase:
     def __init__(self, args):
-        ori_paths = self.gather_path(args.train_path, "ori")[:300]
-        gt_paths = self.gather_path(args.train_path, "gt")[:300]
-        data_loader = CellImageLoad(ori_paths, gt_paths)
+        self.sigma = getattr(args, "sigma", 12)
+        crop_size = getattr(args, "crop_size", 256)
+        self.crop_size = (crop_size, crop_size)
+        data_loader = self.dataset(args.train_path, getattr(args, "train_points", None))
         self.train_dataset_loader = torch.utils.data.DataLoader(
             data_loader, batch_size=args.batch_size, shuffle=True, num_workers=0
         )
         self.number_of_traindata = data_loader.__len__()
 
-        ori_paths = self.gather_path(args.val_path, "ori")[:300]
-        gt_paths = self.gather_path(args.val_path, "gt")[:300]
-        data_loader = CellImageLoad(ori_paths, gt_paths)
+        data_loader = self.dataset(args.val_path, getattr(args, "val_points", None))
         self.val_loader = torch.utils.data.DataLoader(
             data_loader, batch_size=5, shuffle=False, num_workers=0
         )
@@ -90,13 +137,16 @@ class _TrainBase:
             )
         )
 
-        self.net = net
+        self.net = args.net
+        # stages recomputed in the backward pass, see UNet
+        if getattr(args, "checkpoint", None) is not None:
+            self.net.checkpoint = args.checkpoint
 
         self.train = None
         self.val = None
 
         self.N_train = None
-        self.optimizer = optim.Adam(net.parameters(), lr=args.learning_rate)
+        self.optimizer = optim.Adam(self.net.parameters(), lr=args.learning_rate)
         self.epochs = args.epochs
         self.batch_size = args.batch_size
         self.gpu = args.gpu
@@ -107,13 +157,24 @@ class _TrainBase:
         self.epoch_loss = 0
         self.bad = 0
 
-    def gather_path(self, train_paths, mode):
-        ori_paths = []
+    def dataset(self, paths, point_path):
+        """gt images of the paths, or targets rendered from the cell positions"""
+        ori_paths = self.gather_path(paths, "ori", 300)
+        if point_path is not None:
+            return CellPointLoad(ori_paths, point_path, self.sigma, self.crop_size)
+        gt_paths = self.gather_path(paths, "gt", 300)
+        return CellImageLoad(ori_paths, gt_paths, self.crop_size)
+
+    def gather_path(self, train_paths, mode, limit=None):
+        # <train_path>/<mode>/*.tif or a <train_path>/<mode>.tif stack
+        sources = []
         for train_path in train_paths:
-            ori_paths.extend(sorted(train_path.joinpath(mode).glob("*.tif")))
-        return ori_paths
+            sources.append(open_frames(train_path.joinpath(mode), "*.tif", flags=0))
+        return ConcatSource(sources, limit)
 
     def show_graph(self):
+        import matplotlib.pyplot as plt
+
         x = list(range(len(self.losses)))
         plt.plot(x, self.losses)
         plt.plot(x, self.val_losses)
@@ -124,9 +185,14 @@ class TrainNet(_TrainBase):
     def loss_calculate(self, masks_probs_flat, true_masks_flat):
         return self.criterion(masks_probs_flat, true_masks_flat)
 
+    def make_target(self, imgs, true_masks):
+        return true_masks
+
     def main(self):
         for epoch in range(self.epochs):
             print("Starting epoch {}/{}.".format(epoch + 1, self.epochs))
+            # eval_net of the previous epoch left the net in eval mode
+            self.net.train()
 
             pbar = tqdm(total=self.number_of_traindata)
             for i, data in enumerate(self.train_dataset_loader):
@@ -137,6 +203,7 @@ class TrainNet(_TrainBase):
                     imgs = imgs.cuda()
                     true_masks = true_masks.cuda()
 
+                true_masks = self.make_target(imgs, true_masks)
                 masks_pred = self.net(imgs)
 
                 masks_probs_flat = masks_pred.view(-1)
@@ -195,16 +262,20 @@ class TrainNet(_TrainBase):
         self.epoch_loss = 0
 
 
-if __name__ == "__main__":
-    args = parse_args()
-
+def main(args):
     args.train_path = [Path(args.train_path)]
     args.val_path = [Path(args.val_path)]
     # save weight path
     args.weight_path = Path(args.weight_path)
 
     # define model
-    net = UNet(n_channels=1, n_classes=1)
+    net = UNet(
+        n_channels=1,
+        n_classes=1,
+        width=args.width,
+        depth=args.depth,
+        separable=args.separable,
+    )
     if args.gpu:
         net.cuda()
 
@@ -213,3 +284,7 @@ if __name__ == "__main__":
     train = TrainNet(args)
 
     train.main()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,82 @@
+from pathlib import Path
+from time import perf_counter
+import argparse
+from utils import open_frames, CellExporter, file_bytes
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(
+        description="Run-length encoded cells of label images in one columnar file"
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        dest="input_path",
+        help="directory of label images or a label stack",
+        default="./output/pipeline/label",
+        type=str,
+    )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        dest="pattern",
+        help="glob of the label images in the directory, e.g. */label.tif",
+        default="*.tif",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="columnar file of the sequence (.npz)",
+        default="./output/cells.npz",
+        type=str,
+    )
+    parser.add_argument(
+        "--polygon",
+        dest="polygon",
+        help="also store the outline of each cell, simplified to this max "
+        "distance [pixel]",
+        default=None,
+        type=float,
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    input_path = Path(args.input_path)
+    frames = open_frames(input_path, args.pattern, flags=-1)
+    start = perf_counter()
+    with CellExporter(args.output_path, args.polygon) as exporter:
+        for i in range(len(frames)):
+            if hasattr(frames, "paths"):
+                # */label.tif is named by its directory
+                name = str(frames.paths[i].relative_to(input_path).with_suffix(""))
+            else:
+                name = frames.name(i)
+            n = exporter.add(frames[i], name)
+            print("{}: {} cells".format(name, n))
+    input_bytes = file_bytes(frames.paths) if hasattr(frames, "paths") else 0
+    print(
+        "{} frames, {} cells, {} runs, {} vertices in {:.2f} s".format(
+            len(frames),
+            exporter.n_cells,
+            exporter.n_runs,
+            exporter.n_points,
+            perf_counter() - start,
+        )
+    )
+    print(
+        "{} bytes, {} bytes of label images".format(
+            file_bytes([args.output_path]), input_bytes or file_bytes([input_path])
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,110 @@
+from time import perf_counter
+from pathlib import Path
+import argparse
+import torch
+from networks import export_unet, load_model
+from propagation.gen_guided_model import GuidedModel
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(description="Export fused inference model")
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="load weight path",
+        default="./weight/best.pth",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="path of the serialized graph",
+        default="./weight/best.pt",
+        type=str,
+    )
+    parser.add_argument(
+        "-s",
+        "--image_size",
+        dest="image_size",
+        help="height and width the graph is traced with",
+        nargs=2,
+        default=[512, 512],
+        type=int,
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-r", "--repeat", dest="repeat", help="latency repeats", default=10, type=int
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def latency(net, img, repeat):
+    with torch.no_grad():
+        net(img)
+        start = perf_counter()
+        for _ in range(repeat):
+            net(img)
+    return (perf_counter() - start) / repeat * 1000
+
+
+def guided_response(net, img):
+    """input gradient of the guided backprop with the whole map as mask"""
+    model = GuidedModel(net)
+    model.inference()
+    img = img.clone().requires_grad_()
+    out = torch.nn.Sequential.forward(model, img)
+    out.backward(torch.ones_like(out))
+    grad = img.grad.detach().clone()
+    model.train(False)
+    return grad
+
+
+def verify(net, traced, fused, shape, repeat):
+    img = torch.rand((1, 1) + tuple(shape))
+    with torch.no_grad():
+        ref = net(img)
+        diff_fused = (fused(img) - ref).abs().max().item()
+        diff_traced = (traced(img) - ref).abs().max().item()
+    ref_guided = guided_response(net, img)
+    diff_guided = (guided_response(fused, img) - ref_guided).abs().max().item()
+    diff_guided /= max(ref_guided.abs().max().item(), 1e-12)
+
+    text = "max abs diff: fused {:.3e}, traced {:.3e}\n".format(diff_fused, diff_traced)
+    text += "max relative diff of guided grad: {:.3e}\n".format(diff_guided)
+    models = [("original", net), ("fused", fused), ("traced", traced)]
+    times = [latency(model, img, repeat) for _, model in models]
+    for (name, _), ms in zip(models, times):
+        text += "{}: {:.2f} ms ({:.2f}x)\n".format(name, ms, times[0] / ms)
+    return text
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    net = load_model(
+        args.weight_path, width=args.width, depth=args.depth, separable=args.separable
+    )
+    net.eval()
+
+    traced, fused = export_unet(net, args.output_path, args.image_size)
+    text = verify(net, traced, fused, args.image_size, args.repeat)
+    print(text)
+    with Path(args.output_path).with_suffix(".txt").open(mode="w") as f:
+        f.write(text)
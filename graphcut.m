@@ -64,8 +64,15 @@ for fileIndex=3:length(infolders)
     for fidx=2:Nz+1;
         bpfile = fullfile(bpfolder,bpfiles(fidx).name);
         bp = load(bpfile);
-        bp = bp.image;
-        BP(:,:,fidx-1) = double(bp)/255;
+        if isfield(bp,'bbox');
+            % sparse response, the crop inside bbox [y0 x0 y1 x1] (zero based, end exclusive)
+            box = double(bp.bbox);
+            if box(3) > box(1) && box(4) > box(2);
+                BP(box(1)+1:box(3),box(2)+1:box(4),fidx-1) = double(bp.image)*double(bp.scale)/255;
+            end
+        else
+            BP(:,:,fidx-1) = double(bp.image)/255;
+        end
     end
 
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
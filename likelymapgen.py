@@ -1,8 +1,7 @@
 import cv2
 import numpy as np
 from pathlib import Path
-from PIL import Image
-from utils import gaus_filter
+from utils import stamp_batch
 import argparse
 
 
@@ -41,6 +40,9 @@ def parse_args():
         default=12,
         type=int,
     )
+    parser.add_argument(
+        "-b", "--batch", dest="batch", help="frames rendered at once", default=16, type=int
+    )
 
     args = parser.parse_args()
     return args
@@ -51,27 +53,31 @@ def like_map_gen(args):
     args.output_path.mkdir(parents=True, exist_ok=True)
     # load txt file
     cell_positions = np.loadtxt(args.input_path, delimiter=",", skiprows=1)
-    black = np.zeros((args.height, args.width))
+    frames = range(0, int(cell_positions[:, 0].max()))
 
     # 1013 - number of frame
-    for i in range(0, int(cell_positions[:, 0].max())):
-        # likelihood map of one input
-        result = black.copy()
-        cells = cell_positions[cell_positions[:, 0] == i]
-        for _, x, y in cells:
-            img_t = black.copy()  # likelihood map of one cell
-            img_t[int(y)][int(x)] = 255  # plot a white dot
-            img_t = gaus_filter(img_t, 301, args.g_size)
-            result = np.maximum(result, img_t)  # compare result with gaussian_img
-        #  normalization
-        result = 255 * result / result.max()
-        result = result.astype("uint8")
-        cv2.imwrite(str(args.output_path / Path("%05d.tif" % i)), result)
-        print(i + 1)
+    for start in range(0, len(frames), args.batch):
+        batch = frames[start : start + args.batch]
+        # likelihood maps of the batch, max of the gaussians of the cells
+        results = stamp_batch(
+            [cell_positions[cell_positions[:, 0] == i, 1:] for i in batch],
+            (args.height, args.width),
+            args.g_size,
+            ksize=301,
+        )
+        for i, result in zip(batch, results):
+            #  normalization
+            result = 255 * result / result.max()
+            result = result.astype("uint8")
+            cv2.imwrite(str(args.output_path / Path("%05d.tif" % i)), result)
+            print(i + 1)
     print("finish")
 
 
-if __name__ == "__main__":
-    args = parse_args()
+def main(args):
     args.output_path = Path(args.output_path)
     like_map_gen(args)
+
+
+if __name__ == "__main__":
+    main(parse_args())
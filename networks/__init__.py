@@ -1 +1,4 @@
-from .network_model import UNet
+from .network_model import UNet, CHECKPOINTS
+from .network_parts import *
+from .network_export import fuse_unet, export_unet, load_model
+from .network_precision import PRECISIONS, autocast, check_precision, keep_fp32
@@ -0,0 +1,121 @@
+from pathlib import Path
+import copy
+import torch
+import torch.nn as nn
+from .network_model import UNet
+from .network_parts import DoubleConv, SeparableConv
+
+
+def fuse_conv_bn(conv, bn):
+    """
+    fold an eval-mode BatchNorm into the preceding conv
+    :param conv: nn.Conv2d
+    :param bn: nn.BatchNorm2d following conv
+    :return: nn.Conv2d computing bn(conv(x))
+    """
+    fused = nn.Conv2d(
+        conv.in_channels,
+        conv.out_channels,
+        conv.kernel_size,
+        stride=conv.stride,
+        padding=conv.padding,
+        dilation=conv.dilation,
+        groups=conv.groups,
+        bias=True,
+    ).to(conv.weight.device)
+
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    with torch.no_grad():
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_((bias - bn.running_mean) * scale + bn.bias)
+    return fused
+
+
+def fuse_unet(net):
+    """
+    copy of net with every (conv => BN) of DoubleConv folded into one conv.
+    BN is replaced by Identity so the ReLU modules stay in place and
+    GuidedModel can still patch them.
+    """
+    fused = copy.deepcopy(net).eval()
+    for module in fused.modules():
+        if not isinstance(module, DoubleConv):
+            continue
+        seq = module.conv
+        for i in range(0, len(seq), 3):
+            conv, bn = seq[i], seq[i + 1]
+            if not isinstance(bn, nn.BatchNorm2d):
+                continue
+            if isinstance(conv, SeparableConv):
+                conv.pointwise = fuse_conv_bn(conv.pointwise, bn)
+            else:
+                seq[i] = fuse_conv_bn(conv, bn)
+            seq[i + 1] = nn.Identity()
+    return fused
+
+
+def is_fused_state(state_dict):
+    return not any(key.endswith("running_mean") for key in state_dict.keys())
+
+
+def load_model(weight_path, fused=False, quantized=None, **kwargs):
+    """
+    load a UNet from any artifact this package writes
+    :param weight_path: best.pth, a fused *_guided.pth or a serialized *.pt graph
+    :param fused: fold BN into the convs after loading a plain state_dict
+    :param quantized: engine an int8 *.pt graph of quantize_model.py was converted
+        with, selected before loading so its packed weights run on CPU
+    :param kwargs: UNet options (width, depth, separable)
+    :return: nn.Module, or ScriptModule for *.pt
+    """
+    weight_path = Path(weight_path)
+    if quantized is not None:
+        assert weight_path.suffix == ".pt", "quantized model is a *.pt graph"
+        assert quantized in torch.backends.quantized.supported_engines, (
+            "quantized engine %s is not supported here" % quantized
+        )
+        torch.backends.quantized.engine = quantized
+    if weight_path.suffix == ".pt":
+        return torch.jit.load(str(weight_path), map_location="cpu")
+
+    net = UNet(n_channels=1, n_classes=1, **kwargs)
+    state_dict = torch.load(str(weight_path), map_location="cpu")
+    if is_fused_state(state_dict):
+        net = fuse_unet(net)
+        net.load_state_dict(state_dict)
+    else:
+        net.load_state_dict(state_dict)
+        if fused:
+            net = fuse_unet(net)
+    return net
+
+
+def export_unet(net, save_path, shape=(512, 512)):
+    """
+    fuse, freeze and trace net for Predict and save the guided-ReLU compatible
+    fused state_dict next to it.
+    The traced graph has the Up padding of the traced shape baked in, so
+    trace with the frame size used at inference.
+    :param save_path: path of the *.pt graph; the guided variant is *_guided.pth
+    :return: traced module, fused module
+    """
+    save_path = Path(save_path)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    fused = fuse_unet(net).cpu()
+    for param in fused.parameters():
+        param.requires_grad_(False)
+
+    example = torch.rand((1, 1) + tuple(shape))
+    with torch.no_grad():
+        traced = torch.jit.trace(fused, example)
+    traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, str(save_path))
+
+    for param in fused.parameters():
+        param.requires_grad_(True)
+    torch.save(
+        fused.state_dict(),
+        str(save_path.with_name(save_path.stem + "_guided.pth")),
+    )
+    return traced, fused
@@ -1,35 +1,116 @@
 from .network_parts import *
+from contextlib import contextmanager
+import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
+# stages whose activations are recomputed in the backward pass instead of kept
+CHECKPOINTS = ("none", "encoder", "decoder", "all")
 
-class UNet(nn.Module):
-    def __init__(self, n_channels, n_classes):
-        super(UNet, self).__init__()
-        self.inc = Inconv(n_channels, 64)
-        self.down1 = Down(64, 128)
-        self.down2 = Down(128, 256)
-        self.down3 = Down(256, 512)
-        self.down4 = Down(512, 512)
-        self.up1 = Up(1024, 256)
-        self.up2 = Up(512, 128)
-        self.up3 = Up(256, 64)
-        self.up4 = Up(128, 64)
-        self.outc = Outconv(64, n_classes)
 
-    def forward(self, x):
-        x1 = self.inc(x)
-        x2 = self.down1(x1)
-        x3 = self.down2(x2)
-        x4 = self.down3(x3)
-        x5 = self.down4(x4)
-        x = self.up1(x5, x4)
-        x = self.up2(x, x3)
-        x = self.up3(x, x2)
-        x = self.up4(x, x1)
-        x = self.outc(x)
-        return x
+@contextmanager
+def frozen_stats(module):
+    """BatchNorm of module normalizes by the batch but leaves its running stats as they are"""
+    bns = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    momentums = [bn.momentum for bn in bns]
+    # the counter is still incremented, and momentum=None averages over it
+    counts = [
+        None if bn.num_batches_tracked is None else bn.num_batches_tracked.clone()
+        for bn in bns
+    ]
+    for bn in bns:
+        bn.momentum = 0.0
+    try:
+        yield
+    finally:
+        for bn, momentum, count in zip(bns, momentums, counts):
+            bn.momentum = momentum
+            if count is not None:
+                bn.num_batches_tracked.copy_(count)
+
+
+class Recompute(object):
+    """
+    stage run by torch.utils.checkpoint, the second call is the recomputation of the
+    backward pass, which must not update the BatchNorm running stats again
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.calls = 0
 
+    def __call__(self, *inputs):
+        self.calls += 1
+        if self.calls == 1:
+            return self.stage(*inputs)
+        with frozen_stats(self.stage):
+            return self.stage(*inputs)
 
 
+class UNet(nn.Module):
+    """
+    :param width: channels of the first stage, doubled at every down stage
+    :param depth: number of down (and up) stages
+    :param separable: use depthwise separable 3x3 convs
+    :param bilinear: bilinear upsampling instead of transposed conv
+    :param checkpoint: one of CHECKPOINTS, the stages (inconv and down stages for the
+        encoder, up stages for the decoder) whose activations are recomputed in the
+        backward pass of training, only the input of each stage is kept
+    The defaults build the original 64-512 network, so old weights still load.
+    """
+
+    def __init__(
+        self,
+        n_channels,
+        n_classes,
+        width=64,
+        depth=4,
+        separable=False,
+        bilinear=True,
+        checkpoint="none",
+    ):
+        super(UNet, self).__init__()
+        # depth 0 would have no down stage, the receptive field and the 2 ** depth
+        # size alignment of the propagation assume at least one
+        assert depth >= 1 and width >= 1, "depth and width must be at least 1"
+        assert checkpoint in CHECKPOINTS, checkpoint
+        self.width = width
+        self.depth = depth
+        self.separable = separable
+        self.bilinear = bilinear
+        self.checkpoint = checkpoint
+
+        chs = [width * 2 ** i for i in range(depth + 1)]
+        # the bottom stage keeps its width since it is concatenated with the skip
+        chs[depth] = chs[depth - 1]
 
+        self.inc = Inconv(n_channels, chs[0], separable)
+        for i in range(1, depth + 1):
+            setattr(self, "down%d" % i, Down(chs[i - 1], chs[i], separable))
+        for i in range(1, depth + 1):
+            skip_ch = chs[depth - i]
+            out_ch = chs[max(depth - i - 1, 0)]
+            setattr(
+                self, "up%d" % i, Up(skip_ch * 2, out_ch, bilinear, separable)
+            )
+        self.outc = Outconv(chs[0], n_classes)
 
+    def stage(self, part, module, *inputs):
+        """module(*inputs), recomputed in the backward pass if part is checkpointed"""
+        if (
+            self.checkpoint in (part, "all")
+            and self.training
+            and torch.is_grad_enabled()
+        ):
+            return checkpoint(Recompute(module), *inputs, use_reentrant=False)
+        return module(*inputs)
+
+    def forward(self, x):
+        xs = [self.stage("encoder", self.inc, x)]
+        for i in range(1, self.depth + 1):
+            xs.append(self.stage("encoder", getattr(self, "down%d" % i), xs[-1]))
+        x = xs.pop()
+        for i in range(1, self.depth + 1):
+            x = self.stage("decoder", getattr(self, "up%d" % i), x, xs.pop())
+        x = self.outc(x)
+        return x
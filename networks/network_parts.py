@@ -5,16 +5,36 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 
+class SeparableConv(nn.Module):
+    """depthwise 3x3 conv => pointwise 1x1 conv"""
+
+    def __init__(self, in_ch, out_ch):
+        super(SeparableConv, self).__init__()
+        self.depthwise = nn.Conv2d(in_ch, in_ch, 3, padding=1, groups=in_ch)
+        self.pointwise = nn.Conv2d(in_ch, out_ch, 1)
+
+    def forward(self, x):
+        x = self.depthwise(x)
+        x = self.pointwise(x)
+        return x
+
+
+def conv3x3(in_ch, out_ch, separable=False):
+    if separable:
+        return SeparableConv(in_ch, out_ch)
+    return nn.Conv2d(in_ch, out_ch, 3, padding=1)
+
+
 class DoubleConv(nn.Module):
     """(conv => BN => ReLU) * 2"""
 
-    def __init__(self, in_ch, out_ch):
+    def __init__(self, in_ch, out_ch, separable=False):
         super(DoubleConv, self).__init__()
         self.conv = nn.Sequential(
-            nn.Conv2d(in_ch, out_ch, 3, padding=1),
+            conv3x3(in_ch, out_ch, separable),
             nn.BatchNorm2d(out_ch),
             nn.ReLU(inplace=True),
-            nn.Conv2d(out_ch, out_ch, 3, padding=1),
+            conv3x3(out_ch, out_ch, separable),
             nn.BatchNorm2d(out_ch),
             nn.ReLU(inplace=True),
         )
@@ -25,9 +45,10 @@ class DoubleConv(nn.Module):
 
 
 class Inconv(nn.Module):
-    def __init__(self, in_ch, out_ch):
+    def __init__(self, in_ch, out_ch, separable=False):
         super(Inconv, self).__init__()
-        self.conv = DoubleConv(in_ch, out_ch)
+        # the first conv sees a single channel, a depthwise split would not save anything
+        self.conv = DoubleConv(in_ch, out_ch, separable and in_ch > 1)
 
     def forward(self, x):
         x = self.conv(x)
@@ -35,9 +56,11 @@ class Inconv(nn.Module):
 
 
 class Down(nn.Module):
-    def __init__(self, in_ch, out_ch):
+    def __init__(self, in_ch, out_ch, separable=False):
         super(Down, self).__init__()
-        self.mpconv = nn.Sequential(nn.MaxPool2d(2), DoubleConv(in_ch, out_ch))
+        self.mpconv = nn.Sequential(
+            nn.MaxPool2d(2), DoubleConv(in_ch, out_ch, separable)
+        )
 
     def forward(self, x):
         x = self.mpconv(x)
@@ -45,7 +68,7 @@ class Down(nn.Module):
 
 
 class Up(nn.Module):
-    def __init__(self, in_ch, out_ch, bilinear=True):
+    def __init__(self, in_ch, out_ch, bilinear=True, separable=False):
         super(Up, self).__init__()
 
         #  would be a nice idea if the upsampling could be learned too,
@@ -55,13 +78,14 @@ class Up(nn.Module):
         else:
             self.up = nn.ConvTranspose2d(in_ch // 2, in_ch // 2, 2, stride=2)
 
-        self.conv = DoubleConv(in_ch, out_ch)
+        self.conv = DoubleConv(in_ch, out_ch, separable)
 
     def forward(self, x1, x2):
         x1 = self.up(x1)
-        diffX = x1.size()[2] - x2.size()[2]
-        diffY = x1.size()[3] - x2.size()[3]
-        x2 = F.pad(x2, (diffX // 2, int(diffX / 2), diffY // 2, int(diffY / 2)))
+        if x1.shape[2:] != x2.shape[2:]:
+            diffX = x1.size()[2] - x2.size()[2]
+            diffY = x1.size()[3] - x2.size()[3]
+            x2 = F.pad(x2, (diffX // 2, int(diffX / 2), diffY // 2, int(diffY / 2)))
         x = torch.cat([x2, x1], dim=1)
         x = self.conv(x)
         return x
@@ -0,0 +1,48 @@
+from types import MethodType
+import contextlib
+import warnings
+import torch
+from .network_parts import Outconv
+
+PRECISIONS = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def autocast(precision, device="cpu"):
+    """context running convs in precision, fp32 leaves the network unchanged"""
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device, dtype=dtype)
+
+
+def check_precision(precision, device="cpu"):
+    """raise ValueError when autocast on device falls back to fp32 for precision"""
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return
+    conv = torch.nn.Conv2d(1, 1, 3).to(device)
+    x = torch.zeros((1, 1, 8, 8), device=device)
+    with warnings.catch_warnings():
+        # autocast warns and disables itself for an unsupported dtype
+        warnings.simplefilter("ignore")
+        with autocast(precision, device):
+            y = conv(x)
+    if y.dtype != dtype:
+        raise ValueError("{} autocast is not supported on {}".format(precision, device))
+
+
+def fp32_forward(self, *inputs):
+    with torch.autocast(inputs[0].device.type, enabled=False):
+        return self._autocast_forward(*[x.float() for x in inputs])
+
+
+def keep_fp32(net, types=(Outconv,)):
+    """
+    modules of types run in fp32 under autocast. The output conv and sigmoid give the
+    response that peaks are thresholded on, so it is kept at full precision.
+    """
+    for module in net.modules():
+        if isinstance(module, types) and not hasattr(module, "_autocast_forward"):
+            module._autocast_forward = module.forward
+            module.forward = MethodType(fp32_forward, module)
+    return net
@@ -0,0 +1,92 @@
+from types import MethodType
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao import quantization
+from torch.ao.nn.quantized import FloatFunctional
+from .network_parts import DoubleConv, SeparableConv, Up
+
+
+class QuantUNet(nn.Module):
+    """UNet between quant and dequant stubs for eager static quantization"""
+
+    def __init__(self, net):
+        super(QuantUNet, self).__init__()
+        self.quant = quantization.QuantStub()
+        self.net = net
+        self.dequant = quantization.DeQuantStub()
+
+    def forward(self, x):
+        x = self.quant(x)
+        x = self.net(x)
+        x = self.dequant(x)
+        return x
+
+
+def quant_up_forward(self, x1, x2):
+    # same as Up.forward, but the concat goes through FloatFunctional so both
+    # inputs are requantized to a shared scale
+    x1 = self.up(x1)
+    if x1.shape[2:] != x2.shape[2:]:
+        diffX = x1.size()[2] - x2.size()[2]
+        diffY = x1.size()[3] - x2.size()[3]
+        x2 = F.pad(x2, (diffX // 2, int(diffX / 2), diffY // 2, int(diffY / 2)))
+    x = self.skip_cat.cat([x2, x1], dim=1)
+    x = self.conv(x)
+    return x
+
+
+def _fuse(net):
+    for module in net.modules():
+        if isinstance(module, DoubleConv):
+            groups = []
+            for i in range(0, len(module.conv), 3):
+                if isinstance(module.conv[i + 1], nn.BatchNorm2d):
+                    conv = "{}.pointwise" if isinstance(
+                        module.conv[i], SeparableConv
+                    ) else "{}"
+                    groups.append(
+                        [conv.format(i), "{}".format(i + 1), "{}".format(i + 2)]
+                    )
+            quantization.fuse_modules(module.conv, groups, inplace=True)
+        if isinstance(module, Up):
+            module.skip_cat = FloatFunctional()
+            module.forward = MethodType(quant_up_forward, module)
+
+
+def quantize_unet(net, calib_images, backend="fbgemm"):
+    """
+    post-training static int8 quantization of a float UNet
+    :param net: trained UNet (not modified)
+    :param calib_images: iterable of normalized float32 images [H, W]
+    :param backend: quantized engine, per-channel weights with fbgemm/x86
+    :return: quantized QuantUNet, runs on CPU only
+    """
+    torch.backends.quantized.engine = backend
+    model = QuantUNet(copy.deepcopy(net).cpu()).eval()
+    _fuse(model.net)
+
+    model.qconfig = quantization.get_default_qconfig(backend)
+    for module in model.modules():
+        # per-channel weights are not supported for transposed convs
+        if isinstance(module, nn.ConvTranspose2d):
+            module.qconfig = quantization.default_qconfig
+    quantization.prepare(model, inplace=True)
+
+    with torch.no_grad():
+        for img in calib_images:
+            model(torch.from_numpy(img).reshape((1, 1) + img.shape))
+
+    quantization.convert(model, inplace=True)
+    return model
+
+
+def export_quantized(model, save_path, shape=(512, 512)):
+    """trace the quantized model so Predict can load it with torch.jit.load"""
+    example = torch.rand((1, 1) + tuple(shape))
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, str(save_path))
+    return traced
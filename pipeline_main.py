@@ -0,0 +1,125 @@
+from pathlib import Path
+import argparse
+from networks import load_model
+from propagation import Pipeline
+from propagation.pipeline import INTERMEDIATES
+from utils import open_frames
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(
+        description="Detect, propagate and segment each frame in memory"
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        dest="input_path",
+        help="<input>/ori/*.png, a <input>/ori.tif stack or a stack file",
+        default="./image/test",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="output path",
+        default="./output/pipeline",
+        type=str,
+    )
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="load weight path",
+        default="./weights/best.pth",
+    )
+    parser.add_argument(
+        "-g", "--gpu", dest="gpu", help="whether use CUDA", action="store_true"
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fused",
+        dest="fused",
+        help="fold BatchNorm into the convs before inference",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pack",
+        dest="pack",
+        help="share backward passes between peaks with disjoint receptive fields",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--precision",
+        dest="precision",
+        help="autocast the forward pass to bf16 or fp16, the output layer stays fp32",
+        choices=["fp32", "bf16", "fp16"],
+        default="fp32",
+    )
+    parser.add_argument(
+        "--bp_thresh",
+        dest="bp_thresh",
+        help="responses below are background (response / 255, as in graphcut.m)",
+        default=0.01,
+        type=float,
+    )
+    parser.add_argument(
+        "--min_area",
+        dest="min_area",
+        help="fragments of a cell smaller than this are dropped [pixel]",
+        default=3,
+        type=int,
+    )
+    parser.add_argument(
+        "--save",
+        dest="save",
+        help="intermediates written to <output>/<frame>/",
+        nargs="*",
+        choices=INTERMEDIATES,
+        default=[],
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    input_path = Path(args.input_path)
+    if input_path.is_file():
+        args.input_path = open_frames(input_path, flags=0)
+    else:
+        args.input_path = open_frames(input_path.joinpath("ori"), "*.png", flags=0)
+    args.output_path = Path(args.output_path)
+
+    if Path(args.weight_path).suffix == ".pt":
+        raise ValueError(
+            "serialized graphs can not be patched with guided ReLU, "
+            "use the *_guided.pth written by export_model.py"
+        )
+    args.net = load_model(
+        args.weight_path,
+        fused=args.fused,
+        width=args.width,
+        depth=args.depth,
+        separable=args.separable,
+    )
+
+    Pipeline(args).main()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -3,7 +3,10 @@ from datetime import datetime
 from propagation import GuideCall
 from pathlib import Path
 import torch
-from networks import UNet
+from networks import load_model
+from utils import ResponseCache, LayerProfiler, model_key, open_frames
+from utils import BuildManifest, params_key, file_digest
+from utils import METRICS, start_exporters
 import argparse
 
 
@@ -38,20 +41,245 @@ def parse_args():
     parser.add_argument(
         "-g", "--gpu", dest="gpu", help="whether use CUDA", action="store_true"
     )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fused",
+        dest="fused",
+        help="fold BatchNorm into the convs before inference",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pack",
+        dest="pack",
+        help="share backward passes between peaks with disjoint receptive fields",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--check_pack",
+        dest="check_pack",
+        help="also run the per-peak path and print the max difference",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cache_path",
+        help="response cache shared with detection_predict.py",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--cache_size",
+        dest="cache_size",
+        help="max size of the response cache [MB]",
+        default=2048,
+        type=int,
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        help="reuse the responses of cells unchanged since the previous frame",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--move_tol",
+        dest="move_tol",
+        help="max motion of a reused cell [pixel]",
+        default=2,
+        type=float,
+    )
+    parser.add_argument(
+        "--image_tol",
+        dest="image_tol",
+        help="max mean abs change of the normalized input around a reused cell",
+        default=0.02,
+        type=float,
+    )
+    parser.add_argument(
+        "--link_dist",
+        dest="link_dist",
+        help="max distance to link a peak to the previous frame [pixel]",
+        default=10,
+        type=float,
+    )
+    parser.add_argument(
+        "--max_age",
+        dest="max_age",
+        help="frames a response is reused for at most before it is recomputed",
+        default=10,
+        type=int,
+    )
+    parser.add_argument(
+        "--storage",
+        dest="storage",
+        help="per-cell responses as dense arrays or bbox crops of float32, float16 or uint8",
+        choices=["dense", "float32", "float16", "uint8"],
+        default="float32",
+    )
+    parser.add_argument(
+        "--bp_thresh",
+        dest="bp_thresh",
+        help="responses below are dropped from the crops (response / 255, as in graphcut.m)",
+        default=0.01,
+        type=float,
+    )
+    parser.add_argument(
+        "--tile_size",
+        dest="tile_size",
+        help="propagate over tiles of this size, 0 propagates the whole frame",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--halo",
+        dest="halo",
+        help="overlap of the tiles, by default receptive field plus two region radii",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--preview_scale",
+        dest="preview_scale",
+        help="run on the frame resized by this factor, e.g. 0.25, and resize the "
+        "label, instance and detection back",
+        default=1.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--preview_check",
+        dest="preview_check",
+        help="also run every n-th frame at full resolution and report the instance IoU",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--preview_thresh",
+        dest="preview_thresh",
+        help="preview label keeps the pixels above this fraction of the max of each response",
+        default=0.3,
+        type=float,
+    )
+    parser.add_argument(
+        "--precision",
+        dest="precision",
+        help="autocast the forward pass to bf16 or fp16, the output layer stays fp32",
+        choices=["fp32", "bf16", "fp16"],
+        default="fp32",
+    )
+    parser.add_argument(
+        "--update",
+        dest="update",
+        help="only rebuild frames whose input, weights or parameters changed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--dry_run",
+        dest="dry_run",
+        help="list the frames --update would rebuild and exit",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile_path",
+        help="directory of the per-layer profile (trace.json, profile.txt)",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics_port",
+        dest="metrics_port",
+        help="serve the metrics in Prometheus text format on this port",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--metrics_path",
+        dest="metrics_path",
+        help="json snapshot of the metrics, rewritten every --metrics_interval seconds",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        dest="metrics_interval",
+        help="seconds between the json snapshots",
+        default=10,
+        type=float,
+    )
 
     args = parser.parse_args()
+    # the responses of a skipped frame would be needed to reuse them in the next
+    # one, and a changed frame would have to rebuild the frames reusing it
+    if args.incremental and (args.update or args.dry_run):
+        parser.error("--update and --dry_run can not be used with --incremental")
     return args
 
 
-if __name__ == "__main__":
-    args = parse_args()
-
-    args.input_path = sorted(Path(args.input_path).joinpath("ori").glob("*.png"))
+def main(args):
+    # <input>/ori/*.png, a <input>/ori.tif stack or a stack file
+    input_path = Path(args.input_path)
+    if input_path.is_file():
+        args.input_path = open_frames(input_path, flags=0)
+    else:
+        args.input_path = open_frames(input_path.joinpath("ori"), "*.png", flags=0)
     args.output_path = Path(args.output_path)
 
-    net = UNet(n_channels=1, n_classes=1)
-    net.load_state_dict(torch.load(args.weight_path, map_location="cpu"))
+    if Path(args.weight_path).suffix == ".pt":
+        raise ValueError(
+            "serialized graphs can not be patched with guided ReLU, "
+            "use the *_guided.pth written by export_model.py"
+        )
+    net = load_model(
+        args.weight_path,
+        fused=args.fused,
+        width=args.width,
+        depth=args.depth,
+        separable=args.separable,
+    )
     args.net = net
+    args.net_key = model_key(args.weight_path, args.fused, args.precision)
+    args.cache = None
+    if args.cache_path is not None:
+        args.cache = ResponseCache(args.cache_path, args.cache_size * 1024 ** 2)
 
     bp = GuideCall(args)
-    bp.main()
+    if args.update or args.dry_run:
+        weight_key = file_digest(args.weight_path) + ("_fused" if args.fused else "")
+        bp.manifest = BuildManifest(
+            args.output_path.joinpath("build_manifest.jsonl"),
+            params_key(weight_key, **bp.params()),
+            dry_run=args.dry_run,
+        )
+    profiler = None
+    if args.profile_path is not None:
+        profiler = LayerProfiler(bp.back_model).attach()
+        # one pass per peak or per packed group of peaks
+        profiler.wrap(bp.back_model, "backward_mask")
+    exporters = start_exporters(
+        METRICS, args.metrics_port, args.metrics_path, args.metrics_interval
+    )
+    try:
+        bp.main()
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    if bp.manifest is not None:
+        print(bp.manifest.report())
+    if profiler is not None:
+        print(profiler.save(args.profile_path))
+    if args.cache is not None:
+        print("response cache: {}".format(args.cache.stats()))
+
+
+if __name__ == "__main__":
+    main(parse_args())
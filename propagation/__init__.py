@@ -1 +1,3 @@
 from .guided_function import GuideCall
+from .segmentation import label_responses, instance_iou
+from .pipeline import Pipeline
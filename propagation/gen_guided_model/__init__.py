@@ -1 +1,5 @@
-from .guided_model import GuidedModel
\ No newline at end of file
+from .guided_model import GuidedModel
+from .temporal import TemporalReuse
+from .peak_packing import receptive_radius
+from .tiling import TiledPropagation
+from .sparse import SparseResponse, as_dense, pack_responses
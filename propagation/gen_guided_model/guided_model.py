@@ -1,7 +1,10 @@
 from types import MethodType
 import torch.nn as nn
 from .guided_parts import guide_relu
-from utils import local_maxima, gaus_filter
+from .peak_packing import receptive_radius, pack_regions
+from .sparse import SparseResponse, as_dense
+from utils import local_maxima, stamp_labels, weight_hash
+from networks import autocast
 from scipy.io import savemat
 import numpy as np
 import cv2
@@ -91,6 +94,30 @@ class GuidedModel(nn.Sequential):
         super().__init__(*args)
         self.inferencing = False
         self.shape = None
+        # peak detection and region assignment
+        self.peak_thresh = 125
+        self.dist_peak = 2
+        self.kernel_size = 401
+        self.sigma = 12
+        # share one backward pass between peaks whose receptive fields are apart
+        self.pack = False
+        self.check_pack = False
+        self.pack_error = None
+        self.n_backward = 0
+        # ResponseCache shared with detection
+        self.cache = None
+        self.cache_hit = False
+        self.net_key = None
+        # TemporalReuse for time-lapse sequences
+        self.temporal = None
+        self.n_recompute = 0
+        # None keeps dense responses, else SparseResponse storage of the crops
+        # thresholded at bp_thresh (in the units of graphcut.m, response / 255)
+        self.storage = None
+        self.bp_thresh = 0.0
+        # fp32, or bf16 / fp16 autocast of the forward pass, whose activations are
+        # what the graph keeps for the backward passes
+        self.precision = "fp32"
 
     def _patch(self):
         for module in self.modules():
@@ -103,6 +130,103 @@ class GuidedModel(nn.Sequential):
             if isinstance(module, nn.ReLU) and hasattr(module, "_original_forward"):
                 module.forward = module._original_forward
 
+    def detect(self, img):
+        """
+        forward pass and peaks of the detection response
+        :return: response tensor (graph kept for the backward passes), response map, peaks [x, y]
+        """
+        with autocast(self.precision, img.device.type):
+            class_response_maps = super().forward(img)
+        pre_img = class_response_maps.detach().float().cpu().numpy()[0, 0]
+        self.shape = pre_img.shape
+        if self.cache is None:
+            peaks = local_maxima(
+                (pre_img * 255).astype(np.uint8), self.peak_thresh, self.dist_peak
+            ).astype(int)
+            return class_response_maps, pre_img, peaks
+
+        # the graph is needed for the backward passes, only the peaks are reused
+        if self.net_key is None:
+            self.net_key = weight_hash(self[0], self.precision)
+        response, img_key, self.cache_hit = self.cache.response(
+            img.detach().cpu().numpy()[0, 0],
+            self.net_key,
+            lambda: (pre_img * 255).astype(np.uint8),
+        )
+        peaks = self.cache.peaks(
+            img_key, self.net_key, response, self.peak_thresh, self.dist_peak
+        )
+        return class_response_maps, pre_img, peaks
+
+    def assign_region(self, peaks):
+        """
+        :param peaks: peaks [x, y]
+        :return: region map, 0 is background and i is the region of peaks[i - 1]
+        """
+        region, _ = stamp_labels(
+            peaks, self.shape, self.sigma, self.kernel_size, thresh=0.01
+        )
+        return region
+
+    def backward_mask(self, img, class_response_maps, mask):
+        if img.grad is not None:
+            img.grad.zero_()
+        mask = mask.reshape([1, 1, self.shape[0], self.shape[1]])
+        mask = torch.from_numpy(mask).to(class_response_maps)
+
+        class_response_maps.backward(mask, retain_graph=True)
+        self.n_backward += 1
+        result = img.grad.detach().sum(1).clone().clamp(min=0).cpu().numpy()
+        return result[0]
+
+    def store(self, result, support):
+        """keep result in the configured storage, support is the region of the cell"""
+        if self.storage is None:
+            return result
+        return SparseResponse.from_dense(
+            result, self.bp_thresh * 255, self.storage, support
+        )
+
+    def propagate_each(self, img, class_response_maps, region, ids):
+        """one guided backward pass per region id"""
+        results = {}
+        for i in ids:
+            mask = np.zeros(self.shape, dtype=np.float32)
+            mask[region == i] = 1
+            result = self.backward_mask(img, class_response_maps, mask)
+            results[i] = self.store(result, mask > 0)
+        return results
+
+    def propagate_packed(self, img, class_response_maps, region, ids):
+        """
+        one guided backward pass per group of regions whose receptive footprints do not overlap,
+        the input gradient of the group is split back by the footprint of each region
+        """
+        radius = receptive_radius(getattr(self[0], "depth", 4))
+        groups, footprints = pack_regions(region, ids, radius)
+        results = {}
+        for group in groups:
+            mask = np.isin(region, group).astype(np.float32)
+            result = self.backward_mask(img, class_response_maps, mask)
+            if len(group) == 1:
+                results[group[0]] = self.store(result, region == group[0])
+                continue
+            for i in group:
+                results[i] = self.store(footprints[i].apply(result), region == i)
+        return results
+
+    def propagate(self, img, class_response_maps, region, ids):
+        if not self.pack:
+            return self.propagate_each(img, class_response_maps, region, ids)
+        results = self.propagate_packed(img, class_response_maps, region, ids)
+        if self.check_pack:
+            reference = self.propagate_each(img, class_response_maps, region, ids)
+            self.pack_error = max(
+                [np.abs(as_dense(results[i]) - as_dense(reference[i])).max() for i in ids]
+                + [0]
+            )
+        return results
+
     def forward(
         self,
         img,
@@ -117,61 +241,48 @@ class GuidedModel(nn.Sequential):
             img.requires_grad_()
 
         # classification network forwarding
-        class_response_maps = super().forward(img)
-        # peak backpropagation
-        # grad_output = mask
-
-        pre_img = class_response_maps.detach().cpu().numpy()[0, 0]
-        self.shape = pre_img.shape
-        if peak is None:
+        class_response_maps, pre_img, peaks = self.detect(img)
+        detection_path = root_path.joinpath("detection.png")
+        if peak is None and not (self.cache_hit and detection_path.exists()):
             cv2.imwrite(
-                str(root_path.joinpath("detection.png")),
+                str(detection_path),
                 (pre_img * 255).astype(np.uint8),
             )
-        # peak
-        peaks = local_maxima((pre_img * 255).astype(np.uint8), 125, 2).astype(np.int)
-
-        gauses = []
-        try:
-            for peak in peaks:
-                temp = np.zeros(self.shape)
-                temp[peak[1], peak[0]] = 255
-                gauses.append(gaus_filter(temp, 401, 12))
-            region = np.argmax(gauses, axis=0) + 1
-            likely_map = np.max(gauses, axis=0)
-            region[likely_map < 0.01] = 0
-            #
-            # r, g, b = np.loadtxt("./utils/color.csv", delimiter=",")
-        except ValueError:
-            region = np.zeros(self.shape, dtype=np.uint8)
-            likely_map = np.zeros(self.shape)
 
-        gbs = []
+        region = self.assign_region(peaks)
+
         # each propagate
+        self.n_backward = 0
+        ids = list(range(region.max() + 1))
+        reused = {}
+        if self.temporal is not None:
+            img_np = img.detach().cpu().numpy()[0, 0]
+            reused = self.temporal.reuse(img_np, peaks, region)
+        compute_ids = [i for i in ids if i not in reused]
+        results = self.propagate(img, class_response_maps, region, compute_ids)
+        results.update(reused)
+        self.n_recompute = len([i for i in compute_ids if i != 0])
+        if self.temporal is not None:
+            self.temporal.update(img_np, peaks, region, results)
+
+        gbs = []
         peaks = np.insert(peaks, 0, [0, 0], axis=0)
+        save_path = root_path.joinpath("each_peak")
+        save_path.mkdir(parents=True, exist_ok=True)
         with open(root_path.joinpath("peaks.txt"), mode="w") as f:
             f.write("ID,x,y\n")
-            for i in range(region.max() + 1):
-                if img.grad is not None:
-                    img.grad.zero_()
-                # f.write(f"{i},{peaks[i, 0]},{peaks[i ,1]}\n")
+            for i in ids:
                 f.write("{},{},{}\n".format(i, peaks[i, 0], peaks[i, 1]))
-                mask = np.zeros(self.shape, dtype=np.float32)
-                mask[region == i] = 1
-                mask = mask.reshape([1, 1, self.shape[0], self.shape[1]])
-                mask = torch.from_numpy(mask)
-                mask = mask.cuda()
-
-                class_response_maps.backward(mask, retain_graph=True)
-                result = img.grad.detach().sum(1).clone().clamp(min=0).cpu().numpy()
-
-                save_path = root_path.joinpath("each_peak")
-                save_path.mkdir(parents=True, exist_ok=True)
-                savemat(
-                    str(save_path.joinpath("{:04d}.mat".format(i))),
-                    {"image": result[0], "mask": mask},
-                )
-                gbs.append(result[0])
+                if isinstance(results[i], SparseResponse):
+                    # crop of the response and of the mask inside bbox
+                    entry = results[i].to_mat()
+                    mask = (region[results[i].window] == i).astype(np.float32)
+                else:
+                    entry = {"image": results[i]}
+                    mask = (region == i).astype(np.float32)
+                entry["mask"] = mask[np.newaxis, np.newaxis]
+                savemat(str(save_path.joinpath("{:04d}.mat".format(i))), entry)
+                gbs.append(results[i])
         return gbs
 
     def train(self, mode=True):
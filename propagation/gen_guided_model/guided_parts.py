@@ -1,31 +1,21 @@
-import torch
 from torch.autograd import Function
 
 
 class GuidedBackpropReLU(Function):
     @staticmethod
     def forward(ctx, input):
-        positive_mask = (input > 0).type_as(input)
-        output = torch.addcmul(
-            torch.zeros(input.size()).type_as(input), input, positive_mask
-        )
-        ctx.save_for_backward(input, output)
-        return output
+        # backward only needs where the input was positive, a bool mask is a
+        # quarter of an fp32 input and the output is not kept at all
+        positive_mask = input > 0
+        ctx.save_for_backward(positive_mask)
+        return input * positive_mask
 
     @staticmethod
     def backward(ctx, grad_output):
-        input, output = ctx.saved_variables
-
-        positive_mask_1 = (input > 0).type_as(grad_output)
-        positive_mask_2 = (grad_output > 0).type_as(grad_output)
-        grad_input = torch.addcmul(
-            torch.zeros(input.size()).type_as(input),
-            torch.addcmul(
-                torch.zeros(input.size()).type_as(input), grad_output, positive_mask_1
-            ),
-            positive_mask_2,
-        )
+        (positive_mask,) = ctx.saved_tensors
 
+        # pass the positive gradient where the input was positive
+        grad_input = grad_output.clamp(min=0) * positive_mask
         return grad_input
 
 
@@ -0,0 +1,91 @@
+import numpy as np
+import cv2
+from scipy.ndimage import find_objects
+
+
+def receptive_radius(depth=4):
+    """
+    upper bound of the UNet receptive field radius in input pixels
+    :param depth: number of down stages of the UNet
+    :return: radius, a gradient at one output pixel does not reach further
+    """
+    # two 3x3 convs in the input stage
+    radius = 2
+    jump = 1
+    for _ in range(depth):
+        # pooling window, then two 3x3 convs at the coarser stride
+        radius += jump
+        jump *= 2
+        radius += 2 * jump
+    for _ in range(depth):
+        # upsampling mixes neighbouring coarse pixels, then two 3x3 convs
+        radius += jump
+        jump //= 2
+        radius += 2 * jump
+    return radius
+
+
+class Footprint(object):
+    """pixels whose input gradient can depend on one region's mask"""
+
+    def __init__(self, window, mask):
+        self.window = window
+        self.mask = mask
+
+    def apply(self, result):
+        out = np.zeros_like(result)
+        out[self.window] = result[self.window] * self.mask
+        return out
+
+
+def region_footprints(region, ids, radius):
+    """
+    :param region: region map, region == i is the mask of peak i
+    :param ids: region ids
+    :param radius: receptive radius
+    :return: dict id -> Footprint
+    """
+    h, w = region.shape
+    objects = find_objects(region)
+    footprints = {}
+    for i in ids:
+        if i == 0 or i > len(objects) or objects[i - 1] is None:
+            # background covers the frame
+            footprints[i] = Footprint(
+                (slice(0, h), slice(0, w)), np.ones((h, w), dtype=bool)
+            )
+            continue
+        sy, sx = objects[i - 1]
+        window = (
+            slice(max(sy.start - radius, 0), min(sy.stop + radius, h)),
+            slice(max(sx.start - radius, 0), min(sx.stop + radius, w)),
+        )
+        outside = (region[window] != i).astype(np.uint8)
+        dist = cv2.distanceTransform(outside, cv2.DIST_L2, 5)
+        footprints[i] = Footprint(window, dist <= radius)
+    return footprints
+
+
+def pack_regions(region, ids, radius):
+    """
+    greedy colouring of the regions so that the footprints in a group do not overlap
+    :return: list of groups (lists of ids), dict id -> Footprint
+    """
+    footprints = region_footprints(region, ids, radius)
+    groups = []
+    occupied = []
+    # large footprints first, they are the hardest to place
+    order = sorted(ids, key=lambda i: -footprints[i].mask.sum())
+    for i in order:
+        fp = footprints[i]
+        for group, occ in zip(groups, occupied):
+            if not (occ[fp.window] & fp.mask).any():
+                group.append(i)
+                occ[fp.window] |= fp.mask
+                break
+        else:
+            occ = np.zeros(region.shape, dtype=bool)
+            occ[fp.window] = fp.mask
+            groups.append([i])
+            occupied.append(occ)
+    return groups, footprints
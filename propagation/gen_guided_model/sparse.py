@@ -0,0 +1,107 @@
+import numpy as np
+
+STORAGES = ("float32", "float16", "uint8")
+
+
+class SparseResponse(object):
+    """
+    per-cell response kept as its bounding box [y0, x0, y1, x1] and the crop inside it.
+    Values below thresh are zeroed and left out of the box. float16 halves the crop,
+    uint8 stores round(value / scale) with scale = max / 255.
+    """
+
+    __slots__ = ("bbox", "data", "scale", "shape")
+
+    def __init__(self, bbox, data, shape, scale=1.0):
+        self.bbox = tuple(int(v) for v in bbox)
+        self.data = data
+        self.shape = tuple(shape)
+        self.scale = float(scale)
+
+    @classmethod
+    def from_dense(cls, dense, thresh=0.0, storage="float32", support=None):
+        """
+        :param dense: [H, W] response
+        :param thresh: values below are dropped
+        :param storage: one of STORAGES
+        :param support: bool mask the box must also cover, e.g. the region of the cell
+        """
+        keep = dense > thresh if thresh > 0 else dense != 0
+        inside = keep if support is None else keep | support
+        ys = np.flatnonzero(inside.any(axis=1))
+        xs = np.flatnonzero(inside.any(axis=0))
+        if len(ys) == 0:
+            return cls((0, 0, 0, 0), np.zeros((0, 0), np.dtype(storage)), dense.shape)
+        bbox = (ys[0], xs[0], ys[-1] + 1, xs[-1] + 1)
+        window = (slice(bbox[0], bbox[2]), slice(bbox[1], bbox[3]))
+        crop = np.where(keep[window], dense[window], 0)
+        if storage == "uint8":
+            scale = max(float(crop.max()), 1e-12) / 255
+            data = np.round(crop / scale).clip(0, 255).astype(np.uint8)
+            return cls(bbox, data, dense.shape, scale)
+        return cls(bbox, crop.astype(storage), dense.shape)
+
+    @property
+    def window(self):
+        return slice(self.bbox[0], self.bbox[2]), slice(self.bbox[1], self.bbox[3])
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def crop(self):
+        """float32 values inside the box"""
+        return self.data.astype(np.float32) * np.float32(self.scale)
+
+    def dense(self):
+        out = np.zeros(self.shape, np.float32)
+        out[self.window] = self.crop()
+        return out
+
+    def max(self):
+        return float(self.data.max()) * self.scale if self.data.size else 0.0
+
+    def shifted(self, dy, dx):
+        """translated by (dy, dx), the part leaving the frame is cut off"""
+        h, w = self.shape
+        y0, x0, y1, x1 = self.bbox
+        ny0, nx0 = max(y0 + dy, 0), max(x0 + dx, 0)
+        ny1, nx1 = min(y1 + dy, h), min(x1 + dx, w)
+        if ny0 >= ny1 or nx0 >= nx1:
+            return SparseResponse((0, 0, 0, 0), self.data[:0, :0], self.shape, self.scale)
+        data = self.data[ny0 - dy - y0 : ny1 - dy - y0, nx0 - dx - x0 : nx1 - dx - x0]
+        return SparseResponse((ny0, nx0, ny1, nx1), data, self.shape, self.scale)
+
+    def to_mat(self):
+        # matlab has no half type, float16 crops are saved as single
+        data = self.data.astype(np.float32) if self.data.dtype == np.float16 else self.data
+        return {
+            "image": data,
+            "bbox": np.array(self.bbox),
+            "shape": np.array(self.shape),
+            "scale": self.scale,
+        }
+
+
+def as_dense(response):
+    """dense [H, W] array of a SparseResponse or an array"""
+    if isinstance(response, SparseResponse):
+        return response.dense()
+    return response
+
+
+def pack_responses(responses):
+    """
+    :param responses: list of SparseResponse
+    :return: dict for savemat, the crops flattened one after another
+    """
+    return {
+        "bbox": np.array([r.bbox for r in responses]).reshape(-1, 4),
+        "offset": np.cumsum([0] + [r.data.size for r in responses])[:-1],
+        "scale": np.array([r.scale for r in responses]),
+        "shape": np.array(responses[0].shape if responses else (0, 0)),
+        "data": np.concatenate(
+            [r.to_mat()["image"].ravel() for r in responses]
+            or [np.zeros(0, np.float32)]
+        ),
+    }
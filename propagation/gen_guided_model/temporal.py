@@ -0,0 +1,126 @@
+import numpy as np
+from scipy.ndimage import find_objects
+from utils import optimum
+from .sparse import SparseResponse
+
+
+def shift(img, dy, dx):
+    """translate img by (dy, dx) with zero fill"""
+    out = np.zeros_like(img)
+    h, w = img.shape[:2]
+    if abs(dy) >= h or abs(dx) >= w:
+        return out
+    out[max(dy, 0) : h + min(dy, 0), max(dx, 0) : w + min(dx, 0)] = img[
+        max(-dy, 0) : h + min(-dy, 0), max(-dx, 0) : w + min(-dx, 0)
+    ]
+    return out
+
+
+def neighbours(region, objects, i):
+    """region ids touching region i"""
+    if i > len(objects) or objects[i - 1] is None:
+        return set()
+    sy, sx = objects[i - 1]
+    window = region[
+        max(sy.start - 1, 0) : sy.stop + 1, max(sx.start - 1, 0) : sx.stop + 1
+    ]
+    return set(np.unique(window)) - {0, i}
+
+
+class TemporalReuse(object):
+    """
+    reuse the propagation response of cells that did not change since the previous frame.
+    A cell is reused when it is linked to a previous peak moved by at most move_tol pixels,
+    its touching regions are the same linked cells, which also stayed within move_tol,
+    and the input within its receptive footprint changed by at most image_tol
+    (mean absolute difference of the normalized image after undoing the motion).
+    The input is compared with the frame the response was computed on, not the
+    previous one, so a slow drift adds up, and a response is recomputed at the latest
+    max_age frames after it was computed.
+    The reused response is the previous one translated by the motion.
+    """
+
+    def __init__(self, radius, move_tol=2, image_tol=0.02, link_dist=10, max_age=10):
+        self.radius = radius
+        self.move_tol = move_tol
+        self.image_tol = image_tol
+        self.link_dist = link_dist
+        self.max_age = max_age
+        self.prev = None
+        # region id -> source of the reused responses of the last reuse call
+        self.reused_sources = {}
+
+    def link(self, peaks):
+        """
+        :return: dict current peak index -> previous peak index
+        """
+        prev_peaks = self.prev["peaks"]
+        if len(peaks) == 0 or len(prev_peaks) == 0:
+            return {}
+        associate_id = optimum(prev_peaks, peaks, self.link_dist).astype(int)
+        return {cur: prev for prev, cur in associate_id}
+
+    def reuse(self, img, peaks, region):
+        """
+        :param img: normalized input [H, W]
+        :param peaks: peaks [x, y], region i belongs to peaks[i - 1]
+        :param region: region map
+        :return: dict region id -> reused response
+        """
+        self.reused_sources = {}
+        if self.prev is None or img.shape != self.prev["img"].shape:
+            return {}
+        links = self.link(peaks)
+        motion = {
+            cur: peaks[cur] - self.prev["peaks"][prev] for cur, prev in links.items()
+        }
+        still = {
+            cur for cur, d in motion.items() if np.hypot(d[0], d[1]) <= self.move_tol
+        }
+
+        objects = find_objects(region)
+        prev_objects = find_objects(self.prev["region"])
+        h, w = region.shape
+        reused = {}
+        for cur in still:
+            i = cur + 1
+            nbs = neighbours(region, objects, i)
+            if any(nb - 1 not in still for nb in nbs):
+                continue
+            prev_nbs = neighbours(self.prev["region"], prev_objects, links[cur] + 1)
+            if {links[nb - 1] + 1 for nb in nbs} != prev_nbs:
+                continue
+
+            # the frame the previous response was computed on, and the motion since
+            source_img, source_dy, source_dx, age = self.prev["sources"][links[cur] + 1]
+            if age + 1 > self.max_age:
+                continue
+            dx, dy = motion[cur]
+            sy, sx = objects[i - 1]
+            window = (
+                slice(max(sy.start - self.radius, 0), min(sy.stop + self.radius, h)),
+                slice(max(sx.start - self.radius, 0), min(sx.stop + self.radius, w)),
+            )
+            source_dy, source_dx = source_dy + dy, source_dx + dx
+            moved = shift(source_img, source_dy, source_dx)
+            if np.abs(img[window] - moved[window]).mean() > self.image_tol:
+                continue
+            prev_result = self.prev["results"][links[cur] + 1]
+            if isinstance(prev_result, SparseResponse):
+                reused[i] = prev_result.shifted(dy, dx)
+            else:
+                reused[i] = shift(prev_result, dy, dx)
+            self.reused_sources[i] = (source_img, source_dy, source_dx, age + 1)
+        return reused
+
+    def update(self, img, peaks, region, results):
+        """results of the frame, those not given by the last reuse were computed on img"""
+        sources = {i: self.reused_sources.get(i, (img, 0, 0, 0)) for i in results}
+        self.reused_sources = {}
+        self.prev = {
+            "img": img,
+            "peaks": peaks,
+            "region": region,
+            "results": results,
+            "sources": sources,
+        }
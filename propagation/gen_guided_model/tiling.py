@@ -0,0 +1,150 @@
+import numpy as np
+import torch
+from numpy.lib.format import open_memmap
+from scipy.io import savemat
+from .peak_packing import receptive_radius, region_footprints
+from .sparse import as_dense
+from utils import region_radius
+
+
+def round_up(x, align):
+    return -(-x // align) * align
+
+
+def tile_windows(shape, tile_size, halo):
+    """
+    :param shape: image shape [H, W]
+    :return: list of (core, window) slices, the cores partition the image
+             and each window is its core grown by halo
+    """
+    h, w = shape[:2]
+    tiles = []
+    for y in range(0, h, tile_size):
+        for x in range(0, w, tile_size):
+            core = (slice(y, min(y + tile_size, h)), slice(x, min(x + tile_size, w)))
+            window = (
+                slice(max(y - halo, 0), min(y + tile_size + halo, h)),
+                slice(max(x - halo, 0), min(x + tile_size + halo, w)),
+            )
+            tiles.append((core, window))
+    return tiles
+
+
+class TiledPropagation(object):
+    """
+    guided backpropagation over overlapping tiles of an image too large for one graph.
+    The halo covers the regions of the peaks in the core, the peaks competing for those
+    regions and the receptive field around both, so each peak is propagated once by the
+    tile whose core contains it and memory is bounded by (tile_size + 2 * halo) ** 2.
+    Responses are cropped to the receptive footprint of their region and saved with
+    the bounding box [y0, x0, y1, x1] in image coordinates.
+    """
+
+    def __init__(self, model, tile_size=1024, halo=None):
+        depth = getattr(model[0], "depth", 4)
+        # windows start on the pooling grid of the full image
+        self.align = 2 ** depth
+        self.radius = receptive_radius(depth)
+        if halo is None:
+            reach = min(region_radius(model.sigma), model.kernel_size // 2)
+            halo = self.radius + 2 * reach
+        self.model = model
+        self.tile_size = round_up(tile_size, self.align)
+        self.halo = round_up(halo, self.align)
+        self.n_tiles = 0
+
+    def __call__(self, img, root_path, scale, device, coloring):
+        """
+        :param img: [H, W] array, a memory-mapped frame is read tile by tile
+        :param scale: the network input is img / scale
+        :param coloring: function (response, cell id) -> [h, w, 3] uint8
+        :return: number of cells
+        """
+        model = self.model
+        save_path = root_path.joinpath("each_peak")
+        save_path.mkdir(parents=True, exist_ok=True)
+        detection = open_memmap(
+            str(root_path.joinpath("detection.npy")),
+            mode="w+",
+            dtype=np.uint8,
+            shape=img.shape[:2],
+        )
+        instance = open_memmap(
+            str(root_path.joinpath("instance.npy")),
+            mode="w+",
+            dtype=np.uint8,
+            shape=img.shape[:2] + (3,),
+        )
+
+        model.n_backward = 0
+        tiles = tile_windows(img.shape, self.tile_size, self.halo)
+        self.n_tiles = len(tiles)
+        cell = 0
+        with root_path.joinpath("peaks.txt").open(mode="w") as f:
+            f.write("ID,x,y\n")
+            # the background is not propagated per tile, an empty entry keeps the numbering
+            f.write("0,0,0\n")
+            savemat(
+                str(save_path.joinpath("0000.mat")),
+                {
+                    "image": np.zeros((0, 0), dtype=np.float32),
+                    "mask": np.zeros((1, 1, 0, 0), dtype=np.float32),
+                    "bbox": np.zeros(4, dtype=int),
+                    "shape": np.array(img.shape[:2]),
+                    "scale": 1.0,
+                },
+            )
+            for core, window in tiles:
+                oy, ox = window[0].start, window[1].start
+                x = np.asarray(img[window], dtype=np.float32) / scale
+                # the UNet needs sizes divisible by the pooling factor, tiles at the border are zero padded
+                th, tw = x.shape
+                x = np.pad(
+                    x,
+                    ((0, round_up(th, self.align) - th), (0, round_up(tw, self.align) - tw)),
+                )
+                x = torch.from_numpy(x[np.newaxis, np.newaxis]).to(device)
+                x.requires_grad_()
+
+                class_response_maps, pre_img, peaks = model.detect(x)
+                local_core = (
+                    slice(core[0].start - oy, core[0].stop - oy),
+                    slice(core[1].start - ox, core[1].stop - ox),
+                )
+                detection[core] = (pre_img[local_core] * 255).astype(np.uint8)
+
+                # peaks owned by this tile
+                region = model.assign_region(peaks)
+                ids = [
+                    i + 1
+                    for i, (px, py) in enumerate(peaks)
+                    if local_core[0].start <= py < local_core[0].stop
+                    and local_core[1].start <= px < local_core[1].stop
+                ]
+                results = model.propagate(x, class_response_maps, region, ids)
+                footprints = region_footprints(region, ids, self.radius)
+                for i in ids:
+                    cell += 1
+                    fy, fx = footprints[i].window
+                    fy, fx = slice(fy.start, min(fy.stop, th)), slice(fx.start, min(fx.stop, tw))
+                    bbox = np.array([fy.start + oy, fx.start + ox, fy.stop + oy, fx.stop + ox])
+                    response = as_dense(results[i])[fy, fx]
+                    mask = (region[fy, fx] == i).astype(np.float32)
+                    f.write("{},{},{}\n".format(cell, peaks[i - 1, 0] + ox, peaks[i - 1, 1] + oy))
+                    savemat(
+                        str(save_path.joinpath("{:04d}.mat".format(cell))),
+                        {
+                            "image": response,
+                            "mask": mask[np.newaxis, np.newaxis],
+                            "bbox": bbox,
+                            # as SparseResponse.to_mat, graphcut.m multiplies by scale
+                            "shape": np.array(img.shape[:2]),
+                            "scale": 1.0,
+                        },
+                    )
+                    target = (slice(bbox[0], bbox[2]), slice(bbox[1], bbox[3]))
+                    instance[target] = np.maximum(instance[target], coloring(response, cell))
+                del class_response_maps, x
+        detection.flush()
+        instance.flush()
+        return cell
@@ -1,10 +1,13 @@
-from .gen_guided_model import GuidedModel
+from .gen_guided_model import GuidedModel, TemporalReuse, TiledPropagation, receptive_radius
+from .gen_guided_model import pack_responses, as_dense
+from .segmentation import label_responses, instance_iou
+from utils import as_frame_source, METRICS, StageMetrics, tree_bytes
+from networks import check_precision, keep_fp32
 import torch
 import numpy as np
-from PIL import Image
 import cv2
-import matplotlib.pyplot as plt
 from scipy.io import savemat
+from time import perf_counter
 
 
 class GuideCall(object):
@@ -22,34 +25,156 @@ class GuideCall(object):
 
         self.back_model = GuidedModel(self.net)
         self.back_model.inference()
+        self.back_model.pack = getattr(args, "pack", False)
+        self.back_model.check_pack = getattr(args, "check_pack", False)
+        self.back_model.cache = getattr(args, "cache", None)
+        self.back_model.net_key = getattr(args, "net_key", None)
+        storage = getattr(args, "storage", "dense")
+        self.back_model.storage = None if storage == "dense" else storage
+        self.back_model.bp_thresh = getattr(args, "bp_thresh", 0.0)
+        self.back_model.precision = getattr(args, "precision", "fp32")
+        if self.back_model.precision != "fp32":
+            check_precision(self.back_model.precision, "cuda" if self.gpu else "cpu")
+            keep_fp32(self.net)
+        if getattr(args, "incremental", False):
+            self.back_model.temporal = TemporalReuse(
+                receptive_radius(getattr(self.net, "depth", 4)),
+                move_tol=args.move_tol,
+                image_tol=args.image_tol,
+                link_dist=args.link_dist,
+                max_age=getattr(args, "max_age", 10),
+            )
+            with self.output_path.joinpath("recompute.txt").open(mode="w") as f:
+                f.write("frame,cells,recomputed,ratio\n")
+        self.colors = np.loadtxt("./utils/color.csv", delimiter=",")
+        self.tiled = None
+        if getattr(args, "tile_size", 0):
+            assert self.back_model.temporal is None, "tiles can not be reused over time"
+            self.tiled = TiledPropagation(self.back_model, args.tile_size, args.halo)
+        # preview of a resized frame, checked against full resolution every
+        # preview_check frames
+        self.preview_scale = getattr(args, "preview_scale", 1.0)
+        self.preview_check = getattr(args, "preview_check", 0)
+        self.preview_thresh = getattr(args, "preview_thresh", 0.3)
+        if self.preview_scale != 1.0:
+            assert self.tiled is None, "preview runs on the whole frame"
+            assert self.back_model.temporal is None, "preview cells are not reused"
+            with self.output_path.joinpath("preview.txt").open(mode="w") as f:
+                f.write("frame,cells,preview_s,full_cells,full_s,mean_iou,matched\n")
         self.shape = None
         self.output_path_each = None
+        # BuildManifest, frames built from the same input and parameters are skipped
+        self.manifest = None
+        registry = getattr(args, "metrics", METRICS)
+        self.metrics = StageMetrics(registry, "propagate")
+        self.backward = registry.counter(
+            "backward_passes_total", "guided backward passes", stage="propagate"
+        )
+        self.backward_rate = registry.gauge(
+            "backward_passes_per_second",
+            "backward passes per second of the last frame",
+            stage="propagate",
+        )
+
+    def params(self):
+        """parameters the outputs depend on, besides the weights"""
+        module = self.back_model
+        params = {
+            "stage": "propagate",
+            "peak_thresh": module.peak_thresh,
+            "dist_peak": module.dist_peak,
+            "kernel_size": module.kernel_size,
+            "sigma": module.sigma,
+            "pack": module.pack,
+            "storage": module.storage,
+            "bp_thresh": module.bp_thresh,
+            "precision": module.precision,
+        }
+        if self.tiled is not None:
+            params["tile"] = [self.tiled.tile_size, self.tiled.halo]
+        if self.preview_scale != 1.0:
+            params["preview"] = [
+                self.preview_scale,
+                self.preview_check,
+                self.preview_thresh,
+            ]
+        return params
+
+    def outputs(self, name):
+        instance = "instance.npy" if self.tiled is not None else "instance.png"
+        return [self.output_path.joinpath(name, instance)]
 
     def main(self):
-        for img_i, path in enumerate(self.input_path):
-            self.output_path_each = self.output_path.joinpath("{:05d}".format(img_i))
-            self.output_path_each.mkdir(parents=True, exist_ok=True)
-
-            # load image
-            img = cv2.imread(str(path), 0)
-            self.shape = img.shape
-            cv2.imwrite(
-                str(self.output_path_each.joinpath("original.png")),
-                ((img / img.max()) * 255).astype(np.uint8),
-            )
+        # list of image paths or FrameSource
+        frames = as_frame_source(self.input_path, flags=0)
+        for img_i in range(len(frames)):
+            self.metrics.pending.set(len(frames) - img_i - 1)
+            if self.manifest is None:
+                self.process(img_i, frames[img_i])
+                continue
+            name = "{:05d}".format(img_i)
+            inputs = [(frames, img_i)]
+            if self.manifest.reason(name, inputs, self.outputs(name)) is None:
+                continue
+            if not self.manifest.dry_run:
+                self.process(img_i, frames[img_i])
+                self.manifest.done(name, inputs)
 
-            img = (img.astype(np.float32) / img.max()).reshape(
-                (1, 1, img.shape[0], img.shape[1])
-            )
-            img = torch.from_numpy(img)
+    def process(self, img_i, img, name=None):
+        """
+        :param name: output directory of the frame, the zero padded index by default
+        """
+        name = name if name is not None else "{:05d}".format(img_i)
+        self.output_path_each = self.output_path.joinpath(name)
+        self.output_path_each.mkdir(parents=True, exist_ok=True)
+
+        start = perf_counter()
+        read_bytes = img.nbytes
+        if self.preview_scale != 1.0:
+            cells = self.process_preview(img_i, img)
+            self.record(perf_counter() - start, read_bytes, cells)
+            return
+        if self.tiled is not None:
+            cells = self.process_tiled(img_i, img)
+            self.record(perf_counter() - start, read_bytes, cells)
+            return
+
+        self.shape = img.shape
+        original = ((img / img.max()) * 255).astype(np.uint8)
 
-            # throw unet
-            if self.gpu:
-                img = img.cuda()
+        img = (img.astype(np.float32) / img.max()).reshape(
+            (1, 1, img.shape[0], img.shape[1])
+        )
+        img = torch.from_numpy(img)
 
-            module = self.back_model
-            prms = module(img, self.output_path_each)
+        # throw unet
+        if self.gpu:
+            img = img.cuda()
+
+        module = self.back_model
+        prms = module(img, self.output_path_each)
+        original_path = self.output_path_each.joinpath("original.png")
+        if not (module.cache_hit and original_path.exists()):
+            cv2.imwrite(str(original_path), original)
+        if module.temporal is not None:
+            cells = len(prms) - 1
+            ratio = module.n_recompute / cells if cells else 0.0
+            print(
+                "{:05d}: recomputed {}/{} cells ({:.1%})".format(
+                    img_i, module.n_recompute, cells, ratio
+                )
+            )
+            with self.output_path.joinpath("recompute.txt").open(mode="a") as f:
+                f.write("{},{},{},{:.4f}\n".format(img_i, cells, module.n_recompute, ratio))
+        if module.pack:
+            text = "{:05d}: {} cells, {} backward passes".format(
+                img_i, len(prms) - 1, module.n_backward
+            )
+            if module.check_pack:
+                text += ", max diff to per-peak {:.3e}".format(module.pack_error)
+            print(text)
 
+        if module.storage is None:
             prms = np.array(prms)
             prms_coloring = self.coloring(prms)
 
@@ -61,28 +186,184 @@ class GuideCall(object):
             )
 
             prms_coloring = np.max(prms_coloring, axis=0)
+        else:
+            # crops in bbox, the colored instance is composed box by box
+            savemat(
+                str(self.output_path_each.joinpath("prms.mat")), pack_responses(prms)
+            )
+            prms_coloring = self.composite(prms)
+
+        prms_coloring = (
+            prms_coloring.astype(float) / prms_coloring.max() * 255
+        ).astype(np.uint8)
 
-            prms_coloring = (
-                prms_coloring.astype(np.float) / prms_coloring.max() * 255
-            ).astype(np.uint8)
+        cv2.imwrite(
+            str(self.output_path_each.joinpath("instance.png")),
+            prms_coloring.astype(np.uint8),
+        )
+        self.record(perf_counter() - start, read_bytes, len(prms) - 1)
 
-            cv2.imwrite(
-                str(self.output_path_each.joinpath("instance.png")),
-                prms_coloring.astype(np.uint8),
+    def record(self, seconds, read_bytes, cells):
+        """metrics of a processed frame"""
+        n_backward = self.back_model.n_backward
+        self.backward.inc(n_backward)
+        self.backward_rate.set(n_backward / seconds if seconds else 0.0)
+        self.metrics.frame(seconds, read_bytes, tree_bytes(self.output_path_each), cells)
+
+    def propagate_scaled(self, img, scale):
+        """
+        guided backpropagation of img resized by scale, with the region sigma scaled
+        alike. The peaks are detected at full resolution without keeping the graph,
+        the network misses cells that are smaller than the ones it was trained on.
+        Labels of a resized frame keep the pixels above preview_thresh of the max of
+        each response.
+        :return: label (at the resized shape), responses, peaks [x, y] of the resized
+            frame, detection at full resolution
+        """
+        module = self.back_model
+        x = torch.from_numpy((img / img.max()).astype(np.float32)[None, None])
+        if self.gpu:
+            x = x.cuda()
+        if scale != 1.0:
+            with torch.no_grad():
+                _, pre_img, peaks = module.detect(x)
+            # the UNet output matches its input for sizes divisible by 2 ** depth
+            step = 2 ** getattr(module[0], "depth", 4)
+            size = (
+                max(int(img.shape[1] * scale) // step * step, step),
+                max(int(img.shape[0] * scale) // step * step, step),
+            )
+            x = torch.nn.functional.interpolate(x, size=size[::-1], mode="area")
+            peaks = np.round(peaks * scale).astype(int)
+            peaks = np.minimum(np.maximum(peaks, 0), [size[0] - 1, size[1] - 1])
+        x.requires_grad_()
+
+        sigma, kernel_size, bp_thresh = module.sigma, module.kernel_size, module.bp_thresh
+        module.sigma, module.kernel_size = sigma * scale, int(kernel_size * scale) | 1
+        if scale != 1.0:
+            # the responses of a downsampled frame are weaker, the storage keeps them
+            # all and they are thresholded after the rescale below
+            module.bp_thresh = 0.0
+        try:
+            module.n_backward = 0
+            class_response_maps, full_pre_img, full_peaks = module.detect(x)
+            if scale == 1.0:
+                pre_img, peaks = full_pre_img, full_peaks
+            region = module.assign_region(peaks)
+            ids = list(range(1, len(peaks) + 1))
+            results = module.propagate(x, class_response_maps, region, ids)
+        finally:
+            module.sigma, module.kernel_size = sigma, kernel_size
+            module.bp_thresh = bp_thresh
+        responses = [results[i] for i in ids]
+        thresh = max(module.bp_thresh, 0.01)
+        if scale != 1.0:
+            # the response of a downsampled cell is weaker by a factor that depends on
+            # the network, each is rescaled to 255 at its max and thresholded relative
+            responses = [
+                as_dense(r) * (255 / max(float(as_dense(r).max()), 1e-12))
+                for r in responses
+            ]
+            thresh = self.preview_thresh
+        label = label_responses(responses, peaks, module.shape, thresh)
+        return label, responses, peaks, pre_img
+
+    def process_preview(self, img_i, img):
+        """
+        detection, guided backpropagation and label of the frame resized by
+        preview_scale, the outputs are resized back to the frame
+        :return: number of cells
+        """
+        h, w = img.shape
+        start = perf_counter()
+        label, responses, peaks, pre_img = self.propagate_scaled(img, self.preview_scale)
+        # the responses of a resized frame are dense, whatever the storage
+        instance = np.zeros(label.shape + (3,))
+        for peak_i, response in enumerate(responses):
+            instance = np.maximum(instance, self.color_cell(response, peak_i))
+        instance = cv2.resize(instance, (w, h), interpolation=cv2.INTER_LINEAR)
+        instance = instance / max(instance.max(), 1e-12) * 255
+        label = cv2.resize(label, (w, h), interpolation=cv2.INTER_NEAREST)
+        peaks = np.round(peaks / self.preview_scale).astype(int)
+        seconds = perf_counter() - start
+
+        path = self.output_path_each
+        cv2.imwrite(str(path.joinpath("instance.png")), instance.astype(np.uint8))
+        cv2.imwrite(str(path.joinpath("label.tif")), label)
+        cv2.imwrite(str(path.joinpath("detection.png")), (pre_img * 255).astype(np.uint8))
+        with path.joinpath("peaks.txt").open(mode="w") as f:
+            f.write("ID,x,y\n0,0,0\n")
+            for i, peak in enumerate(peaks, 1):
+                f.write("{},{},{}\n".format(i, peak[0], peak[1]))
+
+        row = [img_i, len(peaks), "{:.4f}".format(seconds), "", "", "", ""]
+        text = "{:05d}: preview {} cells in {:.2f} s".format(img_i, len(peaks), seconds)
+        if self.preview_check and img_i % self.preview_check == 0:
+            start = perf_counter()
+            full, _, full_peaks, _ = self.propagate_scaled(img, 1.0)
+            full_seconds = perf_counter() - start
+            ious = instance_iou(full, label)
+            mean_iou = float(ious.mean()) if len(ious) else 1.0
+            matched = float((ious >= 0.5).mean()) if len(ious) else 1.0
+            row[3:] = [
+                len(full_peaks),
+                "{:.4f}".format(full_seconds),
+                "{:.4f}".format(mean_iou),
+                "{:.4f}".format(matched),
+            ]
+            text += ", full {} cells in {:.2f} s ({:.1f}x), instance IoU {:.3f}".format(
+                len(full_peaks), full_seconds, full_seconds / seconds, mean_iou
             )
+            text += ", {:.0%} matched with IoU >= 0.5".format(matched)
+        with self.output_path.joinpath("preview.txt").open(mode="a") as f:
+            f.write(",".join(str(v) for v in row) + "\n")
+        print(text)
+        return len(peaks)
+
+    def process_tiled(self, img_i, img):
+        """whole-slide mode, responses are cropped and instance.npy is stitched on disk"""
+        cells = self.tiled(
+            img,
+            self.output_path_each,
+            float(img.max()),
+            "cuda" if self.gpu else "cpu",
+            lambda gb, peak_i: self.color_cell(gb, peak_i).astype(np.uint8),
+        )
+        print(
+            "{:05d}: {} cells in {} tiles (tile {}, halo {}), {} backward passes".format(
+                img_i,
+                cells,
+                self.tiled.n_tiles,
+                self.tiled.tile_size,
+                self.tiled.halo,
+                self.back_model.n_backward,
+            )
+        )
+        return cells
 
     def coloring(self, gbs):
-        # coloring
-        r, g, b = np.loadtxt("./utils/color.csv", delimiter=",")
         gbs_coloring = []
         for peak_i, gb in enumerate(gbs):
-            gb = gb / gb.max() * 255
-            gb = gb.clip(0, 255).astype(np.uint8)
-            result = np.ones((self.shape[0], self.shape[1], 3))
-            result = gb[..., np.newaxis] * result
-            peak_i = peak_i % 20
-            result[..., 0][result[..., 0] != 0] = r[peak_i] * gb[gb != 0]
-            result[..., 1][result[..., 1] != 0] = g[peak_i] * gb[gb != 0]
-            result[..., 2][result[..., 2] != 0] = b[peak_i] * gb[gb != 0]
-            gbs_coloring.append(result)
+            gbs_coloring.append(self.color_cell(gb, peak_i))
         return gbs_coloring
+
+    def composite(self, gbs):
+        """max of the colored SparseResponse crops"""
+        result = np.zeros((self.shape[0], self.shape[1], 3))
+        for peak_i, gb in enumerate(gbs):
+            window = gb.window
+            result[window] = np.maximum(result[window], self.color_cell(gb.crop(), peak_i))
+        return result
+
+    def color_cell(self, gb, peak_i):
+        # coloring
+        r, g, b = self.colors
+        gb = gb / max(gb.max(), 1e-12) * 255
+        gb = gb.clip(0, 255).astype(np.uint8)
+        result = np.ones((gb.shape[0], gb.shape[1], 3))
+        result = gb[..., np.newaxis] * result
+        peak_i = peak_i % 20
+        result[..., 0][result[..., 0] != 0] = r[peak_i] * gb[gb != 0]
+        result[..., 1][result[..., 1] != 0] = g[peak_i] * gb[gb != 0]
+        result[..., 2][result[..., 2] != 0] = b[peak_i] * gb[gb != 0]
+        return result
@@ -0,0 +1,158 @@
+from time import perf_counter
+from .gen_guided_model import GuidedModel, pack_responses
+from .segmentation import label_responses
+from utils import as_frame_source
+from networks import check_precision, keep_fp32
+from scipy.io import savemat
+import numpy as np
+import cv2
+import torch
+
+STAGES = ("read", "detect", "propagate", "segment", "write")
+INTERMEDIATES = ("original", "detection", "peaks", "responses", "instance")
+
+
+class Pipeline(object):
+    """
+    detection, guided backpropagation and segmentation of each frame in one process.
+    The detection response is the forward pass the backward passes run on, and the
+    responses go to the segmentation as arrays, so only the label image (and the
+    intermediates asked for) is written.
+    """
+
+    def __init__(self, args):
+        self.input_path = args.input_path
+        self.output_path = args.output_path
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        self.label_path = self.output_path.joinpath("label")
+        self.label_path.mkdir(parents=True, exist_ok=True)
+
+        self.gpu = args.gpu
+        self.net = args.net
+        self.net.eval()
+        if self.gpu:
+            self.net.cuda()
+
+        self.model = GuidedModel(self.net)
+        self.model.inference()
+        self.model.pack = getattr(args, "pack", False)
+        # crops keep the segmentation to the box of each cell
+        self.model.storage = "float32"
+        self.model.bp_thresh = getattr(args, "bp_thresh", 0.01)
+        self.model.precision = getattr(args, "precision", "fp32")
+        if self.model.precision != "fp32":
+            check_precision(self.model.precision, "cuda" if self.gpu else "cpu")
+            keep_fp32(self.net)
+        self.min_area = getattr(args, "min_area", 3)
+        self.save = set(getattr(args, "save", None) or [])
+        self.colors = np.loadtxt("./utils/color.csv", delimiter=",")
+
+        self.timing_path = self.output_path.joinpath("timings.csv")
+        with self.timing_path.open(mode="w") as f:
+            f.write(
+                "frame,cells,backward,{},total_s\n".format(
+                    ",".join(stage + "_s" for stage in STAGES)
+                )
+            )
+
+    def main(self):
+        frames = as_frame_source(self.input_path, flags=0)
+        for img_i in range(len(frames)):
+            self.process(frames, img_i)
+
+    def process(self, frames, img_i):
+        """
+        :return: uint16 label, i is the cell of ID i of peaks.txt
+        """
+        times = {}
+        name = "{:05d}".format(img_i)
+
+        start = perf_counter()
+        img = frames[img_i]
+        times["read"] = perf_counter() - start
+
+        start = perf_counter()
+        x = torch.from_numpy(
+            (img.astype(np.float32) / img.max()).reshape(1, 1, *img.shape)
+        )
+        if self.gpu:
+            x = x.cuda()
+        x.requires_grad_()
+        class_response_maps, pre_img, peaks = self.model.detect(x)
+        times["detect"] = perf_counter() - start
+
+        start = perf_counter()
+        region = self.model.assign_region(peaks)
+        ids = list(range(1, len(peaks) + 1))
+        self.model.n_backward = 0
+        results = self.model.propagate(x, class_response_maps, region, ids)
+        responses = [results[i] for i in ids]
+        # free the graph before the next frame
+        del class_response_maps
+        times["propagate"] = perf_counter() - start
+
+        start = perf_counter()
+        label = label_responses(
+            responses, peaks, img.shape, self.model.bp_thresh, self.min_area
+        )
+        times["segment"] = perf_counter() - start
+
+        start = perf_counter()
+        cv2.imwrite(str(self.label_path.joinpath(name + ".tif")), label)
+        if self.save:
+            self.save_intermediate(name, img, pre_img, peaks, responses)
+        times["write"] = perf_counter() - start
+
+        with self.timing_path.open(mode="a") as f:
+            f.write(
+                "{},{},{},{},{:.4f}\n".format(
+                    img_i,
+                    len(peaks),
+                    self.model.n_backward,
+                    ",".join("{:.4f}".format(times[stage]) for stage in STAGES),
+                    sum(times.values()),
+                )
+            )
+        print(
+            "{}: {} cells, {}".format(
+                name,
+                len(peaks),
+                ", ".join("{} {:.2f} s".format(k, times[k]) for k in STAGES),
+            )
+        )
+        return label
+
+    def save_intermediate(self, name, img, pre_img, peaks, responses):
+        """the files of propagate_main.py that were asked for"""
+        path = self.output_path.joinpath(name)
+        path.mkdir(parents=True, exist_ok=True)
+        if "original" in self.save:
+            original = (img / img.max() * 255).astype(np.uint8)
+            cv2.imwrite(str(path.joinpath("original.png")), original)
+        if "detection" in self.save:
+            cv2.imwrite(
+                str(path.joinpath("detection.png")), (pre_img * 255).astype(np.uint8)
+            )
+        if "peaks" in self.save:
+            with path.joinpath("peaks.txt").open(mode="w") as f:
+                # id 0 is the background as in propagate_main.py
+                f.write("ID,x,y\n0,0,0\n")
+                for i, peak in enumerate(peaks, 1):
+                    f.write("{},{},{}\n".format(i, peak[0], peak[1]))
+        if "responses" in self.save:
+            savemat(str(path.joinpath("prms.mat")), pack_responses(responses))
+        if "instance" in self.save:
+            instance = np.zeros(img.shape + (3,))
+            for peak_i, response in enumerate(responses, 1):
+                window = response.window
+                instance[window] = np.maximum(
+                    instance[window], self.color_cell(response.crop(), peak_i)
+                )
+            instance = instance / max(instance.max(), 1e-12) * 255
+            cv2.imwrite(str(path.joinpath("instance.png")), instance.astype(np.uint8))
+
+    def color_cell(self, gb, peak_i):
+        r, g, b = self.colors
+        gb = gb / max(gb.max(), 1e-12)
+        peak_i = peak_i % 20
+        return gb[..., np.newaxis] * np.array([r[peak_i], g[peak_i], b[peak_i]])
@@ -0,0 +1,155 @@
+from time import perf_counter
+from pathlib import Path
+import argparse
+import numpy as np
+import cv2
+import torch
+from networks import load_model
+from networks.network_quantize import quantize_unet, export_quantized
+from detection_predict import PredictFmeasure
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(description="Post-training int8 quantization")
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="load weight path",
+        default="./weight/best.pth",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="path of the quantized graph",
+        default="./weight/best_int8.pt",
+        type=str,
+    )
+    parser.add_argument(
+        "-c",
+        "--calib_path",
+        dest="calib_path",
+        help="calibration frames",
+        default="./image/train/ori",
+        type=str,
+    )
+    parser.add_argument(
+        "-n",
+        "--calib_num",
+        dest="calib_num",
+        help="number of calibration frames",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        dest="input_path",
+        help="test dataset's path for the F-measure report",
+        default="./image/test",
+        type=str,
+    )
+    parser.add_argument(
+        "-s",
+        "--image_size",
+        dest="image_size",
+        help="height and width the graph is traced with",
+        nargs=2,
+        default=[512, 512],
+        type=int,
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--backend",
+        dest="backend",
+        help="quantized engine the graph runs on, qnnpack for ARM",
+        choices=["fbgemm", "qnnpack"],
+        default="fbgemm",
+    )
+    parser.add_argument(
+        "--skip_eval",
+        dest="skip_eval",
+        help="only quantize, do not run the F-measure report",
+        action="store_true",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def load_calib_images(path, num):
+    paths = sorted(list(path.glob("*.tif")) + list(path.glob("*.png")))[:num]
+    assert len(paths) > 0, "no calibration frame in {}".format(path)
+    images = []
+    for img_path in paths:
+        img = cv2.imread(str(img_path), 0)
+        images.append(img.astype(np.float32) / img.max())
+    return images
+
+
+def throughput(net, shape, repeat=5):
+    img = torch.rand((1, 1) + tuple(shape))
+    with torch.no_grad():
+        net(img)
+        start = perf_counter()
+        for _ in range(repeat):
+            net(img)
+    return repeat / (perf_counter() - start)
+
+
+def report(models, args):
+    args.save_path.mkdir(parents=True, exist_ok=True)
+    text = "model,precision,recall,f-measure,frames/s\n"
+    results = []
+    for name, net in models:
+        args.net = net
+        args.output_path = args.save_path.joinpath(name)
+        if args.skip_eval:
+            precision = recall = f_measure = float("nan")
+        else:
+            precision, recall, f_measure = PredictFmeasure(args).main()
+        fps = throughput(net, args.image_size)
+        results.append([precision, recall, f_measure, fps])
+        text += "{},{:.4f},{:.4f},{:.4f},{:.3f}\n".format(name, *results[-1])
+    text += "f-measure drop: {:.4f}\nthroughput gain: {:.2f}x\n".format(
+        results[0][2] - results[1][2], results[1][3] / results[0][3]
+    )
+    print(text)
+    with args.save_path.joinpath("quantization.txt").open(mode="w") as f:
+        f.write(text)
+    return text
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.input_path = Path(args.input_path)
+    args.gpu = False
+
+    net = load_model(
+        args.weight_path, width=args.width, depth=args.depth, separable=args.separable
+    )
+    net.eval()
+
+    calib_images = load_calib_images(Path(args.calib_path), args.calib_num)
+    model = quantize_unet(net, calib_images, args.backend)
+    output_path = Path(args.output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    traced = export_quantized(model, output_path, args.image_size)
+
+    args.save_path = output_path.parent.joinpath(output_path.stem)
+    report([("fp32", net), ("int8", traced)], args)
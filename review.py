@@ -9,20 +9,23 @@ from utils import (
     optimum,
     remove_outside_plot,
     show_res,
-    gaus_filter,
+    stamp_labels,
 )
 import collections
-from utils import EvaluationMethods
+from utils import EvaluationMethods, as_frame_source, open_frames
+
+
+def gray_frame(img):
+    """8 bit single channel frame, as cv2.imread(path, 0) returns"""
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img.astype(np.uint8)
 
 
 class UseMethods(EvaluationMethods):
     def evaluation_all(self, dataset, method, debug):
         evaluations = []
-        for path in zip(self.pred_paths, self.target_path):
-            pred = cv2.imread(str(path[0]), -1)
-
-            target = cv2.imread(str(path[1]), -1)
-
+        for pred, target in zip(self.pred_frames, self.target_frames):
             assert pred.shape == target.shape, print("defferent shape")
             if debug:
                 plt.imshow(pred), plt.show()
@@ -30,15 +33,17 @@ class UseMethods(EvaluationMethods):
             evaluations = self.update_evaluation(pred, target, debug=debug)
         self.review(evaluations)
 
-    def noize_off(self):
-        for img_i, path in enumerate(
-            zip(self.pred_paths, self.target_path)
+    def noize_off(self, detection_path):
+        detection_frames = as_frame_source(detection_path, flags=0)
+        output_path = self.pred_frames.root.parent.joinpath("sophisticated_pred")
+        output_path.mkdir(parents=True, exist_ok=True)
+        for img_i, (pred, detection) in enumerate(
+            zip(self.pred_frames, detection_frames)
         ):
-            pred = cv2.imread(str(path[0]), 0)
+            pred = gray_frame(pred)
             label_image = cv2.connectedComponents(pred)[1]
 
             # get peal
-            detection = cv2.imread(str(path[2]), 0)
             plots = local_maxim(detection, 100, 2)
 
             # only peak segment
@@ -62,30 +67,24 @@ class UseMethods(EvaluationMethods):
                     peak_index = np.where(values == key)[0]
                     local_peaks = plots[peak_index]
 
-                    # gather peak value
-                    local_masks = []
-                    for peak in local_peaks:
-                        local_mask = np.zeros(multi_segment_mask.shape)
-                        local_mask[int(peak[1]), int(peak[0])] = 255
-                        local_masks.append(gaus_filter(local_mask, 201, 9))
-                    index_mask = np.array(local_masks).argmax(axis=0)
+                    # nearest peak, the full kernel keeps far pixels assigned
+                    index_mask, _ = stamp_labels(
+                        local_peaks, pred.shape, 9, 201, truncate=None
+                    )
+                    index_mask = np.maximum(index_mask - 1, 0)
 
                     for i in range(index_mask.max()):
                         temp = np.zeros(pred.shape)
                         temp[index_mask == i] = multi_segment_mask[index_mask == i]
                         new_pred[temp > 0] = label
                         label += 1
-            output_path = path[0].parent.parent.joinpath("sophisticated_pred")
-            output_path.mkdir(parents=True, exist_ok=True)
             np.save(output_path.joinpath(f"{img_i:05d}.npy"), new_pred)
 
     def bensh(self):
-        for img_i, path in enumerate(zip(self.pred_paths, self.target_path)):
-            pred = cv2.imread(str(path[0]), 0)
-            label_image = cv2.connectedComponents(pred)[1]
-
-            output_path = path[0].parent.parent.joinpath("sophisticated_pred")
-            output_path.mkdir(parents=True, exist_ok=True)
+        output_path = self.pred_frames.root.parent.joinpath("sophisticated_pred")
+        output_path.mkdir(parents=True, exist_ok=True)
+        for img_i, pred in enumerate(self.pred_frames):
+            label_image = cv2.connectedComponents(gray_frame(pred))[1]
             np.save(output_path.joinpath(f"{img_i:05d}.npy"), label_image)
 
 
@@ -121,12 +120,11 @@ class LinearReview(UseMethods):
         return pred_centers, target_centers
 
     def evaluate(self):
-        for path in zip(self.pred_paths, self.target_path):
-            pred = cv2.imread(str(path[0]))
+        for pred, target in zip(self.pred_frames, self.target_frames):
+            if pred.ndim == 2:
+                pred = cv2.cvtColor(pred, cv2.COLOR_GRAY2BGR)
             gray = cv2.cvtColor(pred, cv2.COLOR_BGR2GRAY)
 
-            target = cv2.imread(str(path[1]), 0)
-
             # threshold
             thresh, bin_img = cv2.threshold(
                 gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
@@ -163,10 +161,9 @@ class LinearReview(UseMethods):
 
     def evaluation_all(self, debug=False):
         evaluations = []
-        for path in zip(self.pred_paths, self.target_path):
-            pred = cv2.imread(str(path[0]), 0)
-            pred = cv2.connectedComponents(pred)[1]
-            target = cv2.imread(str(path[1]), 0)
+        for pred, target in zip(self.pred_frames, self.target_frames):
+            pred = cv2.connectedComponents(gray_frame(pred))[1]
+            target = gray_frame(target)
             # target = np.load(str(path[1])).astype(np.uint8)
             evaluations = self.update_evaluation(pred, target, debug)
         self.review(evaluations)
@@ -174,20 +171,12 @@ class LinearReview(UseMethods):
 
 if __name__ == "__main__":
 
-    target_path = sorted(
-        Path(f"target path").glob("*.tif")
-    )
+    # directories of frames or multi-page tiff stacks
+    target_path = open_frames(Path(f"target path"), "*.tif")
 
-    pred_path = Path(
-        f"pred path"
-    )
-    pred_paths = sorted(pred_path.glob("*.tif"))
+    pred_paths = open_frames(Path(f"pred path"), "*.tif")
 
-    detection_path = sorted(
-        Path("detection path").glob(
-            "*.tif"
-        )
-    )
+    detection_path = open_frames(Path("detection path"), "*.tif", flags=0)
     save_path = Path(f"save path")
     save_path.mkdir(parents=True, exist_ok=True)
     assert len(target_path) > 0, print("target_no_data")
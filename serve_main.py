@@ -0,0 +1,137 @@
+from pathlib import Path
+import argparse
+from networks import load_model
+from serving import InferenceService, make_server
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(description="Local inference server")
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="load weight path",
+        default="./weight/best.pth",
+    )
+    parser.add_argument(
+        "-g", "--gpu", dest="gpu", help="whether use CUDA", action="store_true"
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fused",
+        dest="fused",
+        help="fold BatchNorm into the convs before inference",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--host", dest="host", help="address to listen on", default="127.0.0.1", type=str
+    )
+    parser.add_argument(
+        "-p", "--port", dest="port", help="port to listen on", default=8080, type=int
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        help="listen on this unix socket instead of tcp",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--max_batch",
+        dest="max_batch",
+        help="max detection requests run as one batch",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--max_wait",
+        dest="max_wait",
+        help="max wait for a batch to fill [ms]",
+        default=10,
+        type=float,
+    )
+    parser.add_argument(
+        "--max_queue",
+        dest="max_queue",
+        help="detection requests waiting before new ones are rejected with 503",
+        default=64,
+        type=int,
+    )
+    parser.add_argument(
+        "--propagate_queue",
+        dest="propagate_queue",
+        help="propagation requests waiting before new ones are rejected with 503",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        help="seconds a request waits for its result before 504",
+        default=120,
+        type=float,
+    )
+    parser.add_argument(
+        "--pack",
+        dest="pack",
+        help="share backward passes between peaks with disjoint receptive fields",
+        action="store_true",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if Path(args.weight_path).suffix == ".pt":
+        raise ValueError(
+            "serialized graphs can not be patched with guided ReLU, "
+            "use the *_guided.pth written by export_model.py"
+        )
+    net = load_model(
+        args.weight_path,
+        fused=args.fused,
+        width=args.width,
+        depth=args.depth,
+        separable=args.separable,
+    )
+    service = InferenceService(
+        net,
+        gpu=args.gpu,
+        max_batch=args.max_batch,
+        max_wait=args.max_wait / 1000,
+        max_queue=args.max_queue,
+        propagate_queue=args.propagate_queue,
+        pack=args.pack,
+    )
+    server = make_server(
+        service, args.host, args.port, args.socket_path, timeout=args.timeout
+    )
+    print(
+        "serving on {}".format(
+            args.socket_path or "http://{}:{}".format(args.host, args.port)
+        )
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,3 @@
+from .batcher import DynamicBatcher
+from .server import InferenceService, make_server
+from .client import ServingClient
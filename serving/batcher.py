@@ -0,0 +1,121 @@
+import threading
+import queue
+from collections import deque
+from concurrent.futures import Future
+from time import perf_counter
+
+
+class DynamicBatcher(object):
+    """
+    worker thread running fn on batches of the submitted items.
+    A batch starts with the oldest item and takes the items that arrive within max_wait
+    seconds, up to max_batch items with the same key (items of another key wait for
+    the next batch). submit raises queue.Full when max_queue items are waiting, including
+    the ones set aside for the next batch. Items still waiting when closed fail with
+    RuntimeError. closed is set as soon as close is called, the running batch is
+    finished after it.
+    """
+
+    def __init__(self, fn, max_batch=8, max_wait=0.01, max_queue=64, key=None):
+        """
+        :param fn: list of items -> list of results
+        :param key: item -> hashable, only items with equal keys are batched together
+        """
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.key = key if key is not None else (lambda item: None)
+        self.max_queue = max_queue
+        self.queue = queue.Queue()
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.batch_sizes = {}
+        self.n_items = 0
+        self.n_errors = 0
+        self.busy_seconds = 0.0
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """
+        :return: Future of the result of item
+        """
+        future = Future()
+        with self.lock:
+            if self.closed.is_set():
+                raise RuntimeError("batcher is closed")
+            if self.depth() >= self.max_queue:
+                raise queue.Full
+            self.queue.put_nowait((item, future))
+        return future
+
+    def depth(self):
+        return self.queue.qsize() + len(self.pending)
+
+    def close(self):
+        with self.lock:
+            self.closed.set()
+        self.thread.join()
+        entries = list(self.pending)
+        self.pending.clear()
+        while True:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for _, future in entries:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("batcher closed before the item ran"))
+
+    def _next(self, timeout):
+        if self.pending:
+            return self.pending.popleft()
+        return self.queue.get(timeout=timeout)
+
+    def _collect(self):
+        try:
+            first = self._next(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        key = self.key(first[0])
+        deadline = perf_counter() + self.max_wait
+        skipped = []
+        while len(batch) < self.max_batch:
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._next(timeout=remaining)
+            except queue.Empty:
+                break
+            if self.key(entry[0]) == key:
+                batch.append(entry)
+            else:
+                skipped.append(entry)
+        self.pending.extendleft(reversed(skipped))
+        return batch
+
+    def _run(self):
+        while not self.closed.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            # requests cancelled by a client timeout are dropped
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            start = perf_counter()
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                self.n_errors += len(batch)
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            self.busy_seconds += perf_counter() - start
+            self.n_items += len(batch)
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
@@ -0,0 +1,80 @@
+import base64
+import http.client
+import json
+import socket
+import numpy as np
+import cv2
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(str(self.socket_path))
+
+
+def decode_png(text):
+    return cv2.imdecode(
+        np.frombuffer(base64.b64decode(text), np.uint8), cv2.IMREAD_UNCHANGED
+    )
+
+
+class ServingClient(object):
+    """
+    client of serve_main.py, over tcp with host and port or over a unix socket
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, socket_path=None, timeout=60):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def connection(self):
+        if self.socket_path is not None:
+            return UnixHTTPConnection(self.socket_path, self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None):
+        """
+        :return: status code, json body
+        """
+        conn = self.connection()
+        try:
+            conn.request(method, path, body=body)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def post_frame(self, name, img, response=False):
+        """
+        :param name: "detect" or "propagate"
+        :param img: 2d array, sent as png
+        :return: status code, json body with the png fields decoded to arrays
+        """
+        body = cv2.imencode(".png", img)[1].tobytes()
+        path = "/{}?response={}".format(name, int(response))
+        status, result = self.request("POST", path, body)
+        if status == 200:
+            result["peaks"] = np.array(result["peaks"], dtype=int).reshape(-1, 2)
+            for key in ("label", "response"):
+                if key in result:
+                    result[key] = decode_png(result[key])
+        return status, result
+
+    def detect(self, img, response=False):
+        return self.post_frame("detect", img, response)
+
+    def propagate(self, img, response=False):
+        return self.post_frame("propagate", img, response)
+
+    def health(self):
+        return self.request("GET", "/health")
+
+    def metrics(self):
+        return self.request("GET", "/metrics")
@@ -0,0 +1,260 @@
+import base64
+import copy
+import json
+import os
+import queue
+import socketserver
+import threading
+from collections import deque
+from concurrent.futures import TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import cv2
+import torch
+from propagation.gen_guided_model import GuidedModel
+from utils import local_maxima
+from .batcher import DynamicBatcher
+
+
+def decode_image(body):
+    """encoded image file (png, tif, ...) -> 2d array"""
+    img = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError("body is not an image file")
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+
+def encode_png(img):
+    return base64.b64encode(cv2.imencode(".png", img)[1].tobytes()).decode("ascii")
+
+
+def normalize(img):
+    img = img.astype(np.float32)
+    return img / max(float(img.max()), 1e-12)
+
+
+class InferenceService(object):
+    """
+    detection batched by DynamicBatcher and propagation on its own worker,
+    with bounded queues and latency metrics
+    """
+
+    def __init__(
+        self,
+        net,
+        gpu=False,
+        max_batch=8,
+        max_wait=0.01,
+        max_queue=64,
+        propagate_queue=4,
+        peak_thresh=100,
+        dist_peak=2,
+        mask_thresh=0.1,
+        pack=False,
+    ):
+        self.device = "cuda" if gpu else "cpu"
+        self.net = net.to(self.device).eval()
+        # the guided ReLU patch must not touch the batched detection network
+        self.guided = GuidedModel(copy.deepcopy(self.net))
+        self.guided.inference()
+        self.guided.pack = pack
+        self.peak_thresh = peak_thresh
+        self.dist_peak = dist_peak
+        self.mask_thresh = mask_thresh
+
+        self.detector = DynamicBatcher(
+            self.detect_batch, max_batch, max_wait, max_queue, key=lambda img: img.shape
+        )
+        self.propagator = DynamicBatcher(
+            self.propagate_batch, 1, 0, propagate_queue
+        )
+        self.started = perf_counter()
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.rejected = {}
+        self.latency = {"detect": deque(maxlen=1000), "propagate": deque(maxlen=1000)}
+
+    def detect_batch(self, imgs):
+        x = torch.from_numpy(np.stack([normalize(img) for img in imgs])[:, np.newaxis])
+        with torch.no_grad():
+            responses = self.net(x.to(self.device)).cpu().numpy()[:, 0]
+        responses = (responses * 255).astype(np.uint8)
+        return [
+            (response, local_maxima(response, self.peak_thresh, self.dist_peak))
+            for response in responses
+        ]
+
+    def propagate_batch(self, imgs):
+        img = torch.from_numpy(normalize(imgs[0])[np.newaxis, np.newaxis])
+        img = img.to(self.device).requires_grad_()
+        model = self.guided
+        class_response_maps, pre_img, peaks = model.detect(img)
+        region = model.assign_region(peaks)
+        ids = list(range(1, len(peaks) + 1))
+        results = model.propagate(img, class_response_maps, region, ids)
+
+        # instance mask, each pixel to the strongest cell above mask_thresh of its max
+        label = np.zeros(pre_img.shape, np.uint16)
+        if ids:
+            stack = np.stack(
+                [results[i] / max(results[i].max(), 1e-12) for i in ids]
+            )
+            label = (stack.argmax(axis=0) + 1).astype(np.uint16)
+            label[stack.max(axis=0) < self.mask_thresh] = 0
+        return [((pre_img * 255).astype(np.uint8), peaks, label)]
+
+    def record(self, name, table):
+        with self.lock:
+            table[name] = table.get(name, 0) + 1
+
+    def call(self, name, img, timeout):
+        """
+        :return: result of the worker, raises queue.Full or TimeoutError
+        """
+        worker = self.detector if name == "detect" else self.propagator
+        start = perf_counter()
+        try:
+            future = worker.submit(img)
+        except queue.Full:
+            self.record(name, self.rejected)
+            raise
+        self.record(name, self.requests)
+        try:
+            result = future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+        self.latency[name].append(perf_counter() - start)
+        return result
+
+    def metrics(self):
+        metrics = {
+            "uptime_s": perf_counter() - self.started,
+            "requests": dict(self.requests),
+            "rejected": dict(self.rejected),
+        }
+        for name, worker in (("detect", self.detector), ("propagate", self.propagator)):
+            latency = np.array(self.latency[name]) * 1000
+            metrics[name] = {
+                "queue": worker.depth(),
+                "processed": worker.n_items,
+                "errors": worker.n_errors,
+                "busy_s": worker.busy_seconds,
+                "batch_sizes": {str(k): v for k, v in sorted(worker.batch_sizes.items())},
+                "latency_ms": {
+                    "mean": float(latency.mean()) if len(latency) else None,
+                    "p50": float(np.percentile(latency, 50)) if len(latency) else None,
+                    "p95": float(np.percentile(latency, 95)) if len(latency) else None,
+                },
+            }
+        return metrics
+
+    def close(self):
+        self.detector.close()
+        self.propagator.close()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    POST /detect, POST /propagate with an encoded image as body,
+    GET /health, GET /metrics, all answered with json
+    """
+
+    service = None
+    timeout_s = 120.0
+
+    def address_string(self):
+        # unix sockets have no client address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self.reply(
+                200,
+                {
+                    "status": "ok",
+                    "detect_queue": self.service.detector.depth(),
+                    "propagate_queue": self.service.propagator.depth(),
+                },
+            )
+        elif path == "/metrics":
+            self.reply(200, self.service.metrics())
+        else:
+            self.reply(404, {"error": "unknown path {}".format(path)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        name = url.path.strip("/")
+        if name not in ("detect", "propagate"):
+            self.reply(404, {"error": "unknown path {}".format(url.path)})
+            return
+        query = parse_qs(url.query)
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            img = decode_image(body)
+        except ValueError as e:
+            self.reply(400, {"error": str(e)})
+            return
+
+        start = perf_counter()
+        try:
+            result = self.service.call(name, img, self.timeout_s)
+        except queue.Full:
+            self.reply(503, {"error": "{} queue is full".format(name)})
+            return
+        except TimeoutError:
+            self.reply(504, {"error": "no result within {} s".format(self.timeout_s)})
+            return
+        except Exception as e:
+            self.reply(500, {"error": repr(e)})
+            return
+
+        body = {
+            "shape": list(img.shape),
+            "peaks": result[1].astype(int).tolist(),
+            "latency_ms": (perf_counter() - start) * 1000,
+        }
+        if name == "propagate":
+            body["label"] = encode_png(result[2])
+        if query.get("response", ["0"])[0] == "1":
+            body["response"] = encode_png(result[0])
+        self.reply(200, body)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        # BaseHTTPRequestHandler expects these from HTTPServer
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def make_server(service, host="127.0.0.1", port=8080, socket_path=None, timeout=120.0):
+    handler = type(
+        "Handler", (ServiceHandler,), {"service": service, "timeout_s": timeout}
+    )
+    if socket_path is not None:
+        return UnixHTTPServer(str(socket_path), handler)
+    return ThreadingHTTPServer((host, port), handler)
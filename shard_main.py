@@ -0,0 +1,298 @@
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import perf_counter
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import cv2
+import torch
+from networks import load_model
+from propagation import GuideCall
+from detection_predict import Predict
+from utils import open_frames, ShardManifest, parse_shard, split_range
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(
+        description="Run detection or propagation over frames in worker processes"
+    )
+    parser.add_argument(
+        "stage", help="detect or propagate", choices=["detect", "propagate"]
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        dest="input_path",
+        help="frames as detection_predict.py (*.tif) or propagate_main.py (<input>/ori) "
+        "read them",
+        default="./image/test",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="output path",
+        default="./output/shard",
+        type=str,
+    )
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="load weight path",
+        default="./weight/best.pth",
+    )
+    parser.add_argument(
+        "-g", "--gpu", dest="gpu", help="whether use CUDA", action="store_true"
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fused",
+        dest="fused",
+        help="fold BatchNorm into the convs before inference",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        dest="workers",
+        help="worker processes on this node, each with its own model",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        dest="threads",
+        help="torch and OpenCV threads of each worker",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--affinity",
+        dest="affinity",
+        help="pin worker k to its own block of cores",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--shard",
+        dest="shard",
+        help="part i/N of the manifest this node runs, 0/1 runs all",
+        default="0/1",
+        type=str,
+    )
+    parser.add_argument(
+        "--manifest",
+        dest="manifest_path",
+        help="frame list shared by the nodes, written from the input when missing "
+        "(default <output>/manifest.json)",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--pack",
+        dest="pack",
+        help="share backward passes between peaks with disjoint receptive fields",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--storage",
+        dest="storage",
+        help="per-cell responses as dense arrays or bbox crops of float32, float16 or uint8",
+        choices=["dense", "float32", "float16", "uint8"],
+        default="float32",
+    )
+    parser.add_argument(
+        "--bp_thresh",
+        dest="bp_thresh",
+        help="responses below are dropped from the crops (response / 255, as in graphcut.m)",
+        default=0.01,
+        type=float,
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def open_input(stage, input_path):
+    """frames in the layout of detection_predict.py or propagate_main.py"""
+    input_path = Path(input_path)
+    if stage == "detect":
+        return open_frames(input_path, "*.tif")
+    # <input>/ori/*.png, a <input>/ori.tif stack or a stack file
+    if input_path.is_file():
+        return open_frames(input_path, flags=0)
+    return open_frames(input_path.joinpath("ori"), "*.png", flags=0)
+
+
+def pin_threads(threads, worker_i=None):
+    """
+    one worker uses threads cores, the default pools of torch and OpenCV would each
+    take every core and oversubscribe the node
+    :param worker_i: pin to cores [worker_i * threads, (worker_i + 1) * threads)
+    """
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # already set once in this process
+        pass
+    cv2.setNumThreads(threads)
+    if worker_i is not None and hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        block = cores[worker_i * threads : (worker_i + 1) * threads]
+        if block:
+            os.sched_setaffinity(0, block)
+
+
+def run_worker(args, start, stop, worker_i):
+    """
+    process global frames [start, stop) in this process
+    :return: stats of the worker
+    """
+    pin_threads(args.threads, worker_i if args.affinity else None)
+
+    net = load_model(
+        args.weight_path,
+        fused=args.fused,
+        width=args.width,
+        depth=args.depth,
+        separable=args.separable,
+    )
+    if args.gpu:
+        torch.cuda.set_device(worker_i % torch.cuda.device_count())
+        net.cuda()
+    frames = open_input(args.stage, args.input_path)
+    worker_args = Namespace(**vars(args))
+    worker_args.net = net
+    worker_args.cache = None
+
+    if args.stage == "detect":
+        predict = Predict(worker_args)
+        predict.net.eval()
+
+        def process(i, img):
+            # the files Predict.main writes
+            pre_img = predict.pred(img)
+            cv2.imwrite(str(predict.save_pred_path / Path("%05d.tif" % i)), pre_img)
+            cv2.imwrite(str(predict.save_ori_path / Path("%05d.tif" % i)), img)
+
+    else:
+        worker_args.input_path = []
+        guide = GuideCall(worker_args)
+        process = guide.process
+
+    busy = 0.0
+    for i in range(start, stop):
+        img = frames[i]
+        frame_start = perf_counter()
+        # output of frame i is named by i as in a single process run
+        process(i, img)
+        busy += perf_counter() - frame_start
+    return {
+        "worker": worker_i,
+        "pid": os.getpid(),
+        "start": start,
+        "stop": stop,
+        "frames": stop - start,
+        "busy_s": busy,
+    }
+
+
+def report(args, shard, results, wall):
+    frames = sum(r["frames"] for r in results)
+    busy = sum(r["busy_s"] for r in results)
+    summary = {
+        "stage": args.stage,
+        "shard": "{}/{}".format(*shard),
+        "node": platform.node(),
+        "workers": args.workers,
+        "threads": args.threads,
+        "frames": frames,
+        "wall_s": wall,
+        "frames_per_s": frames / wall if wall else 0.0,
+        # share of the wall time the workers spent on frames, 1 is perfect scaling
+        "efficiency": busy / (wall * len(results)) if wall and results else 0.0,
+        "per_worker": results,
+    }
+    path = args.output_path.joinpath("shard_{}_of_{}.json".format(*shard))
+    with path.open(mode="w") as f:
+        json.dump(summary, f, indent=1)
+    print(
+        "shard {}: {} frames in {:.1f} s, {:.2f} frames/s with {} workers x {} threads "
+        "(efficiency {:.0%})".format(
+            summary["shard"],
+            frames,
+            wall,
+            summary["frames_per_s"],
+            args.workers,
+            args.threads,
+            summary["efficiency"],
+        )
+    )
+    return summary
+
+
+def main(args):
+    shard = parse_shard(args.shard)
+    args.output_path.mkdir(parents=True, exist_ok=True)
+    manifest_path = (
+        Path(args.manifest_path)
+        if args.manifest_path is not None
+        else args.output_path.joinpath("manifest.json")
+    )
+    frames = open_input(args.stage, args.input_path)
+    if manifest_path.exists():
+        manifest = ShardManifest.load(manifest_path)
+        if manifest.stage != args.stage:
+            raise ValueError(
+                "{} is a manifest of the {} stage".format(manifest_path, manifest.stage)
+            )
+        manifest.check(frames)
+    else:
+        manifest = ShardManifest.from_frames(args.input_path, args.stage, frames)
+        manifest.save(manifest_path)
+
+    start, stop = manifest.shard(*shard)
+    ranges = [r for r in split_range(start, stop, args.workers) if r[0] < r[1]]
+    # spawned children read the thread count when they import torch
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(args.threads)
+
+    wall_start = perf_counter()
+    if len(ranges) <= 1:
+        results = [run_worker(args, *r, 0) for r in ranges]
+    else:
+        # spawn, a forked child would inherit the thread pools of the parent
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(len(ranges), mp_context=context) as pool:
+            futures = [
+                pool.submit(run_worker, args, r[0], r[1], worker_i)
+                for worker_i, r in enumerate(ranges)
+            ]
+            results = [future.result() for future in futures]
+    return report(args, shard, results, perf_counter() - wall_start)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.output_path = Path(args.output_path)
+    main(args)
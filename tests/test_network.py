@@ -0,0 +1,26 @@
+import pytest
+import torch
+from networks import UNet
+
+
+def train_state(checkpoint, momentum):
+    torch.manual_seed(0)
+    net = UNet(n_channels=1, n_classes=1, width=4, depth=2, checkpoint=checkpoint)
+    for module in net.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.momentum = momentum
+    net.train()
+    imgs = torch.rand(2, 1, 32, 32)
+    for _ in range(2):
+        net(imgs).sum().backward()
+    return net.state_dict()
+
+
+@pytest.mark.parametrize("momentum", [0.1, None])
+@pytest.mark.parametrize("checkpoint", ["encoder", "decoder", "all"])
+def test_checkpoint_keeps_state_dict(checkpoint, momentum):
+    expected = train_state("none", momentum)
+    state = train_state(checkpoint, momentum)
+    assert state.keys() == expected.keys()
+    for key in expected:
+        assert torch.equal(state[key], expected[key]), key
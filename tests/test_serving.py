@@ -0,0 +1,118 @@
+import queue
+import threading
+import numpy as np
+import pytest
+import torch
+from networks import UNet
+from serving import DynamicBatcher, InferenceService, ServingClient, make_server
+
+
+def blocked_batcher(max_queue):
+    """
+    batcher running a first batch of "a", each batch blocks until release is
+    released once and its items are put in calls when it starts
+    """
+    calls, release = queue.Queue(), threading.Semaphore(0)
+
+    def fn(items):
+        calls.put(items)
+        release.acquire(timeout=10)
+        return items
+
+    batcher = DynamicBatcher(fn, max_batch=2, max_wait=0, max_queue=max_queue, key=len)
+    first = batcher.submit("a")
+    assert calls.get(timeout=10) == ["a"]
+    return batcher, first, calls, release
+
+
+def test_set_aside_items_count_against_max_queue():
+    batcher, first, calls, release = blocked_batcher(max_queue=4)
+    # the next batch waits for an item of its key
+    batcher.max_wait = 10
+    try:
+        futures = [batcher.submit(item) for item in ("bb", "c", "d", "ee")]
+        release.release()
+        assert first.result(10) == "a"
+        # "c" and "d" are set aside while "bb" waits for "ee"
+        assert calls.get(timeout=10) == ["bb", "ee"]
+        assert batcher.depth() == 2
+        futures += [batcher.submit(item) for item in ("f", "g")]
+        with pytest.raises(queue.Full):
+            batcher.submit("h")
+        for _ in range(3):
+            release.release()
+        results = [future.result(10) for future in futures]
+        assert results == ["bb", "c", "d", "ee", "f", "g"]
+    finally:
+        for _ in range(4):
+            release.release()
+        batcher.close()
+
+
+def test_close_fails_waiting_items():
+    batcher, first, calls, release = blocked_batcher(max_queue=8)
+    waiting = [batcher.submit(item) for item in ("b", "cc", "d")]
+    closer = threading.Thread(target=batcher.close)
+    closer.start()
+    assert batcher.closed.wait(10)
+    release.release()
+    closer.join(10)
+    assert first.result(10) == "a"
+    for future in waiting:
+        with pytest.raises(RuntimeError):
+            future.result(10)
+    with pytest.raises(RuntimeError):
+        batcher.submit("e")
+
+
+@pytest.fixture
+def server():
+    torch.manual_seed(0)
+    net = UNet(n_channels=1, n_classes=1, width=4, depth=2)
+    service = InferenceService(net, max_batch=8, max_wait=0.5, max_queue=16)
+    # port 0 binds an ephemeral port
+    httpd = make_server(service, "127.0.0.1", 0, timeout=60)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield ServingClient("127.0.0.1", httpd.server_address[1], timeout=60)
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+
+
+def test_health(server):
+    status, body = server.health()
+    assert status == 200
+    assert body == {"status": "ok", "detect_queue": 0, "propagate_queue": 0}
+
+
+def test_concurrent_detections_are_batched(server):
+    rng = np.random.default_rng(0)
+    imgs = [(rng.random((64, 64)) * 255).astype(np.uint8) for _ in range(6)]
+    results = [None] * len(imgs)
+
+    def post(i):
+        results[i] = server.detect(imgs[i], response=True)
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(len(imgs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+
+    for status, body in results:
+        assert status == 200
+        assert body["shape"] == [64, 64]
+        assert body["response"].shape == (64, 64)
+    status, metrics = server.metrics()
+    assert status == 200
+    assert metrics["detect"]["processed"] == len(imgs)
+    assert max(int(size) for size in metrics["detect"]["batch_sizes"]) > 1
+
+
+def test_propagate_returns_label(server):
+    img = np.zeros((64, 64), np.uint8)
+    img[20:30, 20:30] = 255
+    status, body = server.propagate(img)
+    assert status == 200
+    assert body["label"].shape == (64, 64)
@@ -1,2 +1,74 @@
-from .load import *
-from .matching import local_maxim, target_peaks_gen, optimum, remove_outside_plot, show_res, gaus_filter
\ No newline at end of file
+from importlib import import_module
+
+# stamp is also a function of utils.stamp, imported here so that the submodule
+# bound on first import does not shadow it
+from .stamp import gaussian_kernel, region_radius, stamp, stamp_labels, stamp_batch
+
+# the other submodules are imported on first use of one of their names, so a script
+# only pays for torch, scipy, pulp, pandas or matplotlib when it uses them
+_names = {
+    "load": ["local_maxima", "CellImageLoad", "CellPointLoad"],
+    "frame_source": [
+        "FrameSource",
+        "DirectorySource",
+        "TiffStackSource",
+        "ConcatSource",
+        "open_frames",
+        "as_frame_source",
+    ],
+    "matching": [
+        "local_maxim",
+        "target_peaks_gen",
+        "optimum",
+        "remove_outside_plot",
+        "show_res",
+        "gaus_filter",
+    ],
+    "sweep": [
+        "peak_candidates",
+        "match_points",
+        "count_tp_fp_fn",
+        "sweep_frame",
+        "pr_table",
+    ],
+    "sharding": ["ShardManifest", "parse_shard", "split_range"],
+    "manifest": ["BuildManifest", "params_key", "file_digest"],
+    "response_cache": ["ResponseCache", "image_hash", "weight_hash", "model_key"],
+    "for_review": ["EvaluationMethods"],
+    "profiler": ["LayerProfiler", "SavedTensorMeter"],
+    "watcher": ["FolderWatcher", "ProgressState"],
+    "metrics": [
+        "METRICS",
+        "MetricsRegistry",
+        "StageMetrics",
+        "EvaluationMetrics",
+        "start_exporters",
+        "file_bytes",
+        "tree_bytes",
+    ],
+    "cell_export": [
+        "CellExporter",
+        "CellTable",
+        "cell_table",
+        "cell_polygons",
+        "label_runs",
+        "decode_runs",
+    ],
+}
+_modules = {name: module for module, names in _names.items() for name in names}
+
+__all__ = ["gaussian_kernel", "region_radius", "stamp", "stamp_labels", "stamp_batch"]
+__all__ += list(_modules)
+
+
+def __getattr__(name):
+    if name not in _modules:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    module = import_module("." + _modules[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_modules))
@@ -0,0 +1,305 @@
+from collections import OrderedDict
+from pathlib import Path
+import shutil
+import struct
+import tempfile
+import zipfile
+import numpy as np
+import cv2
+
+# columns of the file and their types. The cell columns have a row per cell, run_* a
+# row per run and point_* a row per polygon vertex, a cell's runs are
+# run_start[run_offset:run_offset + run_count] and its vertices likewise.
+COLUMNS = OrderedDict(
+    [
+        ("frame", np.int32),
+        ("label", np.int32),
+        ("y0", np.int32),
+        ("x0", np.int32),
+        ("y1", np.int32),
+        ("x1", np.int32),
+        ("area", np.int64),
+        ("run_offset", np.int64),
+        ("run_count", np.int32),
+        ("point_offset", np.int64),
+        ("point_count", np.int32),
+        ("run_start", np.int32),
+        ("run_length", np.int32),
+        ("point_x", np.int32),
+        ("point_y", np.int32),
+    ]
+)
+
+
+def label_runs(label):
+    """
+    runs of equal labels along the rows of a label image, background left out
+    :return: label, row, column and length of each run, grouped by label in raster order
+    """
+    h, w = label.shape
+    flat = np.ascontiguousarray(label).ravel()
+    change = np.ones(flat.size, dtype=bool)
+    change[1:] = flat[1:] != flat[:-1]
+    # a run ends with its row
+    change[::w] = True
+    starts = np.flatnonzero(change)
+    lengths = np.diff(np.append(starts, flat.size))
+    ids = flat[starts]
+    keep = ids != 0
+    starts, lengths, ids = starts[keep], lengths[keep], ids[keep]
+    order = np.argsort(ids, kind="stable")
+    starts = starts[order]
+    return ids[order], starts // w, starts % w, lengths[order]
+
+
+def cell_table(label):
+    """
+    per-cell columns of a label image, all labels at once
+    :return: dict of label, y0, x0, y1, x1, area, run_count and run_start, run_length.
+        run_start is the index in the cell's bounding box flattened row by row.
+    """
+    ids, rows, cols, lengths = label_runs(label)
+    if len(ids) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return {
+            name: empty
+            for name in ("label", "y0", "x0", "y1", "x1", "area", "run_count")
+            + ("run_start", "run_length")
+        }
+    first = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    y0 = np.minimum.reduceat(rows, first)
+    y1 = np.maximum.reduceat(rows, first) + 1
+    x0 = np.minimum.reduceat(cols, first)
+    x1 = np.maximum.reduceat(cols + lengths, first)
+    count = np.diff(np.append(first, len(ids)))
+    cell = np.repeat(np.arange(len(first)), count)
+    return {
+        "label": ids[first],
+        "y0": y0,
+        "x0": x0,
+        "y1": y1,
+        "x1": x1,
+        "area": np.add.reduceat(lengths, first),
+        "run_count": count,
+        "run_start": (rows - y0[cell]) * (x1 - x0)[cell] + cols - x0[cell],
+        "run_length": lengths,
+    }
+
+
+def cell_polygons(label, cells, epsilon):
+    """
+    outline of the largest fragment of each cell, simplified by cv2.approxPolyDP
+    :param cells: cell_table of label
+    :param epsilon: max distance of the outline from the simplified polygon [pixel]
+    :return: vertex count of each cell, x and y of the vertices in frame coordinates
+    """
+    counts, xs, ys = [], [], []
+    for i in range(len(cells["label"])):
+        y0, x0 = cells["y0"][i], cells["x0"][i]
+        crop = label[y0 : cells["y1"][i], x0 : cells["x1"][i]] == cells["label"][i]
+        contours = cv2.findContours(
+            crop.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+        )[-2]
+        contour = max(contours, key=cv2.contourArea)
+        polygon = cv2.approxPolyDP(contour, epsilon, True).reshape(-1, 2)
+        counts.append(len(polygon))
+        xs.append(polygon[:, 0] + x0)
+        ys.append(polygon[:, 1] + y0)
+    if not counts:
+        return np.zeros(0, np.int32), np.zeros(0, np.int32), np.zeros(0, np.int32)
+    return np.array(counts), np.concatenate(xs), np.concatenate(ys)
+
+
+def decode_runs(starts, lengths, shape):
+    """bool mask of the given shape from runs in it flattened row by row"""
+    mask = np.zeros(shape[0] * shape[1], dtype=np.int8)
+    np.add.at(mask, starts, 1)
+    ends = starts + lengths
+    np.add.at(mask, ends[ends < mask.size], -1)
+    return np.cumsum(mask).astype(bool).reshape(shape)
+
+
+def npz_memmap(path):
+    """
+    members of an uncompressed .npz as arrays memory-mapped from the file, np.load
+    ignores mmap_mode for .npz
+    :return: dict of name -> array, None when a member is compressed
+    """
+    with zipfile.ZipFile(str(path)) as archive:
+        infos = archive.infolist()
+    if any(info.compress_type != zipfile.ZIP_STORED for info in infos):
+        return None
+    arrays = {}
+    with open(str(path), "rb") as f:
+        for info in infos:
+            # the local header may have another extra field than the central one
+            f.seek(info.header_offset + 26)
+            name_size, extra_size = struct.unpack("<HH", f.read(4))
+            f.seek(name_size + extra_size, 1)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[: -len(".npy")]
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(
+                str(path),
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran else "C",
+            )
+    return arrays
+
+
+class CellExporter(object):
+    """
+    writes the cells of a sequence of label images to one columnar .npz, frame by
+    frame. The columns are appended to raw files next to the output and copied
+    into the .npz when closed, so memory does not grow with the sequence.
+    The .npz is not compressed, so CellTable can memory-map its columns.
+    """
+
+    def __init__(self, path, polygon_epsilon=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.polygon_epsilon = polygon_epsilon
+        self.tmp_path = Path(
+            tempfile.mkdtemp(prefix=".cells", dir=str(self.path.parent))
+        )
+        self.files = {
+            name: self.tmp_path.joinpath(name).open(mode="wb") for name in COLUMNS
+        }
+        self.names = []
+        self.shapes = []
+        self.n_cells = 0
+        self.n_runs = 0
+        self.n_points = 0
+
+    def write(self, name, values):
+        self.files[name].write(np.asarray(values, dtype=COLUMNS[name]).tobytes())
+
+    def add(self, label, name=None):
+        """
+        :param label: [H, W] integer label image, 0 is background
+        :param name: name of the frame
+        :return: number of cells of the frame
+        """
+        assert label.ndim == 2, "label images have one channel"
+        frame = len(self.names)
+        self.names.append(name if name is not None else "{:05d}".format(frame))
+        self.shapes.append(label.shape)
+
+        cells = cell_table(label)
+        n = len(cells["label"])
+        self.write("frame", np.full(n, frame))
+        for column in ("label", "y0", "x0", "y1", "x1", "area", "run_count"):
+            self.write(column, cells[column])
+        counts = cells["run_count"]
+        self.write("run_offset", self.n_runs + np.cumsum(counts) - counts)
+        self.write("run_start", cells["run_start"])
+        self.write("run_length", cells["run_length"])
+        self.n_runs += len(cells["run_start"])
+
+        if self.polygon_epsilon is None:
+            counts = np.zeros(n)
+            xs = ys = np.zeros(0)
+        else:
+            counts, xs, ys = cell_polygons(label, cells, self.polygon_epsilon)
+        self.write("point_offset", self.n_points + np.cumsum(counts) - counts)
+        self.write("point_count", counts)
+        self.write("point_x", xs)
+        self.write("point_y", ys)
+        self.n_points += len(xs)
+        self.n_cells += n
+        return n
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            path = self.tmp_path.joinpath(name)
+            if path.stat().st_size:
+                columns[name] = np.memmap(str(path), dtype=dtype, mode="r")
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+        shapes = np.array(self.shapes, dtype=np.int32).reshape(-1, 2)
+        np.savez(
+            str(self.path),
+            frame_name=np.array(self.names, dtype=str),
+            frame_height=shapes[:, 0],
+            frame_width=shapes[:, 1],
+            polygon_epsilon=np.float64(
+                -1 if self.polygon_epsilon is None else self.polygon_epsilon
+            ),
+            **columns
+        )
+        del columns
+        shutil.rmtree(str(self.tmp_path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CellTable(object):
+    """
+    reads a file of CellExporter, the columns are memory-mapped and a mask is
+    decoded from the runs of its cell only. Compressed files are read with np.load,
+    a column is then decompressed when first used.
+    """
+
+    def __init__(self, path):
+        self.data = npz_memmap(path)
+        if self.data is None:
+            self.data = np.load(str(path))
+        self.columns = {}
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            self.columns[name] = self.data[name]
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self["label"])
+
+    def cells(self, frame):
+        """indices of the cells of a frame"""
+        return np.flatnonzero(self["frame"] == frame)
+
+    def bbox(self, i):
+        """[y0, x0, y1, x1] of cell i"""
+        return tuple(int(self[name][i]) for name in ("y0", "x0", "y1", "x1"))
+
+    def mask(self, i):
+        """bool mask of cell i in its bounding box"""
+        y0, x0, y1, x1 = self.bbox(i)
+        offset, count = self["run_offset"][i], self["run_count"][i]
+        window = slice(offset, offset + count)
+        return decode_runs(
+            self["run_start"][window].astype(np.int64),
+            self["run_length"][window].astype(np.int64),
+            (y1 - y0, x1 - x0),
+        )
+
+    def polygon(self, i):
+        """[N, 2] x, y of the vertices of cell i"""
+        offset, count = self["point_offset"][i], self["point_count"][i]
+        window = slice(offset, offset + count)
+        return np.stack([self["point_x"][window], self["point_y"][window]], axis=1)
+
+    def frame_label(self, frame):
+        """label image of a frame rebuilt from its cells"""
+        shape = (self["frame_height"][frame], self["frame_width"][frame])
+        label = np.zeros(shape, dtype=np.int32)
+        for i in self.cells(frame):
+            y0, x0, y1, x1 = self.bbox(i)
+            label[y0:y1, x0:x1][self.mask(i)] = self["label"][i]
+        return label
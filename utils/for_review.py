@@ -1,13 +1,16 @@
 import numpy as np
-import matplotlib.pyplot as plt
 from pathlib import Path
 from .matching import remove_outside_plot, optimum, show_res
+from .frame_source import as_frame_source
 
 
 class EvaluationMethods:
     def __init__(self, pred_path, target_path, save_path, each_save=False):
         self.pred_paths = pred_path
         self.target_path = target_path
+        # lists of image paths or FrameSource
+        self.pred_frames = as_frame_source(pred_path)
+        self.target_frames = as_frame_source(target_path)
         self.save_path = save_path
         self.each_save = False
         save_path.mkdir(parents=True, exist_ok=True)
@@ -61,6 +64,8 @@ class EvaluationMethods:
             tar_x = target_mask
             pre_x = pred_mask
             if debug:
+                import matplotlib.pyplot as plt
+
                 plt.imshow(target_mask), plt.show()
                 plt.imshow(pred_mask), plt.show()
             pred_mask = pred_mask.flatten()
@@ -176,6 +181,8 @@ class EvaluationMethods:
         text = "f-measure:{} ,segmentation\ndice:{}\niou:{}\n\
                                     \ninstance-segmentation\ninstance_dice:{}\ninstance-iou:{}\n".format(f_measure, dice, iou, instance_dice, instance_iou)
         print(text)
+        import matplotlib.pyplot as plt
+
         plt.hist(self.instance_iou_list), plt.show()
         with open(self.save_path.joinpath(f"result.txt"), mode="w") as f:
             f.write(text)
@@ -0,0 +1,328 @@
+from pathlib import Path
+import numpy as np
+import cv2
+
+# tiff tag ids
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+IMAGE_DESCRIPTION = 270
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+STRIP_BYTE_COUNTS = 279
+TILE_WIDTH = 322
+PLANAR_CONFIGURATION = 284
+SAMPLE_FORMAT = 339
+
+# tiff field type -> numpy type code
+FIELD_TYPES = {
+    1: "u1",
+    2: "u1",
+    3: "u2",
+    4: "u4",
+    5: "u4",
+    6: "i1",
+    7: "u1",
+    8: "i2",
+    9: "i4",
+    10: "i4",
+    11: "f4",
+    12: "f8",
+    16: "u8",
+    17: "i8",
+    18: "u8",
+}
+# rational fields are two longs
+FIELD_COUNT = {5: 2, 10: 2}
+
+
+def imread_mode(img, flags):
+    """
+    convert a frame of a stack like cv2.imread with these flags converts a file:
+    color frames as BGR, 8 bit unless IMREAD_ANYDEPTH, gray unless IMREAD_COLOR
+    or IMREAD_ANYCOLOR
+    :param img: [H, W] gray or [H, W, 3] RGB frame
+    """
+    channels = 1 if img.ndim == 2 else img.shape[2]
+    if channels == 3:
+        img = cv2.cvtColor(np.ascontiguousarray(img), cv2.COLOR_RGB2BGR)
+    if flags < 0:
+        return img
+    if channels not in (1, 3):
+        # cv2 premultiplies alpha, which a view of the stack can not do
+        raise ValueError(
+            "frames with {} samples can only be read with flags=-1".format(channels)
+        )
+    if not flags & cv2.IMREAD_ANYDEPTH and img.dtype != np.uint8:
+        if img.dtype.kind != "u":
+            raise ValueError(
+                "{} frames can not be read as 8 bit, use flags=-1".format(img.dtype)
+            )
+        img = (img >> (8 * img.dtype.itemsize - 8)).astype(np.uint8)
+    if channels == 1:
+        if flags & cv2.IMREAD_COLOR and not flags & cv2.IMREAD_ANYCOLOR:
+            return cv2.cvtColor(img.reshape(img.shape[:2]), cv2.COLOR_GRAY2BGR)
+        return img
+    if flags & (cv2.IMREAD_COLOR | cv2.IMREAD_ANYCOLOR):
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+class FrameSource(object):
+    """
+    sequence of frames, frames[i] is one frame and frames[a:b] a stacked array.
+    root is the directory or stack file the frames come from.
+    """
+
+    root = None
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def read(self, i):
+        raise NotImplementedError
+
+    def name(self, i):
+        return "{:05d}".format(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return np.stack([self.read(i) for i in range(*index.indices(len(self)))])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame {} is out of range".format(index))
+        return self.read(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read(i)
+
+
+class DirectorySource(FrameSource):
+    """one image file per frame, decoded on access"""
+
+    def __init__(self, paths, flags=-1, root=None):
+        self.paths = [Path(path) for path in paths]
+        self.flags = flags
+        self.root = root if root is not None else (
+            self.paths[0].parent if self.paths else None
+        )
+
+    def __len__(self):
+        return len(self.paths)
+
+    def read(self, i):
+        img = cv2.imread(str(self.paths[i]), self.flags)
+        if img is None:
+            raise IOError("can not read {}".format(self.paths[i]))
+        return img
+
+    def name(self, i):
+        return self.paths[i].stem
+
+
+class TiffStackSource(FrameSource):
+    """
+    multi-page tiff opened once, uncompressed pages are memory-mapped and
+    returned as read-only views of the file without copying.
+    Equally spaced pages (the usual layout of ImageJ and tifffile stacks)
+    are also sliced without copying.
+    Frames are converted like cv2.imread converts files with flags, a copy is
+    only made when the stack is not already in that mode.
+    """
+
+    def __init__(self, path, flags=-1):
+        self.root = Path(path)
+        self.flags = flags
+        self._buffer = np.memmap(str(path), dtype=np.uint8, mode="r")
+        self._parse()
+
+    def _read(self, fmt, offset, count=1):
+        dtype = np.dtype(self._order + fmt)
+        return np.frombuffer(
+            self._buffer, dtype=dtype, count=count, offset=offset
+        )
+
+    def _parse(self):
+        order = bytes(self._buffer[:2])
+        if order not in (b"II", b"MM"):
+            raise ValueError("{} is not a tiff file".format(self.root))
+        self._order = "<" if order == b"II" else ">"
+        magic = int(self._read("u2", 2)[0])
+        if magic == 42:
+            offset_fmt, count_fmt, entry_size, inline = "u4", "u2", 12, 4
+            ifd_offset = int(self._read("u4", 4)[0])
+        elif magic == 43:
+            offset_fmt, count_fmt, entry_size, inline = "u8", "u8", 20, 8
+            ifd_offset = int(self._read("u8", 8)[0])
+        else:
+            raise ValueError("{} is not a tiff file".format(self.root))
+        count_size = np.dtype(count_fmt).itemsize
+
+        pages = []
+        while ifd_offset != 0:
+            n = int(self._read(count_fmt, ifd_offset)[0])
+            tags = {}
+            for k in range(n):
+                entry = ifd_offset + count_size + k * entry_size
+                tag = int(self._read("u2", entry)[0])
+                field = int(self._read("u2", entry + 2)[0])
+                count = int(self._read(offset_fmt, entry + 4)[0])
+                if field not in FIELD_TYPES:
+                    continue
+                fmt = FIELD_TYPES[field]
+                count *= FIELD_COUNT.get(field, 1)
+                value_offset = entry + 4 + np.dtype(offset_fmt).itemsize
+                if count * np.dtype(fmt).itemsize > inline:
+                    value_offset = int(self._read(offset_fmt, value_offset)[0])
+                tags[tag] = self._read(fmt, value_offset, count)
+            pages.append(self._page(tags))
+            ifd_offset = int(
+                self._read(offset_fmt, ifd_offset + count_size + n * entry_size)[0]
+            )
+        self.pages = self._imagej_pages(pages)
+
+        offsets = np.array([page[0] for page in self.pages])
+        nbytes = self.pages[0][1].itemsize * int(np.prod(self.pages[0][2]))
+        steps = np.diff(offsets)
+        same_layout = all(page[1:] == self.pages[0][1:] for page in self.pages)
+        if len(steps) == 0:
+            self._stride = nbytes
+        elif same_layout and (steps == steps[0]).all() and steps[0] >= nbytes:
+            self._stride = int(steps[0])
+        else:
+            self._stride = None
+
+    def _page(self, tags):
+        if int(tags.get(COMPRESSION, [1])[0]) != 1 or TILE_WIDTH in tags:
+            raise ValueError(
+                "{} has compressed or tiled pages, "
+                "only uncompressed stacks can be memory-mapped".format(self.root)
+            )
+        h = int(tags[IMAGE_LENGTH][0])
+        w = int(tags[IMAGE_WIDTH][0])
+        spp = int(tags.get(SAMPLES_PER_PIXEL, [1])[0])
+        bits = int(tags.get(BITS_PER_SAMPLE, [8])[0])
+        kind = {1: "u", 2: "i", 3: "f"}[int(tags.get(SAMPLE_FORMAT, [1])[0])]
+        dtype = np.dtype("{}{}{}".format(self._order, kind, bits // 8))
+        shape = (h, w) if spp == 1 else (h, w, spp)
+        self._planar = spp > 1 and int(tags.get(PLANAR_CONFIGURATION, [1])[0]) == 2
+        if self._planar:
+            # separate planes, read as [spp, H, W] and viewed as [H, W, spp]
+            shape = (spp, h, w)
+
+        offsets = tags[STRIP_OFFSETS].astype(np.int64)
+        counts = tags[STRIP_BYTE_COUNTS].astype(np.int64)
+        if (offsets[1:] != offsets[:-1] + counts[:-1]).any():
+            raise ValueError("{} has non contiguous strips".format(self.root))
+        description = bytes(tags.get(IMAGE_DESCRIPTION, b"")).decode(
+            "latin-1", "ignore"
+        )
+        return int(offsets[0]), dtype, shape, description
+
+    def _imagej_pages(self, pages):
+        # ImageJ writes large stacks with a single ifd and images=N in its description
+        first = pages[0]
+        for line in first[3].splitlines():
+            if line.startswith("images=") and len(pages) == 1:
+                n = int(line.split("=")[1])
+                nbytes = first[1].itemsize * int(np.prod(first[2]))
+                return [(first[0] + k * nbytes,) + first[1:3] for k in range(n)]
+        return [page[:3] for page in pages]
+
+    def __len__(self):
+        return len(self.pages)
+
+    def read(self, i):
+        offset, dtype, shape = self.pages[i]
+        img = np.ndarray(shape, dtype=dtype, buffer=self._buffer, offset=offset)
+        if not dtype.isnative:
+            # torch and cv2 need native byte order, big-endian files are copied
+            img = img.astype(dtype.newbyteorder("="))
+        if self._planar:
+            img = img.transpose(1, 2, 0)
+        return imread_mode(img, self.flags)
+
+    def _unchanged(self):
+        """whether imread_mode returns the pages of the stack as they are"""
+        _, dtype, shape = self.pages[0]
+        if len(shape) != 2:
+            return False
+        if self.flags < 0:
+            return True
+        if self.flags & cv2.IMREAD_COLOR:
+            return False
+        return dtype == np.uint8 or bool(self.flags & cv2.IMREAD_ANYDEPTH)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or self._stride is None:
+            return super().__getitem__(index)
+        if not self.pages[0][1].isnative or self._planar or not self._unchanged():
+            return super().__getitem__(index)
+        start, stop, step = index.indices(len(self))
+        n = len(range(start, stop, step))
+        offset, dtype, shape = self.pages[0]
+        if n == 0:
+            return np.zeros((0,) + shape, dtype=dtype)
+        frame_strides = np.zeros(0, dtype=dtype).itemsize * np.cumprod(
+            (1,) + shape[::-1][:-1]
+        )[::-1]
+        return np.ndarray(
+            (n,) + shape,
+            dtype=dtype,
+            buffer=self._buffer,
+            offset=offset + start * self._stride,
+            strides=(step * self._stride,) + tuple(int(x) for x in frame_strides),
+        )
+
+
+class ConcatSource(FrameSource):
+    """frames of several sources one after another, at most limit frames"""
+
+    def __init__(self, sources, limit=None):
+        self.sources = list(sources)
+        self.root = self.sources[0].root if self.sources else None
+        self.index = [
+            (source, i) for source in self.sources for i in range(len(source))
+        ][:limit]
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, i):
+        source, j = self.index[i]
+        return source.read(j)
+
+    def name(self, i):
+        source, j = self.index[i]
+        return source.name(j)
+
+
+def open_frames(path, pattern="*.png", flags=-1):
+    """
+    :param path: directory of frames or a multi-page tiff stack.
+                 <path>.tif is used when path itself does not exist.
+    :param pattern: glob of the frames in a directory
+    :param flags: cv2.imread flags, stack frames are converted to the same mode
+    :return: FrameSource
+    """
+    path = Path(path)
+    if path.is_dir():
+        return DirectorySource(sorted(path.glob(pattern)), flags, root=path)
+    if not path.exists():
+        for suffix in (".tif", ".tiff"):
+            if path.with_suffix(suffix).is_file():
+                path = path.with_suffix(suffix)
+                break
+    if path.is_file():
+        return TiffStackSource(path, flags)
+    raise FileNotFoundError("no frames at {}".format(path))
+
+
+def as_frame_source(frames, flags=-1):
+    """wrap a list of image paths, FrameSource passes through"""
+    if isinstance(frames, FrameSource):
+        return frames
+    return DirectorySource(frames, flags)
@@ -5,6 +5,8 @@ import numpy as np
 import torch
 import cv2
 from scipy.ndimage.interpolation import rotate
+from .frame_source import as_frame_source
+from .stamp import gaussian_kernel, stamp
 
 
 def local_maxima(img, threshold=100, dist=2):
@@ -22,12 +24,13 @@ def local_maxima(img, threshold=100, dist=2):
 
 class CellImageLoad(object):
     def __init__(self, ori_path, gt_path, crop_size=(256, 256)):
-        self.ori_paths = ori_path
-        self.gt_paths = gt_path
+        # lists of image paths or FrameSource
+        self.ori_frames = as_frame_source(ori_path, flags=0)
+        self.gt_frames = as_frame_source(gt_path, flags=0)
         self.crop_size = crop_size
 
     def __len__(self):
-        return len(self.ori_paths) - 1
+        return len(self.ori_frames) - 1
 
     def random_crop_param(self, shape):
         h, w = shape
@@ -37,20 +40,20 @@ class CellImageLoad(object):
         right = left + self.crop_size[1]
         return top, bottom, left, right
 
+    def target(self, data_id, top, bottom, left, right):
+        gt = self.gt_frames[data_id]
+        gt = gt / gt.max()
+        return gt[top:bottom, left:right]
+
     def __getitem__(self, data_id):
-        img_name = self.ori_paths[data_id]
-        img = cv2.imread(str(img_name), 0)[:880]
+        img = self.ori_frames[data_id][:880]
         img = img / img.max()
 
-        gt_name = self.gt_paths[data_id]
-        gt = cv2.imread(str(gt_name), 0)
-        gt = gt / gt.max()
-
         # data augumentation
         top, bottom, left, right = self.random_crop_param(img.shape)
 
         img = img[top:bottom, left:right]
-        gt = gt[top:bottom, left:right]
+        gt = self.target(data_id, top, bottom, left, right)
 
         rand_value = np.random.randint(0, 4)
         img = rotate(img, 90 * rand_value, mode="nearest")
@@ -62,3 +65,58 @@ class CellImageLoad(object):
         datas = {"image": img.unsqueeze(0), "gt": gt.unsqueeze(0)}
 
         return datas
+
+
+class CellPointLoad(CellImageLoad):
+    """
+    CellImageLoad whose target is rendered from the cell positions, only for the crop
+    and the points that reach it, as likelymapgen.py renders the whole frame. No gt
+    images are read and sigma is a training parameter. Frame i of the table is the
+    i-th ori frame.
+    """
+
+    def __init__(self, ori_path, point_path, sigma=12, crop_size=(256, 256), ksize=301):
+        """
+        :param point_path: table of frame, x, y as sample_cell_position.txt, or its array
+        :param ksize: kernel size of likelymapgen.py
+        """
+        self.ori_frames = as_frame_source(ori_path, flags=0)
+        self.crop_size = crop_size
+        self.sigma = sigma
+        self.ksize = ksize
+
+        if isinstance(point_path, np.ndarray):
+            points = point_path
+        else:
+            points = np.loadtxt(str(point_path), delimiter=",", skiprows=1, ndmin=2)
+        points = points[np.argsort(points[:, 0], kind="stable")]
+        self.points = points[:, 1:3].astype(int)
+        # rows of frame i are points[starts[i]:starts[i + 1]]
+        self.starts = np.searchsorted(
+            points[:, 0], np.arange(len(self.ori_frames) + 1), side="left"
+        )
+        kernel = gaussian_kernel(sigma, ksize, 4.0)
+        self.radius = len(kernel) // 2
+        # likelymapgen.py maps are divided by their max, the peak of a single cell
+        self.peak = kernel[self.radius] ** 2
+
+    def frame_points(self, data_id):
+        return self.points[self.starts[data_id] : self.starts[data_id + 1]]
+
+    def target(self, data_id, top, bottom, left, right):
+        points = self.frame_points(data_id)
+        r = self.radius
+        near = (
+            (points[:, 0] >= left - r)
+            & (points[:, 0] < right + r)
+            & (points[:, 1] >= top - r)
+            & (points[:, 1] < bottom + r)
+        )
+        gt = stamp(
+            points[near] - [left, top],
+            (bottom - top, right - left),
+            self.sigma,
+            self.ksize,
+            value=1,
+        )
+        return gt / self.peak
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from .frame_source import DirectorySource
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with Path(path).open(mode="rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_key(weight_key, **params):
+    """hash of the weights and the parameters an output depends on"""
+    h = hashlib.sha1(weight_key.encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def input_signature(frames, i):
+    """
+    size and mtime of a frame file, compared without reading it,
+    or the content hash of a frame of a stack
+    """
+    if isinstance(frames, DirectorySource):
+        stat = frames.paths[i].stat()
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    return {"hash": hashlib.sha1(frames[i].tobytes()).hexdigest()}
+
+
+def input_digest(frames, i):
+    if isinstance(frames, DirectorySource):
+        return file_digest(frames.paths[i])
+    return input_signature(frames, i)["hash"]
+
+
+class BuildManifest(object):
+    """
+    what each output of a stage was built from: the input signature, the content hash
+    of the input and the key of weights and parameters. Records are appended to a json
+    lines file after each frame, so a crashed run keeps the frames it finished.
+    A frame is up to date when its record has the current key, its outputs exist and
+    its input is unchanged. A changed size or mtime alone, e.g. after a copy, costs one
+    hash of the file.
+    """
+
+    def __init__(self, path, key, dry_run=False):
+        self.path = Path(path)
+        self.key = key
+        self.dry_run = dry_run
+        self.records = {}
+        self.rebuild = []
+        self.n_skipped = 0
+        if self.path.exists():
+            lines = 0
+            with self.path.open() as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # last line of an interrupted write
+                        continue
+                    self.records[record["name"]] = record
+                    lines += 1
+            if lines > 2 * len(self.records) and not dry_run:
+                self.compact()
+
+    def compact(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open(mode="w") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(str(tmp_path), str(self.path))
+
+    def reason(self, name, inputs, outputs):
+        """
+        :param inputs: list of (FrameSource, index) the output is built from
+        :param outputs: paths written for the frame
+        :return: why the frame has to be built, None when it is up to date
+        """
+        record = self.records.get(name)
+        if record is None:
+            reason = "new"
+        elif record["key"] != self.key:
+            reason = "parameters"
+        elif not all(Path(path).exists() for path in outputs):
+            reason = "output missing"
+        else:
+            signatures = [input_signature(frames, i) for frames, i in inputs]
+            if signatures == record["inputs"]:
+                reason = None
+            elif [input_digest(frames, i) for frames, i in inputs] == record["digests"]:
+                # touched or copied but the same content
+                reason = None
+                if not self.dry_run:
+                    self.append(dict(record, inputs=signatures))
+            else:
+                reason = "input"
+        if reason is None:
+            self.n_skipped += 1
+        else:
+            self.rebuild.append((name, reason))
+        return reason
+
+    def done(self, name, inputs, **info):
+        """record a built frame, info is kept for a later run that skips it"""
+        self.append(
+            {
+                "name": name,
+                "key": self.key,
+                "inputs": [input_signature(frames, i) for frames, i in inputs],
+                "digests": [input_digest(frames, i) for frames, i in inputs],
+                "info": info,
+            }
+        )
+
+    def info(self, name):
+        return self.records[name].get("info", {})
+
+    def append(self, record):
+        self.records[record["name"]] = record
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open(mode="a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def report(self):
+        """text of the frames to build and why"""
+        counts = {}
+        for _, reason in self.rebuild:
+            counts[reason] = counts.get(reason, 0) + 1
+        text = "{} frames to build, {} up to date".format(
+            len(self.rebuild), self.n_skipped
+        )
+        if counts:
+            text += " ({})".format(
+                ", ".join("{} {}".format(v, k) for k, v in sorted(counts.items()))
+            )
+        return "\n".join([text] + ["  {}: {}".format(n, r) for n, r in self.rebuild])
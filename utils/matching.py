@@ -1,14 +1,10 @@
 import numpy as np
 import math
-import pulp
-import matplotlib.pyplot as plt
 import cv2
 from skimage.feature import peak_local_max
 from pathlib import Path
-import xml.etree.ElementTree as ET
-import pandas as pd
-from PIL import Image
-from utils import local_maxima
+
+# pulp, matplotlib, xml and PIL are imported by the functions that use them
 
 
 def optimum(target, pred, dist_threshold):
@@ -18,6 +14,8 @@ def optimum(target, pred, dist_threshold):
     :param dist_threshold: distance threshold
     :return: association result
     """
+    import pulp
+
     r = 0.01
     # matrix to calculate
     c = np.zeros((0, pred.shape[0] + target.shape[0]))
@@ -69,7 +67,7 @@ def remove_outside_plot(matrix, associate_id, i, window_size, window_thresh=10):
     :return: removed outside plots
     """
     # delete edge plot
-    index = np.delete(np.arange(matrix.shape[0]), associate_id[:, i])
+    index = np.delete(np.arange(matrix.shape[0]), associate_id[:, i].astype(int))
     if index.shape[0] != 0:
         a = np.where(
             (matrix[index][:, 0] < window_thresh) | (matrix[index][:, 0] > window_size[1] - window_thresh)
@@ -87,6 +85,8 @@ def remove_outside_plot(matrix, associate_id, i, window_size, window_thresh=10):
 
 
 def show_res(img, gt, res, no_detected_id, over_detection_id, path=None):
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(3, 3), dpi=500)
     plt.imshow(img, plt.cm.gray)
     plt.plot(gt[:, 0], gt[:, 1], "y3", label="gt_annotation")
@@ -129,7 +129,7 @@ def target_peaks_gen(img):
 
 
 def gaus_filter(img, kernel_size, sigma):
-    pad_size = int(kernel_size - 1 / 2)
+    pad_size = (kernel_size - 1) // 2
     img_t = np.pad(
         img, (pad_size, pad_size), "constant"
     )  # zero padding
@@ -141,6 +141,8 @@ def gaus_filter(img, kernel_size, sigma):
 
 
 def gt_id_gen():
+    import xml.etree.ElementTree as ET
+
     f_path = Path('./image/gt_id.txt')
 
     tree = ET.parse('./image/sequence18.xml')
@@ -159,6 +161,9 @@ def gt_id_gen():
 
 
 def associate(plot_size, gts, expert, df):
+    from PIL import Image
+    from utils import local_maxima
+
     res_paths = sorted(Path('/home/kazuya/ssd/detection/output/test18/MSELoss/%s/res' % plot_size).glob('*.tif'))
     ori_paths = sorted(Path('./image/originalTiff18').glob('*.tif'))
     paths = zip(res_paths, ori_paths)
@@ -0,0 +1,304 @@
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from time import perf_counter, time
+
+
+class Counter(object):
+    kind = "counter"
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def export(self):
+        return self.value
+
+
+class Gauge(object):
+    kind = "gauge"
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def export(self):
+        return self.value
+
+
+class Summary(object):
+    """
+    count and sum of all observations and the last window of them, quantiles are
+    computed when exported so observe is an append
+    """
+
+    kind = "summary"
+    __slots__ = ("values", "count", "sum")
+    quantiles = (0.5, 0.9, 0.99)
+
+    def __init__(self, window=1024):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+
+    def export(self):
+        values = sorted(self.values)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            # nearest rank
+            "quantiles": {
+                str(q): values[min(int(q * len(values)), len(values) - 1)]
+                if values
+                else None
+                for q in self.quantiles
+            },
+        }
+
+
+class MetricsRegistry(object):
+    """
+    counters, gauges and summaries by name and labels. A metric is created on first
+    use and should be kept by the caller, updating it is an attribute change.
+    """
+
+    def __init__(self, prefix="wsispdr"):
+        self.prefix = prefix
+        self.metrics = OrderedDict()
+        self.help = {}
+        self.lock = threading.Lock()
+        self.started = time()
+
+    def get(self, cls, name, help="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(key, cls())
+                self.help.setdefault(name, help)
+        return metric
+
+    def counter(self, name, help="", **labels):
+        return self.get(Counter, name, help, **labels)
+
+    def gauge(self, name, help="", **labels):
+        return self.get(Gauge, name, help, **labels)
+
+    def summary(self, name, help="", **labels):
+        return self.get(Summary, name, help, **labels)
+
+    @contextmanager
+    def timer(self, name, help="", **labels):
+        summary = self.summary(name, help, **labels)
+        start = perf_counter()
+        yield summary
+        summary.observe(perf_counter() - start)
+
+    def snapshot(self):
+        return {
+            "time": time(),
+            "uptime_s": time() - self.started,
+            "metrics": [
+                {
+                    "name": "{}_{}".format(self.prefix, name),
+                    "type": metric.kind,
+                    "labels": dict(labels),
+                    "value": metric.export(),
+                }
+                for (name, labels), metric in list(self.metrics.items())
+            ],
+        }
+
+    def prometheus(self):
+        """text exposition format"""
+        lines = []
+        seen = set()
+        for (name, labels), metric in sorted(list(self.metrics.items())):
+            full_name = "{}_{}".format(self.prefix, name)
+            if name not in seen:
+                seen.add(name)
+                if self.help.get(name):
+                    lines.append("# HELP {} {}".format(full_name, self.help[name]))
+                lines.append("# TYPE {} {}".format(full_name, metric.kind))
+            if metric.kind != "summary":
+                lines.append(
+                    "{}{} {}".format(full_name, label_text(labels), metric.value)
+                )
+                continue
+            value = metric.export()
+            for q, v in value["quantiles"].items():
+                if v is not None:
+                    lines.append(
+                        "{}{} {}".format(
+                            full_name, label_text(labels + (("quantile", q),)), v
+                        )
+                    )
+            lines.append("{}_sum{} {}".format(full_name, label_text(labels), value["sum"]))
+            lines.append(
+                "{}_count{} {}".format(full_name, label_text(labels), value["count"])
+            )
+        return "\n".join(lines) + "\n"
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in labels) + "}"
+
+
+def file_bytes(paths):
+    """size of the files that exist"""
+    total = 0
+    for path in paths:
+        try:
+            total += os.stat(str(path)).st_size
+        except OSError:
+            pass
+    return total
+
+
+def tree_bytes(root):
+    """size of the files under root"""
+    total = 0
+    for path, _, names in os.walk(str(root)):
+        total += file_bytes(os.path.join(path, name) for name in names)
+    return total
+
+
+class StageMetrics(object):
+    """the metrics of one stage, updated once per frame"""
+
+    def __init__(self, registry, stage):
+        self.frames = registry.counter("frames_total", "frames processed", stage=stage)
+        self.pending = registry.gauge(
+            "frames_pending", "frames waiting for the stage", stage=stage
+        )
+        self.cells = registry.counter("cells_total", "cells found", stage=stage)
+        self.cells_per_frame = registry.summary(
+            "cells_per_frame", "cells found in a frame", stage=stage
+        )
+        self.seconds = registry.summary(
+            "frame_seconds", "latency of the stage for one frame", stage=stage
+        )
+        self.read_bytes = registry.counter(
+            "read_bytes_total", "bytes of the input frames", stage=stage
+        )
+        self.write_bytes = registry.counter(
+            "write_bytes_total", "bytes of the files written", stage=stage
+        )
+        self.last = registry.gauge(
+            "last_frame_timestamp_seconds", "unix time the last frame finished", stage=stage
+        )
+
+    def frame(self, seconds, read_bytes=0, write_bytes=0, cells=None, pending=None):
+        self.frames.inc()
+        self.seconds.observe(seconds)
+        self.read_bytes.inc(read_bytes)
+        self.write_bytes.inc(write_bytes)
+        if cells is not None:
+            self.cells.inc(cells)
+            self.cells_per_frame.observe(cells)
+        if pending is not None:
+            self.pending.set(pending)
+        self.last.set(time())
+
+
+class EvaluationMetrics(object):
+    """tp, fp, fn and the f-measure so far of a stage compared with the annotation"""
+
+    def __init__(self, registry, stage):
+        self.tp = registry.counter("true_positives_total", "matched cells", stage=stage)
+        self.fp = registry.counter("false_positives_total", "over detections", stage=stage)
+        self.fn = registry.counter("false_negatives_total", "missed cells", stage=stage)
+        self.f_measure = registry.gauge(
+            "f_measure", "f-measure of the frames so far", stage=stage
+        )
+
+    def update(self, tp, fp, fn):
+        self.tp.inc(tp)
+        self.fp.inc(fp)
+        self.fn.inc(fn)
+        tps, fps, fns = self.tp.value, self.fp.value, self.fn.value
+        self.f_measure.set(2 * tps / (2 * tps + fps + fns) if tps else 0.0)
+
+
+class PrometheusExporter(object):
+    """GET /metrics on host:port from a daemon thread"""
+
+    def __init__(self, registry, port, host="0.0.0.0"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SnapshotWriter(object):
+    """json snapshot of the registry every interval seconds and when closed"""
+
+    def __init__(self, registry, path, interval=10.0):
+        self.registry = registry
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open(mode="w") as f:
+            json.dump(self.registry.snapshot(), f, indent=1)
+        os.replace(str(tmp_path), str(self.path))
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        self.write()
+
+
+def start_exporters(registry, port=None, path=None, interval=10.0):
+    """:return: exporters to close at the end of the run"""
+    exporters = []
+    if port is not None:
+        exporters.append(PrometheusExporter(registry, port))
+    if path is not None:
+        exporters.append(SnapshotWriter(registry, path, interval))
+    return exporters
+
+
+# registry of the process, the stages update it unless given another one
+METRICS = MetricsRegistry()
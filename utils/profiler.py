@@ -0,0 +1,244 @@
+import json
+from collections import OrderedDict
+from functools import wraps
+from pathlib import Path
+from time import perf_counter
+import torch
+
+
+def tensors(value):
+    if isinstance(value, torch.Tensor):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [t for v in value for t in tensors(v)]
+    return []
+
+
+class LayerProfiler(object):
+    """
+    opt-in per-module timing of a network through forward hooks and tensor gradient hooks.
+    Forward spans run from the forward pre hook to the forward hook. Backward spans run
+    from the arrival of the output gradient to the completion of the input gradient,
+    so a module whose input also feeds a skip connection ends with the last consumer.
+    The patched guided ReLUs are nn.ReLU modules and are timed like any other layer.
+    On CUDA every hook synchronizes, which slows the profiled run down.
+    """
+
+    def __init__(self, model):
+        if isinstance(model, torch.jit.ScriptModule):
+            raise ValueError("serialized graphs can not be hooked, profile the *.pth model")
+        self.model = model
+        self.cuda = any(p.is_cuda for p in model.parameters())
+        self.origin = perf_counter()
+        self.handles = []
+        self.events = []
+        self.layers = OrderedDict()
+        self.passes = []
+        self._forward_start = {}
+        self._backward_start = {}
+
+    def now(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+        return (perf_counter() - self.origin) * 1e6
+
+    def memory(self):
+        return torch.cuda.memory_allocated() if self.cuda else None
+
+    def attach(self):
+        for name, module in self.model.named_modules():
+            name = name or type(module).__name__
+            self.layers[name] = {
+                "type": type(module).__name__,
+                "calls": 0,
+                "forward_us": 0.0,
+                "backward_calls": 0,
+                "backward_us": 0.0,
+                "activation_bytes": 0,
+                "memory_bytes": None,
+            }
+            self.handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+            self.handles.append(module.register_forward_hook(self._hook(name)))
+        return self
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def _event(self, name, tid, start, end, args=None):
+        self.events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "pid": 0,
+                "tid": tid,
+                "ts": start,
+                "dur": end - start,
+                "args": args or {},
+            }
+        )
+
+    def _pre_hook(self, name):
+        def hook(module, inputs):
+            self._forward_start[name] = self.now()
+            if torch.is_grad_enabled():
+                for t in tensors(inputs):
+                    if t.requires_grad:
+                        t.register_hook(self._backward_end(name))
+
+        return hook
+
+    def _hook(self, name):
+        def hook(module, inputs, output):
+            end = self.now()
+            start = self._forward_start.pop(name, end)
+            layer = self.layers[name]
+            outputs = tensors(output)
+            nbytes = sum(t.numel() * t.element_size() for t in outputs)
+            layer["calls"] += 1
+            layer["forward_us"] += end - start
+            layer["activation_bytes"] = nbytes
+            layer["memory_bytes"] = self.memory()
+            self._event(
+                name,
+                "forward",
+                start,
+                end,
+                {"activation_bytes": nbytes, "memory_bytes": layer["memory_bytes"]},
+            )
+            if torch.is_grad_enabled():
+                for t in outputs:
+                    if t.requires_grad:
+                        t.register_hook(self._backward_begin(name))
+
+        return hook
+
+    def _backward_begin(self, name):
+        def hook(grad):
+            self._backward_start[name] = self.now()
+
+        return hook
+
+    def _backward_end(self, name):
+        def hook(grad):
+            if name not in self._backward_start:
+                return
+            end = self.now()
+            start = self._backward_start.pop(name)
+            layer = self.layers[name]
+            layer["backward_calls"] += 1
+            layer["backward_us"] += end - start
+            self._event(name, "backward", start, end, {"memory_bytes": self.memory()})
+
+        return hook
+
+    def wrap(self, obj, method):
+        """
+        record each call of obj.method as one pass, e.g. the backward pass of each peak
+        """
+        function = getattr(obj, method)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if self.cuda:
+                torch.cuda.reset_peak_memory_stats()
+            start = self.now()
+            before = self.memory()
+            result = function(*args, **kwargs)
+            end = self.now()
+            record = {
+                "pass": len(self.passes),
+                "us": end - start,
+                "memory_bytes": before,
+                "peak_memory_bytes": torch.cuda.max_memory_allocated()
+                if self.cuda
+                else None,
+            }
+            self.passes.append(record)
+            self._event("{} {}".format(method, record["pass"]), "passes", start, end, record)
+            return result
+
+        setattr(obj, method, wrapper)
+        return self
+
+    def summary(self):
+        text = "{:<40} {:<16} {:>6} {:>12} {:>12} {:>12}\n".format(
+            "layer", "type", "calls", "forward ms", "backward ms", "act MB"
+        )
+        order = sorted(
+            self.layers.items(),
+            key=lambda item: -(item[1]["forward_us"] + item[1]["backward_us"]),
+        )
+        for name, layer in order:
+            if layer["calls"] == 0:
+                continue
+            text += "{:<40} {:<16} {:>6} {:>12.2f} {:>12.2f} {:>12.2f}\n".format(
+                name[-40:],
+                layer["type"][:16],
+                layer["calls"],
+                layer["forward_us"] / 1e3,
+                layer["backward_us"] / 1e3,
+                layer["activation_bytes"] / 1024 ** 2,
+            )
+        if self.passes:
+            times = [p["us"] / 1e3 for p in self.passes]
+            text += "\n{} passes, mean {:.2f} ms, max {:.2f} ms\n".format(
+                len(times), sum(times) / len(times), max(times)
+            )
+            peaks = [p["peak_memory_bytes"] for p in self.passes if p["peak_memory_bytes"]]
+            if peaks:
+                text += "peak memory per pass {:.1f} MB\n".format(max(peaks) / 1024 ** 2)
+        return text
+
+    def save(self, save_path):
+        """
+        <save_path>/trace.json opens in chrome://tracing or Perfetto,
+        <save_path>/layers.json and profile.txt hold the per-layer totals
+        """
+        save_path = Path(save_path)
+        save_path.mkdir(parents=True, exist_ok=True)
+        names = {"forward": 0, "backward": 1, "passes": 2}
+        events = [dict(event, tid=names[event["tid"]]) for event in self.events]
+        events += [
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": name}}
+            for name, tid in names.items()
+        ]
+        with save_path.joinpath("trace.json").open(mode="w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        with save_path.joinpath("layers.json").open(mode="w") as f:
+            json.dump({"layers": self.layers, "passes": self.passes}, f, indent=2)
+        text = self.summary()
+        with save_path.joinpath("profile.txt").open(mode="w") as f:
+            f.write(text)
+        return text
+
+
+class SavedTensorMeter(object):
+    """
+    bytes autograd keeps for the backward pass of the graphs built inside the context,
+    counted once per storage. Storages of exclude (e.g. the parameters) are left out.
+    """
+
+    def __init__(self, exclude=()):
+        self.exclude = {t.untyped_storage().data_ptr() for t in exclude}
+        self.storages = {}
+        self._hooks = None
+
+    def _pack(self, tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in self.exclude:
+            self.storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    def __enter__(self):
+        self._hooks = torch.autograd.graph.saved_tensors_hooks(self._pack, lambda t: t)
+        self._hooks.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self._hooks.__exit__(*exc)
+
+    @property
+    def nbytes(self):
+        return sum(self.storages.values())
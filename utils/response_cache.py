@@ -0,0 +1,154 @@
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from .load import local_maxima
+from .manifest import file_digest
+
+
+def image_hash(img):
+    """hash of the normalized network input"""
+    img = np.ascontiguousarray(img, dtype=np.float32)
+    h = hashlib.sha1(str(img.shape).encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def weight_hash(net, *params):
+    """
+    hash of the state_dict of net and params (e.g. the precision). A frozen TorchScript
+    graph keeps its weights as constants and has no state_dict, use model_key for it.
+    """
+    state_dict = net.state_dict()
+    if not state_dict:
+        raise ValueError("net has no state_dict to hash, key it by its weight file")
+    h = hashlib.sha1()
+    for key, value in sorted(state_dict.items()):
+        h.update(key.encode())
+        h.update(value.detach().cpu().numpy().tobytes())
+    h.update(repr(params).encode())
+    return h.hexdigest()
+
+
+def model_key(weight_path, fused=False, precision="fp32"):
+    """key of the responses of the network loaded from weight_path with these options"""
+    h = hashlib.sha1(file_digest(weight_path).encode())
+    h.update(repr((bool(fused), precision)).encode())
+    return h.hexdigest()
+
+
+class ResponseCache(object):
+    """
+    content-addressed store of detection responses shared by Predict and GuideCall.
+    An entry is keyed by the weight hash and the input image hash and holds
+    the uint8 response map and the peaks extracted from it.
+    The least recently used entries are removed when the cache exceeds max_bytes.
+    """
+
+    def __init__(self, cache_path, max_bytes=2 * 1024 ** 3):
+        self.cache_path = Path(cache_path)
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # path -> size, oldest first
+        self.entries = OrderedDict(
+            (path, path.stat().st_size)
+            for path in sorted(
+                self.cache_path.glob("*/*.npz"), key=lambda path: path.stat().st_mtime
+            )
+        )
+        self.total_bytes = sum(self.entries.values())
+
+    def entry_path(self, img_key, net_key):
+        return self.cache_path.joinpath(net_key[:16], img_key + ".npz")
+
+    def _load(self, path):
+        if path not in self.entries:
+            return None
+        try:
+            with np.load(str(path)) as f:
+                entry = dict(f)
+        except (OSError, ValueError):
+            self._remove(path)
+            return None
+        # mtime keeps the recency across runs
+        os.utime(str(path))
+        self.entries.move_to_end(path)
+        return entry
+
+    def get(self, img_key, net_key):
+        """
+        :return: dict of arrays or None
+        """
+        entry = self._load(self.entry_path(img_key, net_key))
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, img_key, net_key, **arrays):
+        path = self.entry_path(img_key, net_key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open(mode="wb") as f:
+            np.savez(f, **arrays)
+        os.replace(str(tmp_path), str(path))
+
+        self.total_bytes -= self.entries.pop(path, 0)
+        self.entries[path] = path.stat().st_size
+        self.total_bytes += self.entries[path]
+        self.evict()
+
+    def response(self, img, net_key, net_fn):
+        """
+        :param img: normalized input [H, W]
+        :param net_fn: called with no argument on a miss, returns the uint8 response
+        :return: uint8 response, image key, whether it was a hit
+        """
+        img_key = image_hash(img)
+        entry = self.get(img_key, net_key)
+        if entry is not None:
+            return entry["response"], img_key, True
+        response = net_fn()
+        self.put(img_key, net_key, response=response)
+        return response, img_key, False
+
+    def peaks(self, img_key, net_key, response, threshold, dist):
+        """local maxima of the response, computed once per threshold and distance"""
+        name = "peaks_{}_{}".format(threshold, dist)
+        entry = self._load(self.entry_path(img_key, net_key))
+        if entry is not None and name in entry:
+            return entry[name]
+        peaks = local_maxima(response, threshold, dist).astype(int)
+        entry = entry if entry is not None else {"response": response}
+        entry[name] = peaks
+        self.put(img_key, net_key, **entry)
+        return peaks
+
+    def _remove(self, path):
+        self.total_bytes -= self.entries.pop(path, 0)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        # keep the entry just written even if it alone exceeds the bound
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "evictions": self.evictions,
+        }
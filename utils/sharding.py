@@ -0,0 +1,91 @@
+import json
+import os
+from pathlib import Path
+
+
+def parse_shard(text):
+    """
+    :param text: "i/N", shard i (from 0) of N
+    :return: i, N
+    """
+    try:
+        index, count = (int(v) for v in text.split("/"))
+    except ValueError:
+        raise ValueError("shard must be i/N, got {!r}".format(text))
+    if not 0 <= index < count:
+        raise ValueError("shard index {} is out of 0..{}".format(index, count - 1))
+    return index, count
+
+
+def split_range(start, stop, parts):
+    """
+    contiguous [start, stop) ranges of nearly equal length, as np.array_split,
+    so that each part keeps consecutive frames of a time-lapse
+    """
+    n = stop - start
+    bounds = [start + n * i // parts for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(parts)]
+
+
+class ShardManifest(object):
+    """
+    frame list of a sharded run, fixed when the manifest is written.
+    Every node reads the same file, so shard i/N is the same frames on every machine
+    even if more frames arrive in the input later, and a frame keeps its global index
+    (its output directory) whichever shard processes it.
+    """
+
+    def __init__(self, input_path, stage, names):
+        self.input_path = str(input_path)
+        self.stage = stage
+        self.names = list(names)
+
+    @classmethod
+    def from_frames(cls, input_path, stage, frames):
+        """:param frames: FrameSource"""
+        return cls(input_path, stage, [frames.name(i) for i in range(len(frames))])
+
+    @classmethod
+    def load(cls, path):
+        with Path(path).open() as f:
+            manifest = json.load(f)
+        return cls(manifest["input_path"], manifest["stage"], manifest["names"])
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open(mode="w") as f:
+            json.dump(
+                {
+                    "input_path": self.input_path,
+                    "stage": self.stage,
+                    "names": self.names,
+                },
+                f,
+                indent=1,
+            )
+        os.replace(str(tmp_path), str(path))
+
+    def __len__(self):
+        return len(self.names)
+
+    def shard(self, index, count):
+        """:return: [start, stop) of the global frame indices of shard index/count"""
+        return split_range(0, len(self), count)[index]
+
+    def check(self, frames):
+        """raise if frames do not start with the frames of the manifest"""
+        if len(frames) < len(self):
+            raise ValueError(
+                "manifest lists {} frames, {} has {}".format(
+                    len(self), self.input_path, len(frames)
+                )
+            )
+        for i, name in enumerate(self.names):
+            if frames.name(i) != name:
+                raise ValueError(
+                    "frame {} is {} in the manifest but {} in the input".format(
+                        i, name, frames.name(i)
+                    )
+                )
@@ -0,0 +1,122 @@
+from functools import lru_cache
+import numpy as np
+import cv2
+
+
+def region_radius(sigma, value=255, thresh=0.01):
+    """
+    distance from a point at which its gaussian of peak value drops below thresh,
+    where its region ends in GuidedModel.assign_region
+    """
+    top = value / (2 * np.pi * sigma ** 2)
+    if top <= thresh:
+        return 0
+    return int(np.ceil(sigma * np.sqrt(2 * np.log(top / thresh))))
+
+
+@lru_cache(maxsize=32)
+def gaussian_kernel(sigma, ksize, truncate=None):
+    """
+    1d kernel of cv2.GaussianBlur(ksize, sigma), normalized over the full ksize
+    and cut to a radius of truncate * sigma
+    :return: read-only float64 array of odd length
+    """
+    kernel = cv2.getGaussianKernel(ksize, sigma, cv2.CV_64F)[:, 0]
+    radius = ksize // 2
+    if truncate is not None:
+        radius = min(radius, int(np.ceil(truncate * sigma)))
+    kernel = kernel[ksize // 2 - radius : ksize // 2 + radius + 1].copy()
+    kernel.flags.writeable = False
+    return kernel
+
+
+def windows(point, radius, shape):
+    """
+    :return: slices of the frame and of the kernel around point [x, y]
+    """
+    x, y = int(point[0]), int(point[1])
+    h, w = shape
+    y0, y1 = max(y - radius, 0), min(y + radius + 1, h)
+    x0, x1 = max(x - radius, 0), min(x + radius + 1, w)
+    frame = (slice(y0, y1), slice(x0, x1))
+    kernel = (
+        slice(y0 - y + radius, y1 - y + radius),
+        slice(x0 - x + radius, x1 - x + radius),
+    )
+    return frame, kernel
+
+
+def stamp(
+    points,
+    shape,
+    sigma,
+    ksize=None,
+    truncate=4.0,
+    value=255,
+    mode="max",
+    dtype=np.float64,
+):
+    """
+    render points as gaussians, the same as gaus_filter of an image with value at the
+    point, composed over the points by max or sum
+    :param points: [x, y]
+    :param ksize: kernel size of gaus_filter, 6 * sigma + 1 by default
+    :param truncate: radius of the kernel in sigma, None keeps the full ksize
+    :return: [H, W] map
+    """
+    ksize = ksize if ksize is not None else int(6 * sigma) | 1
+    kernel = gaussian_kernel(sigma, ksize, truncate)
+    radius = len(kernel) // 2
+    out = np.zeros(shape, dtype)
+    if len(points) == 0:
+        return out
+    if mode == "sum":
+        # linear, one separable convolution of the impulses
+        impulses = np.zeros(shape, np.float64)
+        for x, y in np.asarray(points, dtype=int):
+            impulses[y, x] += value
+        out[:] = cv2.sepFilter2D(
+            impulses, -1, kernel, kernel, borderType=cv2.BORDER_CONSTANT
+        )
+        return out
+    patch = value * np.outer(kernel, kernel)
+    for point in points:
+        frame, window = windows(point, radius, shape)
+        np.maximum(out[frame], patch[window], out=out[frame])
+    return out
+
+
+def stamp_labels(
+    points, shape, sigma, ksize=None, truncate=4.0, value=255, thresh=None
+):
+    """
+    index of the strongest gaussian at each pixel, as np.argmax over one gaus_filter
+    map per point (the first point wins ties)
+    :param thresh: label 0 where the max is below, the kernel then only reaches that far
+    :return: label map (point i is i + 1, 0 where no gaussian reaches), max map
+    """
+    ksize = ksize if ksize is not None else int(6 * sigma) | 1
+    if thresh is not None:
+        truncate = (region_radius(sigma, value, thresh) + 1) / sigma
+    kernel = gaussian_kernel(sigma, ksize, truncate)
+    radius = len(kernel) // 2
+    patch = value * np.outer(kernel, kernel)
+    label = np.zeros(shape, int)
+    likely = np.zeros(shape, np.float64)
+    for i, point in enumerate(points):
+        frame, window = windows(point, radius, shape)
+        better = patch[window] > likely[frame]
+        likely[frame][better] = patch[window][better]
+        label[frame][better] = i + 1
+    if thresh is not None:
+        label[likely < thresh] = 0
+    return label, likely
+
+
+def stamp_batch(points_list, shape, sigma, **kwargs):
+    """
+    one map per frame
+    :param points_list: list of points [x, y] of each frame
+    :return: [N, H, W]
+    """
+    return np.stack([stamp(points, shape, sigma, **kwargs) for points in points_list])
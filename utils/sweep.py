@@ -0,0 +1,110 @@
+import numpy as np
+import cv2
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
+from skimage.feature import peak_local_max
+
+
+def peak_candidates(img, threshold, dist):
+    """
+    local_maxima at the lowest threshold of a sweep, kept with their value so that
+    higher thresholds are a filter. peak_local_max only suppresses a peak by a higher
+    one and plateau pixels merged into one peak share their value, so filtering
+    gives the same peaks as local_maxima at the higher threshold.
+    :return: peaks [x, y] (int as local_maxima), value of each peak
+    """
+    x = peak_local_max(img, threshold_abs=threshold, min_distance=dist)
+    peak_img = np.zeros(img.shape, dtype=np.uint8)
+    peak_img[x[:, 0], x[:, 1]] = 255
+    labels, label_img, _, center = cv2.connectedComponentsWithStats(peak_img)
+    values = np.zeros(labels)
+    values[label_img[x[:, 0], x[:, 1]]] = img[x[:, 0], x[:, 1]]
+    return center[1:].astype(int), values[1:]
+
+
+def match_points(target, pred, dist_threshold, r=0.01):
+    """
+    same association as optimum, the max weight matching of exp(-r * distance) over
+    pairs closer than dist_threshold, solved by linear_sum_assignment
+    :return: association result [target index, pred index]
+    """
+    if len(target) == 0 or len(pred) == 0:
+        return np.zeros((0, 2), dtype=int)
+    dist = cdist(target[:, :2], pred[:, :2])
+    valid = dist <= dist_threshold
+    # only rows and columns with a candidate pair enter the assignment
+    rows = np.flatnonzero(valid.any(axis=1))
+    cols = np.flatnonzero(valid.any(axis=0))
+    weight = np.where(valid, np.exp(-r * dist), 0)[np.ix_(rows, cols)]
+    row, col = linear_sum_assignment(weight, maximize=True)
+    keep = weight[row, col] > 0
+    return np.stack([rows[row[keep]], cols[col[keep]]], axis=1)
+
+
+def inside(points, shape, window_thresh=10):
+    """points kept by remove_outside_plot when they are not associated"""
+    return (
+        (points[:, 0] >= window_thresh)
+        & (points[:, 0] <= shape[1] - window_thresh)
+        & (points[:, 1] >= window_thresh)
+        & (points[:, 1] <= shape[0] - window_thresh)
+    )
+
+
+def count_tp_fp_fn(target, pred, associate_id, shape, window_thresh=10):
+    """
+    tp, fp, fn as PredictFmeasure.cal_tp_fp_fn, unassociated points near the border
+    are not counted
+    """
+    tp = len(associate_id)
+    missed = np.ones(len(target), bool)
+    missed[associate_id[:, 0]] = False
+    over = np.ones(len(pred), bool)
+    over[associate_id[:, 1]] = False
+    fn = int((missed & inside(target, shape, window_thresh)).sum())
+    fp = int((over & inside(pred, shape, window_thresh)).sum())
+    return tp, fp, fn
+
+
+def sweep_frame(response, target, peak_threshs, dist_peaks, dist_thresholds):
+    """
+    :param response: detection response
+    :param target: gt peaks [x, y]
+    :return: [len(dist_peaks), len(peak_threshs), len(dist_thresholds), 3] tp, fp, fn
+    """
+    counts = np.zeros(
+        (len(dist_peaks), len(peak_threshs), len(dist_thresholds), 3), dtype=int
+    )
+    for i, dist_peak in enumerate(dist_peaks):
+        peaks, values = peak_candidates(response, min(peak_threshs), dist_peak)
+        for j, thresh in enumerate(peak_threshs):
+            pred = peaks[values > thresh]
+            for k, dist_threshold in enumerate(dist_thresholds):
+                associate_id = match_points(target, pred, dist_threshold)
+                counts[i, j, k] = count_tp_fp_fn(
+                    target, pred, associate_id, response.shape
+                )
+    return counts
+
+
+def pr_table(counts, peak_threshs, dist_peaks, dist_thresholds):
+    """
+    :param counts: summed output of sweep_frame
+    :return: rows of peak_thresh, dist_peak, dist_threshold, tp, fp, fn,
+        precision, recall, f_measure
+    """
+    rows = []
+    for i, dist_peak in enumerate(dist_peaks):
+        for j, thresh in enumerate(peak_threshs):
+            for k, dist_threshold in enumerate(dist_thresholds):
+                tp, fp, fn = counts[i, j, k]
+                precision = tp / (tp + fp) if tp else 0.0
+                recall = tp / (tp + fn) if tp else 0.0
+                f_measure = (
+                    2 * recall * precision / (recall + precision) if tp else 0.0
+                )
+                rows.append(
+                    [thresh, dist_peak, dist_threshold, tp, fp, fn]
+                    + [precision, recall, f_measure]
+                )
+    return np.array(rows)
@@ -0,0 +1,92 @@
+import json
+import os
+from pathlib import Path
+from time import monotonic, time
+
+
+class FolderWatcher(object):
+    """
+    polls a directory for new frames written by an instrument.
+    A frame is ready when its size and mtime did not change for settle seconds,
+    files renamed into the directory after writing are ready after one settle period too.
+    """
+
+    def __init__(self, path, pattern="*.png", settle=2.0, skip=()):
+        self.path = Path(path)
+        self.pattern = pattern
+        self.settle = settle
+        # names already queued or processed
+        self.done = set(skip)
+        # path -> ((size, mtime), time the signature was first seen)
+        self.seen = {}
+
+    def poll(self):
+        """
+        :return: paths ready since the last poll, sorted by name
+        """
+        now = monotonic()
+        ready = []
+        for path in sorted(self.path.glob(self.pattern)):
+            if path.name in self.done:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self.seen.get(path)
+            if previous is None or previous[0] != signature:
+                self.seen[path] = (signature, now)
+                continue
+            if stat.st_size > 0 and now - previous[1] >= self.settle:
+                ready.append(path)
+        return ready
+
+    def mark(self, path):
+        self.done.add(path.name)
+        self.seen.pop(path, None)
+
+
+class ProgressState(object):
+    """
+    frames processed by a streaming run, saved atomically to json after each frame
+    so that a restarted run skips them
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.done = {}
+        self.failed = {}
+        if self.path.exists():
+            with self.path.open() as f:
+                state = json.load(f)
+            self.done = state.get("done", {})
+            self.failed = state.get("failed", {})
+        self.queued = 0
+
+    def __contains__(self, name):
+        return name in self.done
+
+    def names(self):
+        """frames to skip, failed frames are tried again by the next run"""
+        return set(self.done)
+
+    def update(self, name, **info):
+        self.failed.pop(name, None)
+        self.done[name] = dict(info, finished=time())
+        self.save()
+
+    def fail(self, name, stage, error):
+        self.failed[name] = {"stage": stage, "error": str(error), "finished": time()}
+        self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open(mode="w") as f:
+            json.dump(
+                {"done": self.done, "failed": self.failed, "queued": self.queued},
+                f,
+                indent=1,
+            )
+        os.replace(str(tmp_path), str(self.path))
@@ -0,0 +1,297 @@
+from pathlib import Path
+from time import perf_counter, sleep, time
+import argparse
+import queue
+import subprocess
+import threading
+import cv2
+from networks import load_model
+from propagation import GuideCall
+from detection_predict import Predict
+from utils import FolderWatcher, ProgressState, ResponseCache, model_key
+from utils import METRICS, start_exporters
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(description="Process frames as they are written")
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        dest="input_path",
+        help="directory the instrument writes frames to",
+        default="./image/test/ori",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        dest="output_path",
+        help="output path",
+        default="./output/stream",
+        type=str,
+    )
+    parser.add_argument(
+        "-w",
+        "--weight_path",
+        dest="weight_path",
+        help="load weight path",
+        default="./weight/best.pth",
+    )
+    parser.add_argument(
+        "-g", "--gpu", dest="gpu", help="whether use CUDA", action="store_true"
+    )
+    parser.add_argument(
+        "--width", dest="width", help="channels of the first stage", default=64, type=int
+    )
+    parser.add_argument(
+        "--depth", dest="depth", help="number of down stages", default=4, type=int
+    )
+    parser.add_argument(
+        "--separable",
+        dest="separable",
+        help="use depthwise separable convs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fused",
+        dest="fused",
+        help="fold BatchNorm into the convs before inference",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pattern", dest="pattern", help="glob of the frames", default="*.png", type=str
+    )
+    parser.add_argument(
+        "--interval",
+        dest="interval",
+        help="seconds between two scans of the input directory",
+        default=1.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--settle",
+        dest="settle",
+        help="seconds a frame must stay unchanged before it is read",
+        default=2.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--max_pending",
+        dest="max_pending",
+        help="frames queued for processing, scanning pauses when the queue is full",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--idle_exit",
+        dest="idle_exit",
+        help="stop after this many seconds without a new frame, 0 runs until interrupted",
+        default=0,
+        type=float,
+    )
+    parser.add_argument(
+        "--detect_only",
+        dest="detect_only",
+        help="only write the detection response of each frame",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--segment_cmd",
+        dest="segment_cmd",
+        help="command run on each propagated frame, {frame} is its output directory "
+        "and {output} the output path",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--pack",
+        dest="pack",
+        help="share backward passes between peaks with disjoint receptive fields",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        help="reuse the responses of cells unchanged since the previous frame",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cache_path",
+        help="response cache shared with detection_predict.py",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--cache_size",
+        dest="cache_size",
+        help="max size of the response cache [MB]",
+        default=2048,
+        type=int,
+    )
+    parser.add_argument(
+        "--metrics_port",
+        dest="metrics_port",
+        help="serve the metrics in Prometheus text format on this port",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--metrics_path",
+        dest="metrics_path",
+        help="json snapshot of the metrics, rewritten every --metrics_interval seconds",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        dest="metrics_interval",
+        help="seconds between the json snapshots",
+        default=10,
+        type=float,
+    )
+
+    args = parser.parse_args()
+    # temporal reuse settings of propagate_main.py
+    args.move_tol = 2
+    args.image_tol = 0.02
+    args.link_dist = 10
+    args.max_age = 10
+    return args
+
+
+class StreamRunner(object):
+    """
+    scans the input directory in a thread and processes the ready frames in order.
+    The bounded queue is the backpressure: when compute falls behind, scanning waits
+    and the frames stay on disk until there is room.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.state = ProgressState(args.output_path.joinpath("progress.json"))
+        self.watcher = FolderWatcher(
+            args.input_path, args.pattern, args.settle, skip=self.state.names()
+        )
+        self.queue = queue.Queue(maxsize=args.max_pending)
+        self.queued = METRICS.gauge(
+            "stream_queue_depth", "ready frames waiting to be processed"
+        )
+        self.stop = threading.Event()
+        self.last_frame = time()
+
+        if args.detect_only:
+            self.predict = Predict(args)
+        else:
+            args.input_path = []
+            self.guide = GuideCall(args)
+
+    def scan(self):
+        while not self.stop.is_set():
+            for path in self.watcher.poll():
+                # blocks while the queue is full
+                while not self.stop.is_set():
+                    try:
+                        self.queue.put(path, timeout=self.args.interval)
+                        break
+                    except queue.Full:
+                        continue
+                self.watcher.mark(path)
+                self.last_frame = time()
+            sleep(self.args.interval)
+
+    def process(self, path):
+        info = {"captured": path.stat().st_mtime}
+        img = cv2.imread(str(path), 0)
+        if img is None:
+            self.state.fail(path.name, "read", "can not decode {}".format(path))
+            return
+        start = perf_counter()
+        if self.args.detect_only:
+            pre_img = self.predict.pred(img)
+            cv2.imwrite(
+                str(self.predict.save_pred_path.joinpath(path.stem + ".tif")), pre_img
+            )
+            info["detect_s"] = perf_counter() - start
+        else:
+            self.guide.process(len(self.state.done), img, name=path.stem)
+            info["propagate_s"] = perf_counter() - start
+            if self.args.segment_cmd is not None:
+                start = perf_counter()
+                command = self.args.segment_cmd.format(
+                    frame=self.guide.output_path_each, output=self.args.output_path
+                )
+                result = subprocess.run(command, shell=True)
+                if result.returncode != 0:
+                    self.state.fail(
+                        path.name, "segment", "exit status {}".format(result.returncode)
+                    )
+                    return
+                info["segment_s"] = perf_counter() - start
+        info["latency_s"] = time() - info["captured"]
+        self.state.queued = self.queue.qsize()
+        self.queued.set(self.state.queued)
+        self.state.update(path.name, **info)
+        print(
+            "{}: done {:.1f} s after capture, {} frames waiting".format(
+                path.name, info["latency_s"], self.state.queued
+            )
+        )
+
+    def main(self):
+        thread = threading.Thread(target=self.scan, daemon=True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    path = self.queue.get(timeout=self.args.interval)
+                except queue.Empty:
+                    idle = time() - self.last_frame
+                    if self.args.idle_exit and idle > self.args.idle_exit:
+                        break
+                    continue
+                try:
+                    self.process(path)
+                except Exception as e:
+                    self.state.fail(path.name, "process", repr(e))
+                    print("{}: failed, {!r}".format(path.name, e))
+                self.last_frame = time()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop.set()
+            thread.join()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    args.input_path = Path(args.input_path)
+    args.output_path = Path(args.output_path)
+
+    net = load_model(
+        args.weight_path,
+        fused=args.fused,
+        width=args.width,
+        depth=args.depth,
+        separable=args.separable,
+    )
+    if args.gpu:
+        net.cuda()
+    args.net = net
+    args.net_key = model_key(args.weight_path, args.fused)
+    args.cache = None
+    if args.cache_path is not None:
+        args.cache = ResponseCache(args.cache_path, args.cache_size * 1024 ** 2)
+
+    exporters = start_exporters(
+        METRICS, args.metrics_port, args.metrics_path, args.metrics_interval
+    )
+    try:
+        StreamRunner(args).main()
+    finally:
+        for exporter in exporters:
+            exporter.close()
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from importlib import import_module
+from time import perf_counter
+import argparse
+import json
+import subprocess
+import sys
+
+# subcommand: script run by it, description
+SUBCOMMANDS = OrderedDict(
+    [
+        ("mapgen", ("likelymapgen", "likelihood maps from the cell positions")),
+        ("train", ("detection_train", "train the detection network")),
+        ("detect", ("detection_predict", "detection responses and f-measure")),
+        ("propagate", ("propagate_main", "guided backpropagation from each cell")),
+        ("pipeline", ("pipeline_main", "detect, propagate and segment in memory")),
+        ("evaluate", ("detection_evaluate", "f-measure of saved responses")),
+        ("export", ("export_cells", "run-length encoded cells of label images")),
+    ]
+)
+# dependencies reported as loaded or not by --import_time
+HEAVY = ("torch", "scipy", "skimage", "matplotlib", "pandas", "pulp")
+
+
+def parse_args():
+    """
+  Parse input arguments
+  """
+    parser = argparse.ArgumentParser(
+        description="Run a stage, only the modules of that stage are imported",
+        usage="%(prog)s [-h] [--import_time] {} [options of the stage]".format(
+            "{" + ",".join(SUBCOMMANDS) + "}"
+        ),
+        epilog="\n".join(
+            "{:10s}{} ({}.py)".format(name, description, module)
+            for name, (module, description) in SUBCOMMANDS.items()
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--import_time",
+        dest="import_time",
+        help="import time of each stage in a new interpreter",
+        action="store_true",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def import_times():
+    """
+    seconds to import the script of each subcommand and the heavy dependencies it
+    loaded, each in a new interpreter so that nothing is imported already
+    """
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import {}\n"
+        "seconds = time.perf_counter() - start\n"
+        "print(json.dumps([seconds, [m for m in {} if m in sys.modules]]))\n"
+    )
+    times = OrderedDict()
+    for name, (module, _) in SUBCOMMANDS.items():
+        output = subprocess.run(
+            [sys.executable, "-c", code.format(module, list(HEAVY))],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+        times[name] = json.loads(output.decode().splitlines()[-1])
+    return times
+
+
+def run(name, argv):
+    """import the script of subcommand name and run its main with options argv"""
+    module_name = SUBCOMMANDS[name][0]
+    start = perf_counter()
+    module = import_module(module_name)
+    print(
+        "{}: imported {} in {:.2f} s".format(name, module_name, perf_counter() - start),
+        file=sys.stderr,
+    )
+    # the script parses its own options, with the subcommand in its usage
+    sys.argv = ["{} {}".format(sys.argv[0], name)] + argv
+    return module.main(module.parse_args())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        run(sys.argv[1], sys.argv[2:])
+        sys.exit(0)
+
+    args = parse_args()
+    if not args.import_time:
+        print("a stage is needed, one of {}".format(", ".join(SUBCOMMANDS)))
+        sys.exit(2)
+    for name, (seconds, loaded) in import_times().items():
+        print("{:10s}{:6.2f} s  {}".format(name, seconds, ", ".join(loaded)))